@@ -17,16 +17,42 @@
 
 from signal import *
 import asyncio
+import sys
 from experiment import Experiment, ExperimentError
+from log_pipeline import attach_queue_logging
+from station_runner import StationRunner
 import logging
 
+# SIGBREAK only exists on Windows
+STOP_SIGNALS = [SIGABRT, SIGILL, SIGINT, SIGSEGV, SIGTERM] + ([SIGBREAK] if "SIGBREAK" in globals() else [])
 
 
+def dump_metrics_on_signal(experiments: list):
+    """
+    Logs the latency histograms and counters of the experiments whenever the process receives SIGUSR1 (not available
+    on Windows, where the telemetry server's /metrics can be used instead).
+    """
+
+    if "SIGUSR1" not in globals():
+        return
+
+    def dump(signum, frame):
+        for experiment in experiments:
+            experiment.metrics.dump(experiment.logger)
+
+    signal(SIGUSR1, dump)
+
 
 def main():
+    # with station configuration files as arguments, run every station in this process
+    if len(sys.argv) > 1:
+        run_stations(sys.argv[1:])
+        return
+
     logger = logging.getLogger("experiment")
     exp = Experiment()  # note, experiment.json needs to be in the current working directory!!!
     loop = asyncio.get_event_loop()
+    dump_metrics_on_signal([exp])
     try:
         loop.run_until_complete(exp.run_experiment())
         logger.info("Experiment Finished successfully")
@@ -34,7 +60,7 @@ def main():
         def cleanup():
             raise ExperimentError("Experiment cancelled before its specified duration.")
 
-        for sig in (SIGABRT, SIGBREAK, SIGILL, SIGINT, SIGSEGV, SIGTERM):
+        for sig in STOP_SIGNALS:
             signal(sig, cleanup)
 
     except BaseException as err:
@@ -46,5 +72,26 @@ def main():
         logger.info("Experiment finished.")
 
 
+def run_stations(config_paths: list):
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    attach_queue_logging(logging.getLogger(), [console], logging.DEBUG)
+    logger = logging.getLogger("experiment")
+
+    try:
+        runner = StationRunner(config_paths)
+    except (OSError, ValueError, KeyError, ExperimentError) as err:
+        logger.fatal(f"Unable to load the station configurations: {err}")
+        return
+
+    dump_metrics_on_signal(list(runner.stations.values()))
+
+    # interrupting cancels every station, each of which puts its devices at rest before the runner returns
+    outcomes = asyncio.run(runner.run())
+
+    for station, outcome in outcomes.items():
+        logger.info(f"{station}: {outcome}")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,359 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import itertools
+import os
+import sys
+
+import numpy as np
+
+from binary_recording import MAGIC, read_recording
+
+CSV_FORMAT = "%.15g"
+
+
+def is_binary_recording(file_path: str) -> bool:
+    with open(file_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_chunks(file_path: str, chunk_rows: int = 100000, sampling_rate: float = 1.0):
+    """
+    Yields (columns, rows) for consecutive chunks of at most chunk_rows rows of a .csv data file or binary recording,
+    where rows is a 2D float array with one column per name in columns. Footer lines and the repeated headers of
+    experiments appended to the same file are skipped. Files recorded before samples were timestamped get a Time
+    column of the row number times sampling_rate.
+    """
+
+    if is_binary_recording(file_path):
+        header, data = read_recording(file_path)
+        columns = tuple(header["columns"])
+
+        for start in range(0, len(data), chunk_rows):
+            chunk = data[start:start + chunk_rows]
+            yield columns, chunk.view("<f8").reshape(len(chunk), len(columns))
+
+        return
+
+    columns = None
+    row_count = 0
+
+    with open(file_path) as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+
+            if len(lines) == 0:
+                break
+
+            data_lines = []
+
+            for line in lines:
+                # comments start with "#", headers with a capitalised column name and rows with a number or nan
+                if line.startswith("#") or len(line.strip()) == 0:
+                    continue
+
+                if line[0].isupper():
+                    header = tuple(name.strip() for name in line.split(","))
+
+                    if columns is not None and header != columns:
+                        raise ValueError(f"{file_path} changes its columns from {columns} to {header}.")
+
+                    columns = header
+                    continue
+
+                data_lines.append(line)
+
+            if len(data_lines) == 0:
+                continue
+
+            if columns is None:
+                raise ValueError(f"{file_path} does not start with a header.")
+
+            rows = np.loadtxt(data_lines, delimiter=",", ndmin=2)
+
+            if "Time" not in columns:
+                times = (np.arange(len(rows)) + row_count) * sampling_rate
+                row_count += len(rows)
+                yield ("Time",) + columns, np.column_stack((times, rows))
+            else:
+                yield columns, rows
+
+
+def window_statistics(chunks, window: float):
+    """
+    Yields the count, mean, standard deviation, minimum and maximum of every channel per window of window seconds,
+    one window at a time, accumulated over the chunks from read_chunks. Gap markers (rows of nan) are left out. The
+    variance is accumulated as sums of squared deviations from the mean of each chunk's part of a window, merged with
+    the parallel algorithm of Chan et al., as sums of squares lose every digit of small variations of large values.
+    """
+
+    origin = None
+    carried = None
+
+    for columns, rows in chunks:
+        rows = rows[~np.isnan(rows[:, 1:]).any(axis=1)]
+
+        if len(rows) == 0:
+            continue
+
+        if origin is None:
+            origin = rows[0, 0]
+
+        values = rows[:, 1:]
+        ids = np.floor((rows[:, 0] - origin) / window).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        counts = np.diff(np.append(starts, len(rows)))
+        means = np.add.reduceat(values, starts, axis=0) / counts[:, None]
+        deviations = values - np.repeat(means, counts, axis=0)
+        groups = [ids[starts],
+                  counts,
+                  means,
+                  np.add.reduceat(deviations * deviations, starts, axis=0),
+                  np.minimum.reduceat(values, starts, axis=0),
+                  np.maximum.reduceat(values, starts, axis=0)]
+
+        for group in zip(*groups):
+            if carried is not None and carried[0] == group[0]:
+                count = carried[1] + group[1]
+                delta = group[2] - carried[2]
+                carried = (group[0],
+                           count,
+                           carried[2] + delta * group[1] / count,
+                           carried[3] + group[3] + delta * delta * carried[1] * group[1] / count,
+                           np.minimum(carried[4], group[4]),
+                           np.maximum(carried[5], group[5]))
+                continue
+
+            if carried is not None:
+                yield _window_row(columns, origin, window, carried)
+
+            carried = group
+
+    if carried is not None:
+        yield _window_row(columns, origin, window, carried)
+
+
+def _window_row(columns: tuple, origin: float, window: float, group: tuple) -> dict:
+    window_id, count, means, squared_deviations, minimums, maximums = group
+    deviations = np.sqrt(squared_deviations / max(count - 1, 1))
+
+    row = {"Window start": origin + window_id * window, "Samples": count}
+
+    for i, name in enumerate(columns[1:]):
+        row[f"{name} mean"] = means[i]
+        row[f"{name} standard deviation"] = deviations[i]
+        row[f"{name} minimum"] = minimums[i]
+        row[f"{name} maximum"] = maximums[i]
+
+    return row
+
+
+def minmax_downsample(chunks, bucket: float, channel: str = "Voltage"):
+    """
+    Yields (columns, rows) holding, for every bucket of bucket seconds, the rows where channel is at its minimum and
+    maximum, in time order. The extremes of the channel are kept exactly, so its shape survives in a plot with a
+    fraction of the rows.
+    """
+
+    origin = None
+    carried = None
+
+    for columns, rows in chunks:
+        index = columns.index(channel)
+        rows = rows[~np.isnan(rows[:, index])]
+
+        if len(rows) == 0:
+            continue
+
+        if origin is None:
+            origin = rows[0, 0]
+
+        values = rows[:, index]
+        ids = np.floor((rows[:, 0] - origin) / bucket).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(rows))))
+
+        # first row of each bucket holding the bucket's minimum (maximum)
+        low = starts + _first_in_group(values == np.minimum.reduceat(values, starts)[group], group)
+        high = starts + _first_in_group(values == np.maximum.reduceat(values, starts)[group], group)
+
+        for bucket_id, low_row, high_row in zip(ids[starts], rows[low], rows[high]):
+            if carried is not None and carried[0] == bucket_id:
+                low_row = low_row if low_row[index] < carried[1][index] else carried[1]
+                high_row = high_row if high_row[index] > carried[2][index] else carried[2]
+            elif carried is not None:
+                yield columns, _extremes(carried)
+
+            carried = (bucket_id, low_row, high_row)
+
+    if carried is not None:
+        yield columns, _extremes(carried)
+
+
+def _first_in_group(mask: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """
+    Returns, for each group, the offset from the start of the group of the first position where mask is True.
+    """
+
+    positions = np.flatnonzero(mask)
+    _, first = np.unique(group[positions], return_index=True)
+    starts = np.searchsorted(group, np.arange(group[-1] + 1))
+
+    return positions[first] - starts
+
+
+def _extremes(carried: tuple) -> np.ndarray:
+    _, low_row, high_row = carried
+
+    if low_row[0] == high_row[0]:
+        return low_row[np.newaxis]
+
+    return np.array(sorted((low_row, high_row), key=lambda row: row[0]))
+
+
+def lttb(rows: np.ndarray, points: int, index: int) -> np.ndarray:
+    """
+    Returns points rows of rows chosen with the Largest-Triangle-Three-Buckets algorithm on the Time column and the
+    column at index, which keeps the visual shape of that column.
+    """
+
+    if points >= len(rows) or points < 3:
+        return rows
+
+    x = rows[:, 0]
+    y = rows[:, index]
+    edges = np.linspace(1, len(rows) - 1, points - 1).astype(np.int64)
+    selected = [0]
+
+    for i in range(points - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+
+        if i + 2 < len(edges):
+            next_x, next_y = x[edges[i + 1]:edges[i + 2]].mean(), y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        previous = selected[-1]
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        selected.append(start + int(np.argmax(areas)))
+
+    selected.append(len(rows) - 1)
+
+    return rows[selected]
+
+
+def data_span(file_path: str, chunk_rows: int = 100000, sampling_rate: float = 1.0) -> tuple:
+    """
+    Returns the (first, last) time of a data file. Only reads the time column of a binary recording and the ends of a
+    .csv file that has a Time column, otherwise the file is read once.
+    """
+
+    if is_binary_recording(file_path):
+        _, data = read_recording(file_path)
+        return data["Time"][0], data["Time"][-1]
+
+    first = last = None
+
+    with open(file_path) as f:
+        header = f.readline()
+
+        if "Time" in header:
+            for line in f:
+                if line[:1].isdigit():
+                    first = float(line.split(",")[0])
+                    break
+
+            f.seek(max(0, os.path.getsize(file_path) - 4096))
+
+            for line in f.read().splitlines():
+                if line[:1].isdigit():
+                    last = float(line.split(",")[0])
+
+            return first, last
+
+    for _, rows in read_chunks(file_path, chunk_rows, sampling_rate):
+        first = rows[0, 0] if first is None else first
+        last = rows[-1, 0]
+
+    return first, last
+
+
+def write_csv(file_path: str, columns: tuple, row_chunks) -> None:
+    with open(file_path, "w") as f:
+        f.write(", ".join(columns))
+        f.write("\n")
+
+        for rows in row_chunks:
+            np.savetxt(f, rows, fmt=CSV_FORMAT, delimiter=", ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarises and downsamples experiment data files of any size.")
+    parser.add_argument("data", help="path of the .csv data file or binary recording")
+    parser.add_argument("--window", type=float, default=3600, help="length of the statistics windows in seconds")
+    parser.add_argument("--stats", help="write the window statistics to this .csv file instead of the console")
+    parser.add_argument("--downsample", help="write a downsampled copy of the data to this .csv file for plotting")
+    parser.add_argument("--method", choices=("minmax", "lttb"), default="minmax", help="downsampling method")
+    parser.add_argument("--points", type=int, default=2000, help="approximate number of downsampled rows")
+    parser.add_argument("--channel", default="Voltage", help="channel whose shape the downsampling preserves")
+    parser.add_argument("--sampling-rate", type=float, default=1.0,
+                        help="sampling rate of files recorded without a Time column, in seconds")
+    parser.add_argument("--chunk-rows", type=int, default=100000, help="rows parsed at a time")
+    args = parser.parse_args()
+
+    def chunks():
+        return read_chunks(args.data, args.chunk_rows, args.sampling_rate)
+
+    statistics = window_statistics(chunks(), args.window)
+    first = next(statistics, None)
+
+    if first is None:
+        print(f"{args.data} holds no samples.")
+        return
+
+    stats_file = open(args.stats, "w") if args.stats else sys.stdout
+
+    try:
+        stats_file.write(", ".join(first) + "\n")
+
+        for row in itertools.chain((first,), statistics):
+            stats_file.write(", ".join(CSV_FORMAT % value for value in row.values()) + "\n")
+    finally:
+        if args.stats:
+            stats_file.close()
+
+    if args.downsample is None:
+        return
+
+    first_time, last_time = data_span(args.data, args.chunk_rows, args.sampling_rate)
+    columns = next(chunks())[0]
+
+    # lttb chooses its rows among the extremes of finer buckets, which keeps memory bounded by the number of points
+    buckets = args.points // 2 if args.method == "minmax" else args.points * 4
+    bucket = max((last_time - first_time) / max(buckets, 1), 1e-9)
+    extremes = (rows for _, rows in minmax_downsample(chunks(), bucket, args.channel))
+
+    if args.method == "lttb":
+        extremes = [lttb(np.concatenate(list(extremes)), args.points, columns.index(args.channel))]
+
+    write_csv(args.downsample, columns, extremes)
+
+
+if __name__ == "__main__":
+    main()
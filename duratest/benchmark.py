@@ -0,0 +1,206 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from data_writer import DataWriter
+from experiment import COLUMNS, Experiment
+from instrumentation import LatencyHistogram
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak resident memory is then left out
+    resource = None
+
+BENCHMARK_VERSION = 1
+
+
+def benchmark_config(directory: str, args: argparse.Namespace) -> dict:
+    """
+    Returns an experiment.json for simulated devices with the latency given on the command line and a fixed seed, so
+    runs with the same arguments are comparable. Noise and drift are kept small enough to never trip a limit.
+    """
+
+    simulation = {"latency": args.latency, "latency-jitter": args.latency_jitter, "noise": 0.0005, "drift": 0.0,
+                  "time-scale": 1, "reset-time": 0, "seed": args.seed}
+
+    return {
+        "sampling-rate": args.sampling_rate,
+        "duration": args.duration,
+        "data-save-path": os.path.join(directory, "benchmark.csv"),
+        "log-save-path": os.path.join(directory, "benchmark.log"),
+        "log-level": "WARNING",
+        "Power-Supply-options": {"com-port": "simulated", "current-setpoint": 0.5, "maximum-voltage": 2.2,
+                                 "minimum-voltage": 1.5, "voltage-threshold": 1.1, "max-dV": 1,
+                                 "simulation": dict(simulation)},
+        "Temperature-Controller-options": {"com-port": "simulated", "temperature-setpoint": 22,
+                                           "max-temperature": 150, "simulation": dict(simulation)},
+        "Pump-Controller-options": {"serial-number": "simulated", "simulation": dict(simulation)},
+    }
+
+
+class Measurement:
+    """
+    Measures the wall clock time, CPU time (of every thread of the process, so the writer thread is included) and
+    per-iteration latency of a benchmark, and the peak memory allocated by Python while it runs if tracing is on.
+    """
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.latencies = LatencyHistogram()
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = time.perf_counter() - self.started
+        self.cpu_time = time.process_time() - self.cpu_started
+        self.peak_memory = None
+
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    async def iterate(self, count: int, step) -> None:
+        """
+        Awaits step() count times, recording the latency of each.
+        """
+
+        for _ in range(count):
+            started = time.perf_counter()
+            await step()
+            self.latencies.record(time.perf_counter() - started)
+
+    def result(self, count: int) -> dict:
+        return {
+            "iterations": count,
+            "wall-time": self.wall_time,
+            "per-second": count / self.wall_time if self.wall_time else 0.0,
+            "latency": self.latencies.summary(),
+            "cpu-time-per-iteration": self.cpu_time / count if count else 0.0,
+            "peak-python-memory": self.peak_memory,
+        }
+
+
+async def run_benchmarks(experiment: Experiment, args: argparse.Namespace) -> dict:
+    results = {}
+
+    async def measure(name: str, step, count: int = args.samples):
+        with Measurement(args.trace_memory) as measurement:
+            await measurement.iterate(count, step)
+
+        results[name] = measurement.result(count)
+
+    await experiment._start_experiment()
+
+    # a single request to the power supply, through the lock, the framing and the reply reader
+    await measure("send-command", lambda: experiment.bk_operator._send_command("meas:curr?;:meas:volt?"))
+
+    # the readings of one sample from every device, requested concurrently
+    await measure("get-readings", experiment._get_readings)
+
+    # a complete sample: readings, limits, analytics and queueing the row to the data file
+    await measure("process-readings", experiment._process_readings)
+
+    # queueing rows to the .csv writer, and draining its queue when it is closed
+    writer = DataWriter(experiment.save_path + ".rows", COLUMNS, experiment.flush_rows, experiment.flush_interval,
+                        experiment.fsync_interval, max_queued_rows=args.rows)
+    writer.open()
+    row = (time.time(), 0.5, 1.7, 22.0)
+
+    async def write_row():
+        writer.write_row(row)
+
+    await measure("write-row", write_row, args.rows)
+
+    with Measurement(args.trace_memory) as measurement:
+        await writer.close()
+
+    results["close-writer"] = {"rows": args.rows, "wall-time": measurement.wall_time}
+
+    # the scheduled sampling loop at the sampling rate, for the duration
+    with Measurement(args.trace_memory) as measurement:
+        await experiment._sample()
+
+    scheduled = measurement.result(experiment.scheduler.tick_count)
+    scheduled["latency"] = experiment.metrics.latencies["Sample total"].summary()
+    scheduled["scheduler"] = experiment.scheduler.stats()
+    scheduled["jitter"] = experiment.metrics.latencies["Sample jitter"].summary()
+    results["scheduled-run"] = scheduled
+
+    await experiment.stop_experiment()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the acquisition loop against simulated devices and writes "
+                                                 "the results as JSON.")
+    parser.add_argument("--samples", type=int, default=1000, help="iterations of each device benchmark")
+    parser.add_argument("--rows", type=int, default=100000, help="rows written by the writer benchmark")
+    parser.add_argument("--latency", type=float, default=0.001, help="reply latency of the simulated devices (s)")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="random extra latency of replies (s)")
+    parser.add_argument("--sampling-rate", type=float, default=0.01, help="period of the scheduled run (s)")
+    parser.add_argument("--duration", type=float, default=10, help="duration of the scheduled run (s)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the simulated devices")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="trace the peak memory allocated by Python (slows the benchmarks down)")
+    parser.add_argument("--output", help="path of the JSON results, printed if not given")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "experiment.json")
+
+        with open(config_path, "w") as f:
+            json.dump(benchmark_config(directory, args), f)
+
+        experiment = Experiment(config_path, "benchmark")
+        results = asyncio.run(run_benchmarks(experiment, args))
+
+    report = {
+        "benchmark-version": BENCHMARK_VERSION,
+        "time": time.time(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "arguments": vars(args),
+        "results": results,
+        # kilobytes on Linux, bytes on macOS
+        "peak-resident-memory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+    }
+
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
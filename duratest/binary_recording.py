@@ -0,0 +1,157 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import json
+import logging
+import os
+import struct
+import time
+
+from data_writer import DataWriter
+
+# file layout: MAGIC, then version and header length as little-endian uint32, then the JSON header padded with spaces so
+# that the records start on an 8 byte boundary, then fixed-width records of one little-endian float64 per column
+MAGIC = b"DURATEST"
+VERSION = 1
+_PREAMBLE = struct.Struct("<II")
+
+
+class BinaryDataWriter(DataWriter):
+    """
+    Appends rows to a compact binary recording of fixed-width float64 columns. The header carries the column names, the
+    time the recording started and the experiment.json parameters. Appending to an existing recording is allowed as
+    long as the columns match; a partial record left behind by a crash is dropped first.
+    """
+
+    def __init__(self, save_path: str, columns: tuple, parameters: dict, flush_rows: int = 60,
+                 flush_interval: float = 5.0, fsync_interval: float = 60.0, logger: logging.Logger = None):
+        super().__init__(save_path, columns, flush_rows, flush_interval, fsync_interval, logger)
+        self.parameters = parameters
+        self.record = struct.Struct(f"<{len(columns)}d")
+
+    def _open_file(self):
+        if _path_has_data(self.save_path):
+            header, data_offset = read_header(self.save_path)
+
+            if tuple(header["columns"]) != tuple(self.columns):
+                raise IOError(f"{self.save_path} was recorded with columns {header['columns']}, not {self.columns}.")
+
+            size = os.path.getsize(self.save_path)
+            partial = (size - data_offset) % self.record.size
+
+            if partial:
+                self.logger.warning(f"Dropping a partial record of {partial} bytes at the end of {self.save_path}")
+                os.truncate(self.save_path, size - partial)
+
+        return open(self.save_path, "ab")
+
+    def _write_header(self) -> None:
+        if self.file.tell() > 0:
+            return
+
+        header = json.dumps({"columns": list(self.columns),
+                             "start-time": time.time(),
+                             "parameters": self.parameters}).encode("utf-8")
+        header += b" " * (-(len(MAGIC) + _PREAMBLE.size + len(header)) % 8)
+        self.file.write(MAGIC + _PREAMBLE.pack(VERSION, len(header)) + header)
+        self.file.flush()
+
+    def _encode_row(self, row: tuple) -> bytes:
+        return self.record.pack(*row)
+
+    def _write_footer(self, footer: dict) -> None:
+        # records can still be appended to the recording later, so the footer is kept next to it instead
+        with open(f"{self.save_path}.summary.json", "w") as f:
+            json.dump(footer, f, indent=4)
+
+
+def _path_has_data(file_path: str) -> bool:
+    return os.path.exists(file_path) and os.path.getsize(file_path) > 0
+
+
+def read_header(file_path: str) -> tuple:
+    """
+    Returns (header, data_offset) of a binary recording, where header is the decoded JSON header and data_offset is the
+    position of the first record in the file. Raises an IOError if the file is not a binary recording.
+    """
+
+    with open(file_path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError(f"{file_path} is not a binary recording.")
+
+        version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+
+        if version != VERSION:
+            raise IOError(f"{file_path} has unsupported binary recording version {version}.")
+
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+    return header, len(MAGIC) + _PREAMBLE.size + header_length
+
+
+def read_recording(file_path: str) -> tuple:
+    """
+    Memory-maps a binary recording and returns (header, data). data is a read-only NumPy structured array with one field
+    per column, so data["Voltage"] is a zero-copy view of that column. Requires NumPy.
+    """
+
+    import numpy as np
+
+    header, data_offset = read_header(file_path)
+    dtype = np.dtype([(column, "<f8") for column in header["columns"]])
+    rows = (os.path.getsize(file_path) - data_offset) // dtype.itemsize
+
+    if rows == 0:
+        return header, np.empty(0, dtype=dtype)
+
+    return header, np.memmap(file_path, dtype=dtype, mode="r", offset=data_offset, shape=(rows,))
+
+
+def export_csv(file_path: str, csv_path: str, chunk_rows: int = 100000) -> int:
+    """
+    Converts a binary recording into a .csv file in the same format the experiment writes, one chunk at a time so that
+    memory use does not depend on the length of the recording. Returns the number of rows written.
+    """
+
+    import numpy as np
+
+    header, data = read_recording(file_path)
+
+    with open(csv_path, "w") as f:
+        f.write(", ".join(header["columns"]))
+        f.write("\n")
+
+        for start in range(0, len(data), chunk_rows):
+            chunk = data[start:start + chunk_rows]
+            np.savetxt(f, chunk.view("<f8").reshape(len(chunk), -1), fmt="%.15g", delimiter=", ")
+
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts a binary experiment recording into a .csv file.")
+    parser.add_argument("recording", help="path of the binary recording")
+    parser.add_argument("csv", help="path of the .csv file to write")
+    args = parser.parse_args()
+
+    rows = export_csv(args.recording, args.csv)
+    print(f"Wrote {rows} rows to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
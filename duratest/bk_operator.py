@@ -20,23 +20,27 @@ import time
 
 
 class BKOperator(SerialCommunicator):
-    def __init__(self, com_port: str):
-        super().__init__(com_port, "BK Power Supply")
-        try:
-            self.ser = serial.Serial(port=com_port,
-                                     baudrate=4800,
-                                     bytesize=serial.EIGHTBITS,
-                                     timeout=1,
-                                     parity=serial.PARITY_NONE,
-                                     stopbits=serial.STOPBITS_ONE)
-        except IOError as err:
-            self.logger.error(f"Error opening serial communication with {self.name}")
-            raise err
+    def __init__(self, com_port: str, measure_all: bool = False):
+        super().__init__(com_port,
+                         "BK Power Supply",
+                         baudrate=4800,
+                         bytesize=serial.EIGHTBITS,
+                         timeout=1,
+                         parity=serial.PARITY_NONE,
+                         stopbits=serial.STOPBITS_ONE)
+        self._open_serial()
+
+        # when set, combined measurements use the single meas:all? query instead of a compound query
+        self.measure_all = measure_all
 
-    async def verify_connection(self) -> bool:
+        # (points, interval, monotonic start time) of the burst captured by the Power Supply, None until one is started
+        self.burst = None
+
+    async def verify_connection(self, ready_timeout: float = 5.0) -> bool:
         """
-        Resets the state of the BK Power Supply, waits 5 seconds for the device to reboot, then requests the
-        name of the device. If no name response is received, then the function returns False, otherwise True.
+        Resets the state of the BK Power Supply, waits up to ready_timeout seconds for the device to report that the
+        reset is complete, then requests the name of the device. If the device does not become ready or no name
+        response is received, then the function returns False, otherwise True.
         """
 
         if not self.ser.is_open:
@@ -46,7 +50,11 @@ class BKOperator(SerialCommunicator):
         await self._send_command("syst:rem")
         await self._send_command("*CLS")
         await self._send_command("*RST")
-        time.sleep(3)
+
+        if not await self.wait_until_ready(ready_timeout):
+            self.logger.error(f"BK Power Supply did not become ready within {ready_timeout} s of being reset.")
+            return False
+
         name = await self._send_command("*IDN?")
 
         if len(name) == 0:
@@ -54,6 +62,24 @@ class BKOperator(SerialCommunicator):
 
         return True
 
+    async def wait_until_ready(self, timeout: float = 5.0, interval: float = 0.1) -> bool:
+        """
+        Polls the operation complete query (*OPC?) every interval seconds until the Power Supply reports that every
+        pending operation has finished. Returns False if it has not done so within timeout seconds. While the device is
+        rebooting it does not reply, so a poll may take up to the port timeout.
+        """
+
+        deadline = time.monotonic() + timeout
+
+        while True:
+            if await self._send_command("*OPC?") == "1":
+                return True
+
+            if time.monotonic() >= deadline:
+                return False
+
+            await asyncio.sleep(interval)
+
     async def set_current(self, current: float) -> bool:
         """
         Instructs the BK power supply to set the current to the input argument, given in Amperes. Returns True if the
@@ -72,9 +98,12 @@ class BKOperator(SerialCommunicator):
     async def get_current(self) -> float:
         """
         Returns the current reading from the BK power supply in Amperes. Raises an IOError if the Power Supply fails to
-        give a reading, or if the reading is not a number.
+        give a reading, or if the reading is not a number, after retrying.
         """
 
+        return await self._with_retries(self._read_current)
+
+    async def _read_current(self) -> float:
         response = await self._send_command("meas:curr?")
 
         if len(response) == 0:
@@ -89,9 +118,12 @@ class BKOperator(SerialCommunicator):
     async def get_voltage(self) -> float:
         """
         Returns the voltage reading from the BK power supply in Voltages. Raises an IOError if the Power Supply fails to
-        give a reading, or if the reading is not a number.
+        give a reading, or if the reading is not a number, after retrying.
         """
 
+        return await self._with_retries(self._read_voltage)
+
+    async def _read_voltage(self) -> float:
         response = await self._send_command("meas:volt?")
 
         if len(response) == 0:
@@ -103,6 +135,103 @@ class BKOperator(SerialCommunicator):
             self.logger.error(f"Error converting voltage: {response} from Power Supply to string.")
             raise IOError("Error requesting voltage from Power Supply. The reading was not a number.")
 
+    async def get_measurements(self, include_power: bool = False) -> tuple:
+        """
+        Returns (current, voltage), or (current, voltage, power) if include_power is True, from the BK power supply in
+        Amperes, Volts and Watts. Every value is requested in a single SCPI transaction, so the readings are taken at
+        the same moment for the cost of one round trip. Raises an IOError if the Power Supply fails to give a reading,
+        or if a reading is not a number, after retrying.
+        """
+
+        return await self._with_retries(self._read_measurements, include_power)
+
+    async def _read_measurements(self, include_power: bool) -> tuple:
+        if self.measure_all:
+            response = await self._send_command("meas:all?")
+            count = 3 if include_power else 2
+        else:
+            queries = ["meas:curr?", "meas:volt?"] + (["meas:pow?"] if include_power else [])
+            response = await self._send_command(";:".join(queries))
+            count = len(queries)
+
+        if len(response) == 0:
+            raise IOError("Error requesting measurements from Power Supply. There was no response.")
+
+        # replies to compound queries are separated by semicolons, meas:all? separates its values with commas
+        values = response.replace(";", ",").split(",")
+
+        try:
+            values = [float(value) for value in values]
+        except ValueError as err:
+            self.logger.error(f"Error converting measurements: {response} from Power Supply to string.")
+            raise IOError("Error requesting measurements from Power Supply. A reading was not a number.")
+
+        if len(values) < count:
+            raise IOError(f"Error requesting measurements from Power Supply. Expected {count} readings, got {response}")
+
+        if self.measure_all:
+            # TODO: Confirm in testing, meas:all? is documented to reply with voltage, current, power
+            values[0], values[1] = values[1], values[0]
+
+        return tuple(values[:count])
+
+    async def start_burst(self, points: int, interval: float) -> float:
+        """
+        Arms the Power Supply to capture points readings of current and voltage, one every interval seconds, into its
+        internal buffer and starts the capture. The Power Supply samples at its own rate, far faster than the readings
+        can be polled over the serial port, so transients such as a current step can be recorded. Returns the monotonic
+        time the capture started at, the readings are fetched with fetch_burst.
+        """
+
+        # TODO: Confirm in testing, the acquisition commands are assumed from the data logging section of the manual
+        await self._send_command(f"acq:poin {points}")
+        await self._send_command(f"acq:tint {interval}")
+        await self._send_command("acq:init")
+        started = time.monotonic()
+        self.burst = (points, interval, started)
+
+        return started
+
+    async def fetch_burst(self, ready_timeout: float = 5.0) -> list:
+        """
+        Waits for the capture started by start_burst to complete, then fetches the readings in one bulk transfer per
+        channel. Returns a list of (monotonic time, current, voltage) tuples. Raises an IOError if the capture does not
+        complete within ready_timeout seconds of its expected end, or if the readings can not be fetched.
+        """
+
+        if self.burst is None:
+            raise IOError("No burst has been started on the Power Supply.")
+
+        points, interval, started = self.burst
+        self.burst = None
+        remaining = started + points * interval - time.monotonic()
+
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+        if not await self.wait_until_ready(ready_timeout):
+            raise IOError("The Power Supply did not complete the burst capture.")
+
+        # TODO: Confirm in testing, the fetch queries are assumed to reply with comma separated values
+        currents = await self._with_retries(self._fetch_array, "fetc:curr:arr?", points)
+        voltages = await self._with_retries(self._fetch_array, "fetc:volt:arr?", points)
+
+        return [(started + i * interval, current, voltage) for i, (current, voltage) in enumerate(zip(currents, voltages))]
+
+    async def _fetch_array(self, query: str, points: int) -> list:
+        # a reading takes at most 16 characters with its separator
+        response = await self._send_command(query, points * 16)
+
+        try:
+            values = [float(value) for value in response.split(",")]
+        except ValueError as err:
+            raise IOError(f"Error fetching {query} from Power Supply. A reading was not a number.")
+
+        if len(values) != points:
+            raise IOError(f"Error fetching {query} from Power Supply. Expected {points} readings, got {len(values)}.")
+
+        return values
+
     async def set_voltage_limits(self, min_voltage: float, max_voltage: float) -> bool:
         """
         Sets the voltage protection limits. Returns true if the device acknowledges a change in voltage
@@ -128,29 +257,15 @@ class BKOperator(SerialCommunicator):
         if self.ser is None:
             return False
 
-        response = await self._send_command("outp 0")
+        # the output must be switched off even if the port has to be reopened first
+        response = await self._with_retries(self._send_command, "outp 0")
 
         # TODO: Confirm response in testing
         return True
 
-    async def _send_command(self, command: str) -> str:
+    def _expects_reply(self, command: str) -> bool:
         """
-        Locks the resource and sends ascii text to a serial port and waits until 100 bytes are read back or 1 seconds have passed. Returns
-        the bytes read from the serial port in ascii format with new line characters stripped.
+        Only SCPI queries are answered by the Power Supply, so setting commands do not wait out the port timeout.
         """
 
-        if self.ser is None:
-            raise IOError(f"Attempting to write to {self.name} which has no software serial connection.")
-
-        try:
-            await self.serial_lock.acquire()
-            written = bytes(str().join((command, "\r\n")), "ascii")
-            self.logger.info(f"Wrote {written} to {self.name}")
-            self.ser.write(written)
-            ret = self.ser.read(100).decode("ascii").rstrip("\n")
-            self.ser.flush()
-            self.serial_lock.release()
-            return ret
-        except BaseException as e:
-            self.ser.flush()
-            self.serial_lock.release()
+        return command.endswith("?")
@@ -0,0 +1,95 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import logging
+import math
+import time
+
+from instrumentation import metrics
+from sampling_scheduler import SamplingScheduler
+from serial_communicator import request_priority
+
+
+class LatestValues:
+    """
+    Table of the latest value of every channel and the monotonic time it was read at, filled by the channel pollers and
+    read by the recorder.
+    """
+
+    def __init__(self, channels: tuple):
+        self.channels = channels
+        self.values = {channel: math.nan for channel in channels}
+        self.read_at = {channel: None for channel in channels}
+        self.ready = asyncio.Event()
+
+    def update(self, channels: tuple, values: tuple, read_at: float) -> None:
+        for channel, value in zip(channels, values):
+            self.values[channel] = value
+            self.read_at[channel] = read_at
+
+        if not self.ready.is_set() and all(at is not None for at in self.read_at.values()):
+            self.ready.set()
+
+    def age(self, channel: str, now: float) -> float:
+        """
+        Returns how many seconds ago the channel was last read, or infinity if it has not been read yet.
+        """
+
+        read_at = self.read_at[channel]
+        return math.inf if read_at is None else now - read_at
+
+
+class ChannelPoller:
+    """
+    Reads one or more channels that a device gives in a single request every interval seconds, independently of the
+    other channels, and keeps their latest values in a LatestValues table. Requests of a poller with a lower priority
+    value are served first when they wait for the same device as other requests. Failed reads are counted and logged,
+    the values in the table then grow stale.
+    """
+
+    def __init__(self, name: str, read, channels: tuple, table: LatestValues, interval: float, priority: int = 10,
+                 logger: logging.Logger = None, metrics=metrics):
+        self.name = name
+        self.read = read
+        self.channels = channels
+        self.table = table
+        self.interval = interval
+        self.priority = priority
+        self.logger = logger or logging.getLogger("experiment")
+        self.metrics = metrics
+
+    async def run(self) -> None:
+        """
+        Polls until it is cancelled.
+        """
+
+        request_priority.set(self.priority)
+        scheduler = SamplingScheduler(self.interval, math.inf, self.logger)
+
+        async for _ in scheduler.ticks():
+            started = time.perf_counter()
+
+            try:
+                values = await self.read()
+            except IOError as err:
+                self.metrics.count(f"{self.name} channel read errors")
+                self.logger.warning("Reading the %s channels failed: %s", self.name, err)
+                continue
+
+            self.metrics.record(f"{self.name} channel read", time.perf_counter() - started)
+            self.table.update(self.channels, values, time.monotonic())
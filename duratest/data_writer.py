@@ -0,0 +1,163 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+
+# queued by close() to tell the writer thread to drain its buffer and close the file
+_STOP = object()
+
+
+class DataWriter:
+    """
+    Long-lived writer for the experiment data file. Rows are queued from the event loop without blocking and written by
+    a background thread that keeps the file open, batches rows in memory and writes them out once flush_rows rows are
+    buffered or flush_interval seconds have passed. The file is fsynced every fsync_interval seconds and when closed.
+    Once max_queued_rows rows are waiting for the writer thread, the data file is considered to no longer be written.
+    """
+
+    def __init__(self, save_path: str, columns: tuple, flush_rows: int = 60, flush_interval: float = 5.0,
+                 fsync_interval: float = 60.0, logger: logging.Logger = None, max_queued_rows: int = 10000):
+        self.logger = logger or logging.getLogger("experiment")
+        self.save_path = save_path
+        self.columns = columns
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+
+        self.file = None
+        self.footer = None
+        self.error = None
+        self.max_queued_rows = max_queued_rows
+        self.queue = queue.Queue(max_queued_rows)
+        self.thread = threading.Thread(target=self._run, name=f"DataWriter {save_path}", daemon=True)
+
+    def open(self) -> None:
+        """
+        Opens the data file for appending, writes the header and starts the writer thread. Raises an IOError if the
+        file can not be opened.
+        """
+
+        self.file = self._open_file()
+        self._write_header()
+        self.thread.start()
+
+    def write_row(self, row: tuple) -> None:
+        """
+        Queues a row to be written by the writer thread. Raises an IOError if the writer thread has failed to write to
+        the data file, or has fallen max_queued_rows rows behind.
+        """
+
+        if self.error is not None:
+            raise IOError(f"Error writing to {self.save_path}: {self.error}")
+
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            raise IOError(f"Error writing to {self.save_path}: {self.max_queued_rows} rows are waiting to be written.")
+
+    async def close(self, footer: dict = None) -> None:
+        """
+        Writes every queued row, followed by the footer if one is given, fsyncs and closes the data file. Waits for the
+        writer thread in the default executor so the event loop is not blocked while the buffer is drained.
+        """
+
+        if not self.thread.is_alive():
+            return
+
+        self.footer = footer
+        loop = asyncio.get_running_loop()
+        # the queue may be full, the stop is queued once the writer thread has made room for it
+        await loop.run_in_executor(None, self.queue.put, _STOP)
+        await loop.run_in_executor(None, self.thread.join)
+
+    def _open_file(self):
+        return open(self.save_path, "a")
+
+    def _write_header(self) -> None:
+        self.file.write(", ".join(self.columns))
+        self.file.write("\n")
+
+    def _encode_row(self, row: tuple) -> str:
+        return ", ".join(map(str, row)) + "\n"
+
+    def _buffer_row(self, row: tuple, buffer: list) -> None:
+        # runs on the writer thread, subclasses may write the buffer out before the row (to start a new file)
+        buffer.append(self._encode_row(row))
+
+    def _write_footer(self, footer: dict) -> None:
+        # footer lines are marked as comments so the rows above can still be read as plain .csv
+        self.file.writelines(f"# {key}: {value}\n" for key, value in footer.items())
+
+    def _run(self) -> None:
+        buffer = []
+        last_flush = last_fsync = time.monotonic()
+        unsynced = False
+
+        try:
+            while True:
+                now = time.monotonic()
+                if buffer:
+                    timeout = max(0.0, last_flush + self.flush_interval - now)
+                else:
+                    timeout = max(0.0, last_fsync + self.fsync_interval - now) if unsynced else None
+
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    row = None
+
+                if row is _STOP:
+                    break
+
+                if row is not None:
+                    self._buffer_row(row, buffer)
+
+                now = time.monotonic()
+
+                if len(buffer) >= self.flush_rows or (buffer and now - last_flush >= self.flush_interval):
+                    self._flush(buffer)
+                    buffer.clear()
+                    last_flush = now
+                    unsynced = True
+
+                if unsynced and now - last_fsync >= self.fsync_interval:
+                    os.fsync(self.file.fileno())
+                    last_fsync = now
+                    unsynced = False
+
+            self._flush(buffer)
+
+            if self.footer:
+                self._write_footer(self.footer)
+                self.file.flush()
+
+            os.fsync(self.file.fileno())
+        except Exception as err:
+            # any error stops the writer thread, it is raised by the next write_row instead of losing rows silently
+            self.error = err
+            self.logger.error(f"Error writing to {self.save_path}: {err!r}")
+        finally:
+            self.file.close()
+
+    def _flush(self, buffer: list) -> None:
+        self.file.writelines(buffer)
+        self.file.flush()
@@ -0,0 +1,149 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+
+
+class RunningStatistics:
+    """
+    Running count, mean, variance, minimum and maximum of a channel, updated in O(1) per sample (Welford's method).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+class DegradationAnalytics:
+    """
+    Streaming degradation analytics of the cell, updated in O(1) per sample: running statistics of every channel, an
+    exponentially weighted moving average of the voltage and the least-squares degradation rate of the voltage over the
+    whole run. From the rate, the time at which the voltage will cross the voltage-threshold limit (the starting
+    voltage times voltage_threshold) is forecast.
+    """
+
+    def __init__(self, voltage_threshold: float = None, ewma_alpha: float = 0.05):
+        self.voltage_threshold = voltage_threshold
+        self.ewma_alpha = ewma_alpha
+
+        self.current = RunningStatistics()
+        self.voltage = RunningStatistics()
+        self.temperature = RunningStatistics()
+        self.ewma_voltage = None
+        self.start_time = None
+        self.last_time = None
+        self.starting_voltage = None
+
+        # running means and co-moments of (hours since start, voltage) for the incremental least-squares fit
+        self.mean_hours = 0.0
+        self.var_hours = 0.0
+        self.cov_hours_voltage = 0.0
+
+    def update(self, timestamp: float, current: float, voltage: float, temperature: float) -> None:
+        """
+        Adds a sample taken at timestamp (in seconds since the epoch).
+        """
+
+        if self.start_time is None:
+            self.start_time = timestamp
+            self.starting_voltage = voltage
+            self.ewma_voltage = voltage
+
+        self.current.update(current)
+        self.temperature.update(temperature)
+        self.ewma_voltage += self.ewma_alpha * (voltage - self.ewma_voltage)
+
+        # the fit shares the running mean of the voltage with the voltage statistics
+        self.last_time = timestamp
+        count = self.voltage.count + 1
+        hours = (timestamp - self.start_time) / 3600
+        delta_hours = hours - self.mean_hours
+        self.mean_hours += delta_hours / count
+        self.var_hours += delta_hours * (hours - self.mean_hours)
+        self.cov_hours_voltage += delta_hours * (voltage - (self.voltage.mean + (voltage - self.voltage.mean) / count))
+        self.voltage.update(voltage)
+
+    def degradation_rate(self):
+        """
+        Returns the least-squares rate of change of the voltage in microvolts per hour, or None with fewer than two
+        samples at different times.
+        """
+
+        if self.var_hours <= 0:
+            return None
+
+        return self.cov_hours_voltage / self.var_hours * 1e6
+
+    def threshold_voltage(self):
+        if self.voltage_threshold is None or self.starting_voltage is None:
+            return None
+
+        return abs(self.starting_voltage * self.voltage_threshold)
+
+    def forecast_threshold_time(self):
+        """
+        Returns the time (in seconds since the epoch) at which the fitted voltage crosses the voltage-threshold limit, or
+        None if the voltage is not rising.
+        """
+
+        rate = self.degradation_rate()
+        threshold = self.threshold_voltage()
+
+        if rate is None or rate <= 0 or threshold is None:
+            return None
+
+        hours = self.mean_hours + (threshold - self.voltage.mean) / (rate / 1e6)
+        return self.start_time + hours * 3600
+
+    def summary(self) -> dict:
+        """
+        Returns the current analytics by name, ready to be logged or written to the data file.
+        """
+
+        summary = {"Samples": self.voltage.count}
+
+        for name, statistics in (("Current", self.current), ("Voltage", self.voltage), ("Temperature", self.temperature)):
+            if statistics.count:
+                summary[f"{name} mean"] = statistics.mean
+                summary[f"{name} standard deviation"] = math.sqrt(statistics.variance)
+                summary[f"{name} minimum"] = statistics.minimum
+                summary[f"{name} maximum"] = statistics.maximum
+
+        summary["Voltage EWMA"] = self.ewma_voltage
+        summary["Degradation rate (uV/h)"] = self.degradation_rate()
+        summary["Threshold voltage"] = self.threshold_voltage()
+
+        forecast = self.forecast_threshold_time()
+        summary["Forecast threshold time"] = forecast
+        summary["Forecast hours to threshold"] = None if forecast is None else (forecast - self.last_time) / 3600
+
+        return summary
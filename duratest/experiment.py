@@ -15,131 +15,498 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import cProfile
+import io
 import json
 import asyncio
+import pstats
 import logging
+import math
 import time
 
+from binary_recording import BinaryDataWriter
 from bk_operator import BKOperator
+from channels import ChannelPoller, LatestValues
+from data_writer import DataWriter
+from degradation_analytics import DegradationAnalytics
+from instrumentation import Instrumentation
+from limits import compile_limits
+from log_pipeline import attach_queue_logging
+from modbus_temperature_controller import ModbusTemperatureController
 from pump_controller import PumpController
+from safety_interlock import SafetyInterlock
+from sample_compression import create_compressor
+from sampling_scheduler import AdaptiveSampling, SamplingScheduler
+from serial_bus import shared_bus
+from segmented_recording import SegmentedDataWriter
+from simulated_devices import (SimulatedBKOperator, SimulatedModbusTemperatureController, SimulatedPumpController,
+                               SimulatedTemperatureController)
+from telemetry import TelemetryServer
 from temperature_controller import TemperatureController
 from os import path, makedirs
 
+# columns of every row in the data file
+COLUMNS = ("Time", "Current", "Voltage", "Temperature")
+
 
 class Experiment:
-    def __init__(self):
-        with open("experiment.json") as f:
+    def __init__(self, config_path: str = "experiment.json", station: str = None):
+        """
+        Reads the experiment parameters from config_path. When station is given, the experiment runs as one of several
+        stations in the same process (see StationRunner): its messages are logged under the station name (or the
+        "station-name" given in the file) to its own log file, and logging is otherwise left to the runner.
+        """
+
+        with open(config_path) as f:
             data = json.load(f)
 
+        self.parameters = data
         self.sampling_rate = data["sampling-rate"]
         self.duration = data["duration"]
         self.save_path = data["data-save-path"]
+        self.data_format = data.get("data-format", "csv")
         save_dir = path.dirname(self.save_path)
 
         if not path.exists(save_dir):
             makedirs(save_dir)
 
-        # save log in same directory that .csv data is stored
-        logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(message)s", handlers=[logging.FileHandler(data["log-save-path"]),logging.StreamHandler()])
+        # rows are buffered in memory and written out once either bound is reached, fsync is on its own (slower) cadence
+        self.flush_rows = data.get("data-flush-rows", 60)
+        self.flush_interval = data.get("data-flush-interval", 5)
+        self.fsync_interval = data.get("data-fsync-interval", 60)
+
+        # a .csv data file can be split into hourly or daily segments, which are compressed once they are closed
+        self.segment_options = data.get("data-segments")
+
+        # sample times are wall clock times derived from the monotonic clock, so they can be lined up with other systems
+        # without jumping when the system clock is adjusted during the experiment
+        self.wall_start = time.time()
+        self.monotonic_start = time.monotonic()
+
+        # log records are written by a background thread, repetitive messages are rate limited before they are queued
+        # and the wire traces of each device are only logged if its log-level is DEBUG
+        if station is None:
+            self.station = None
+            self.logger = logging.getLogger("experiment")
+            self.device_logger = logging.getLogger("serial")
+
+            # save log in same directory that .csv data is stored
+            attach_queue_logging(logging.getLogger(),
+                                 [logging.FileHandler(data["log-save-path"]), logging.StreamHandler()],
+                                 data.get("log-level", "DEBUG"),
+                                 data.get("log-rate-limit"))
+        else:
+            self.station = data.get("station-name", station)
+            self.logger = logging.getLogger(f"experiment.{self.station}")
+            self.device_logger = self.logger.getChild("serial")
+
+            handler = logging.FileHandler(data["log-save-path"])
+            handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+            attach_queue_logging(self.logger, [handler], data.get("log-level"), data.get("log-rate-limit"))
 
         self.bk_options = data["Power-Supply-options"]
         self.pump_options = data["Pump-Controller-options"]
         self.temperature_options = data["Temperature-Controller-options"]
 
+        # devices are brought up concurrently, "startup-order" decides whether current is applied once the temperature
+        # has settled (temperature-first) or as soon as the power supply is ready (concurrent)
+        self.startup_order = data.get("startup-order", "temperature-first")
+
+        if self.startup_order not in ("temperature-first", "concurrent"):
+            raise ExperimentError(f"Unknown startup-order {self.startup_order}")
+
         # these three are not assigned until run_experiment is called publicly (privately, they are assigned in
         # their getter methods)
         self.bk_operator = None
         self.temp_controller = None
         self.pump_controller = None
-
-        # this is overwritten and used to measure dV for successive voltage measurements
-        self.previous_voltage = None
-        self.starting_voltage = None
+        self.scheduler = None
+        self.data_writer = None
+        # burst captures are kept apart from the samples, which are the only rows checked against the limits
+        self.burst_writer = None
+
+        # latency histograms and counters of every device command and sampling stage, dumped when the experiment stops
+        self.metrics = Instrumentation()
+
+        # an opt-in cProfile of the sampling iterations start + 1 to start + iterations
+        self.profile_options = data.get("profile")
+        self.profiler = None
+
+        # compression drops rows that can be reproduced within the tolerance of each channel from the rows kept, limits
+        # and analytics still see every sample
+        if "compression" in data:
+            try:
+                self.compressor = create_compressor(data["compression"], COLUMNS)
+            except ValueError as err:
+                raise ExperimentError(str(err))
+        else:
+            self.compressor = None
+
+        # the telemetry server publishes every validated sample from memory while the experiment runs
+        if "telemetry" in data:
+            telemetry_options = data["telemetry"]
+            self.telemetry = TelemetryServer(COLUMNS,
+                                             telemetry_options.get("host", "127.0.0.1"),
+                                             telemetry_options.get("port", 8080),
+                                             telemetry_options.get("history-size", 3600),
+                                             telemetry_options.get("client-queue-size", 100),
+                                             self.logger,
+                                             self.metrics)
+        else:
+            self.telemetry = None
+
+        # with channels every device is polled at its own interval into a table of the latest values, which samples are
+        # taken from, instead of polling every device for every sample
+        self.channel_options = data.get("channels")
+        self.channel_table = None
+        self.channel_max_age = {}
+
+        # with adaptive sampling the sampling rate follows the dynamics of the readings instead of staying fixed
+        if "adaptive-sampling" in data:
+            self.adaptive_sampling = AdaptiveSampling(data["adaptive-sampling"], self.sampling_rate, self.bk_options,
+                                                      self.temperature_options)
+        else:
+            self.adaptive_sampling = None
+
+        # streaming analytics of every validated sample, logged every log-interval seconds and written to the data file
+        # when the experiment stops
+        analytics_options = data.get("analytics", {})
+        self.analytics = DegradationAnalytics(self.bk_options["voltage-threshold"],
+                                              analytics_options.get("ewma-alpha", 0.05))
+        self.analytics_log_interval = analytics_options.get("log-interval", 3600)
+        self.analytics_logged = None
+
+        # samples a device failed to give (after its own retries) are written as gap rows of NaN, the experiment only
+        # fails once more than max-missed-samples samples in a row were missed
+        self.max_missed_samples = data.get("max-missed-samples", 0)
+        self.missed_samples = 0
+
+        # the limits every sample is checked against, they keep the previous and starting voltage of the samples
+        self.limits = compile_limits(self.bk_options, self.temperature_options)
+
+        # the safety interlock checks its own readings against the same limits at its own (faster) rate
+        if "safety-interlock" in data:
+            self.safety_interlock = SafetyInterlock(self._poll_devices,
+                                                    compile_limits(self.bk_options, self.temperature_options),
+                                                    data["safety-interlock"].get("period", 0.1),
+                                                    self._trip_interlock,
+                                                    self.logger,
+                                                    self.metrics)
+        else:
+            self.safety_interlock = None
+
+        # (timestamp, current, voltage, temperature) of the last validated sample
+        self.last_sample = None
+
+        # set once sampling ran for the whole duration, an experiment stopped by an error or a limit is stopped at once
+        self.completed = False
 
     async def run_experiment(self):
         """
-        Runs a simple loop that will execute for at least the duration given in experiment.json. Depending on how long
-        it takes to get readings from each device, the duration of the experiment may be longer than experiment.json. (I
-        estimate it would be bounded above by about duration + duration/sampling_rate)
+        Samples every device on a fixed schedule for the duration given in experiment.json. Samples are taken on
+        absolute deadlines of the monotonic clock, so the time it takes to get readings does not stretch the sampling
+        period or the duration of the experiment. Samples that can not be taken on time are skipped and reported. With
+        adaptive sampling, the period is chosen again after every sample. With the safety interlock, sampling is
+        stopped as soon as the interlock detects a breached limit. With channels, every device is polled at the
+        interval of its channels and samples hold the latest values read.
+        """
+
+        if self.telemetry is not None:
+            try:
+                await self.telemetry.start()
+            except OSError as err:
+                raise ExperimentError(f"Unable to start the telemetry server: {err}")
+
+        pollers = []
+
+        try:
+            task = asyncio.create_task(self._start_experiment())
+            await task
+
+            if self.bk_operator is None or self.pump_controller is None or self.temp_controller is None:
+                raise ExperimentError("Failed to make a connection to all devices")
+
+            pollers = [asyncio.create_task(poller.run()) for poller in self._get_channel_pollers()]
+
+            if pollers:
+                await self._wait_for_channels()
+
+            if self.safety_interlock is None:
+                await self._sample()
+            else:
+                await self._sample_with_interlock()
+
+            self.completed = True
+        finally:
+            for task in pollers:
+                task.cancel()
+
+            await asyncio.gather(*pollers, return_exceptions=True)
+
+            # streaming clients never finish on their own, they are disconnected before the caller waits for every task
+            if self.telemetry is not None:
+                await self.telemetry.stop()
+
+    async def _sample_with_interlock(self) -> None:
+        """
+        Runs the sampling loop next to the safety interlock until either finishes.
         """
 
-        task = asyncio.create_task(self._start_experiment())
-        await task
+        sampling = asyncio.create_task(self._sample())
+        interlock = asyncio.create_task(self.safety_interlock.run())
+
+        try:
+            await asyncio.wait({sampling, interlock}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (sampling, interlock):
+                task.cancel()
 
-        if self.bk_operator is None or self.pump_controller is None or self.temp_controller is None:
-            raise ExperimentError("Failed to make a connection to all devices")
+            await asyncio.gather(sampling, interlock, return_exceptions=True)
 
-        task = asyncio.create_task(asyncio.sleep(10))
-        await task
+        # the outcome of sampling (including the ExperimentError of a limit breached by a sample) is the outcome of the
+        # experiment, unless the interlock stopped it first
+        if not sampling.cancelled():
+            sampling.result()
+            return
 
-        while self.duration > 0:
-            await self._process_readings()
-            self.duration -= self.sampling_rate
-            await asyncio.sleep(self.sampling_rate)
+        raise ExperimentError(interlock.result())
+
+    async def _sample(self) -> None:
+        """
+        Runs the sampling loop of run_experiment.
+        """
+
+        period = self.sampling_rate if self.adaptive_sampling is None else self.adaptive_sampling.period
+        self.scheduler = SamplingScheduler(period, self.duration, self.logger)
+
+        try:
+            async for _ in self.scheduler.ticks():
+                self.metrics.record("Sample jitter", self.scheduler.last_jitter)
+                self._profile(self.scheduler.tick_count)
+
+                with self.metrics.measure("Sample total"):
+                    await self._process_readings()
+
+                if self.adaptive_sampling is not None and self.last_sample is not None:
+                    self.scheduler.period = self.adaptive_sampling.next_period(*self.last_sample)
+        finally:
+            self.logger.info(f"Sampling summary: {self.scheduler.stats()}")
 
     async def stop_experiment(self) -> bool:
         """
-        Sends the equivalent stop command to each device putting the entire system at rest. TODO: Technically these
-        can fail if communication has been severed, warn user of such later.
+        Sends the equivalent stop command to each device putting the entire system at rest. A device that can not be
+        reset (for example because communication has been severed) is logged, and the other devices are still reset.
+        The current is switched off before anything else is sent.
         """
 
-        if self.bk_operator is not None:
-            task = asyncio.create_task(self.bk_operator.reset())
-            await task
+        try:
+            burst = None
 
-        if self.temp_controller is not None: 
-            task = asyncio.create_task(self.temp_controller.reset())
-            await task
+            if self.bk_operator is not None:
+                await self._reset_device(self.bk_operator, "BK Power Supply")
 
-        if self.pump_controller is not None:
-            task = asyncio.create_task(self.pump_controller.reset())
-            await task
+                # the relaxation after the current is switched off is only captured at the end of a completed run
+                if self.completed and self.bk_options.get("burst", {}).get("at-stop", False):
+                    burst = await self._start_burst()
 
+            if self.temp_controller is not None:
+                await self._reset_device(self.temp_controller, "Temperature Controller")
+
+            if self.pump_controller is not None:
+                await self._reset_device(self.pump_controller, "Pump Controller")
+
+            # the bulk transfer of the burst only starts once every device is at rest
+            await self._write_burst(burst)
+        finally:
+            if self.telemetry is not None:
+                await self.telemetry.stop()
+
+            # drain every buffered sample to disk, even if a device could not be reset
+            if self.data_writer is not None:
+                if self.compressor is not None:
+                    self._write_rows(self.compressor.flush())
+
+                await self.data_writer.close(self.analytics.summary())
+
+            if self.burst_writer is not None:
+                await self.burst_writer.close()
+
+            if self.profiler is not None:
+                self._stop_profiler()
+
+            # the ports are released, so the devices (and a shared bus) can be opened again by the next experiment
+            for device in (self.bk_operator, self.temp_controller):
+                if device is not None:
+                    self.logger.info(f"Health of {device.name}: {device.health.summary()}")
+                    device.close()
+
+            self.metrics.dump(self.logger)
 
         return True
 
 
+    async def _trip_interlock(self) -> None:
+        """
+        Switches the current off as soon as the safety interlock detects a breach, before sampling is stopped and the
+        other devices are put at rest by stop_experiment.
+        """
+
+        await self._reset_device(self.bk_operator, "BK Power Supply")
+
+    async def _reset_device(self, device, name: str) -> bool:
+        """
+        Resets device, returns False and logs the error instead of raising it if the device fails to communicate.
+        """
+
+        try:
+            return await device.reset()
+        except IOError as err:
+            self.logger.error(f"Unable to reset the {name}, it may not be at rest: {err}")
+            return False
+
     async def _start_experiment(self):
         """
         Readies each device and sets the desired setpoint for each device using the values stored in the experiment.json file.
+        The pump is turned on, the temperature setpoint is applied and the BK Power Supply is reset and given its limits
+        concurrently, since none of these put current through the system. Current is only applied once all three are
+        ready and, with the temperature-first startup order, once the temperature has settled.
         """
 
-        # note that the BK Power supply takes longer to ready and that the temp controller may be applying
-        # temperature BEFORE the BK Power Supply is applying current.
-        task = asyncio.create_task(self._ready_Pump_Controller())
-        await task
-        
-        task = asyncio.create_task(self._ready_Temp_Controller())
-        await task
+        results = await asyncio.gather(self._ready_Pump_Controller(),
+                                       self._ready_Temp_Controller(),
+                                       self._ready_BK(),
+                                       return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, IOError):
+                raise ExperimentError(f"Device communication error while starting the experiment: {result}")
+            if isinstance(result, BaseException):
+                raise result
+
+        if self.startup_order == "temperature-first":
+            await self._settle_temperature()
 
-        task = asyncio.create_task(self._ready_BK())
-        await task
+        # the data files are opened before current is applied, so a burst captured around the step can be written
+        self.data_writer = self._get_new_DataWriter(COLUMNS)
+
+        try:
+            self.data_writer.open()
+        except IOError as err:
+            raise ExperimentError(f"Unable to open the data file {self.save_path}: {err}")
 
-        
+        if "burst" in self.bk_options:
+            burst_path = self.bk_options["burst"].get("save-path", path.splitext(self.save_path)[0] + ".burst.csv")
+            self.burst_writer = DataWriter(burst_path, COLUMNS, self.flush_rows, self.flush_interval,
+                                           self.fsync_interval, self.logger)
 
-        with open(self.save_path, "a") as f:
-            f.write("Current, Voltage, Temperature\n")
+            try:
+                self.burst_writer.open()
+            except IOError as err:
+                raise ExperimentError(f"Unable to open the burst data file {burst_path}: {err}")
 
+        await self._apply_current()
 
     async def _ready_BK(self) -> None:
         """
         Makes initial connection with the BK Power Supply, ensures that the Power Supply is correctly communicating
-        with the software, sets the voltage limits of the power supply, then sets the current setpoint to the
-        value given in the experiment.json file. The power supply immediately beings applying the current.
+        with the software and sets the voltage limits of the power supply. Current is applied by _apply_current.
         """
 
         self.bk_operator = self._get_new_BK(self.bk_options)
+        self._adopt_device(self.bk_operator, "bk", self.bk_options)
 
-        if not await self.bk_operator.verify_connection():
+        if not await self.bk_operator.verify_connection(self.bk_options.get("ready-timeout", 5)):
             raise ExperimentError("The BK Power Supply has failed to verify its connection")
 
         # We can just check the voltage ourselves during sampling
         if not await self.bk_operator.set_voltage_limits(self.bk_options["minimum-voltage"], self.bk_options["maximum-voltage"]):
             raise ExperimentError("The BK Power Supply has failed to set Experiment voltage limits.")
 
+    async def _apply_current(self) -> None:
+        """
+        Sets the current setpoint of the BK Power Supply to the value given in the experiment.json file and waits until
+        the Power Supply reports the change complete, so the first sample is taken with the current applied.
+        """
+
+        burst = await self._start_burst()
+
         if not await self.bk_operator.set_current(self.bk_options["current-setpoint"]):
             raise ExperimentError("The BK Power Supply has failed to set the current setpoint")
 
+        await self._write_burst(burst)
+
+        if not await self.bk_operator.wait_until_ready(self.bk_options.get("ready-timeout", 5)):
+            raise ExperimentError("The BK Power Supply has failed to apply the current setpoint")
+
+    async def _start_burst(self):
+        """
+        Starts a burst capture of the Power Supply if "burst" is given in the Power-Supply-options, so the transient of
+        the current step that follows is recorded at the native rate of the Power Supply. Returns the temperature the
+        burst rows are written with, or None if no burst was started. A burst that fails to start is only logged.
+        """
+
+        options = self.bk_options.get("burst")
+
+        if options is None or self.burst_writer is None:
+            return None
+
+        try:
+            # the temperature changes slowly, it is read once instead of during the burst
+            if self.last_sample is not None:
+                temperature = self.last_sample[3]
+            else:
+                temperature = await self.temp_controller.get_temperature()
+
+            await self.bk_operator.start_burst(options.get("points", 500), options.get("interval", 0.001))
+        except IOError as err:
+            self.logger.warning(f"Unable to start a burst capture of the Power Supply: {err}")
+            return None
+
+        return temperature
+
+    async def _write_burst(self, temperature) -> None:
+        """
+        Fetches the readings of the burst started by _start_burst and writes them to the burst data file at the time
+        they were taken. Limits and analytics are only applied to the regular samples. A burst that fails to be fetched
+        is only logged.
+        """
+
+        if temperature is None:
+            return
+
+        try:
+            readings = await self.bk_operator.fetch_burst(self.bk_options.get("ready-timeout", 5))
+        except IOError as err:
+            self.logger.warning(f"Unable to fetch the burst capture of the Power Supply: {err}")
+            return
+
+        for at, current, voltage in readings:
+            self.burst_writer.write_row((self._timestamp(at), current, voltage, temperature))
+
+        self.metrics.count("Burst readings", len(readings))
+
+    async def _settle_temperature(self) -> None:
+        """
+        Waits until the temperature has stayed within settle-tolerance of the setpoint for settle-time seconds. Does not
+        wait if no settle-tolerance is given. An ExperimentError is raised if it has not settled within settle-timeout.
+        """
+
+        tolerance = self.temperature_options.get("settle-tolerance")
+
+        if tolerance is None:
+            return
+
+        setpoint = self.temperature_options["temperature-setpoint"]
+        timeout = self.temperature_options.get("settle-timeout", 1800)
+        self.logger.info(f"Waiting for the temperature to settle within {tolerance} C of {setpoint} C.")
+
+        if not await self.temp_controller.wait_until_settled(setpoint,
+                                                             tolerance,
+                                                             self.temperature_options.get("settle-time", 10),
+                                                             timeout,
+                                                             self.temperature_options.get("settle-interval", 1)):
+            raise ExperimentError(f"The temperature has not settled at {setpoint} C within {timeout} s.")
+
     async def _ready_Pump_Controller(self) -> None:
         """
         Makes initial connection with the Pump Controller, ensures that the Pump Controller is correctly communicating
@@ -147,6 +514,7 @@ class Experiment:
         """
 
         self.pump_controller = self._get_new_PumpController(self.pump_options)
+        self._adopt_device(self.pump_controller, "pump", self.pump_options)
 
         if not await self.pump_controller.turn_on():
             raise ExperimentError("The Pump Controller has failed to turn on.")
@@ -159,6 +527,7 @@ class Experiment:
         """
 
         self.temp_controller = self._get_new_TemperatureController(self.temperature_options)
+        self._adopt_device(self.temp_controller, "temperature", self.temperature_options)
 
         if not await self.temp_controller.verify_connection():
             raise ExperimentError("The Temperature Controller has failed to verify its connection")
@@ -169,89 +538,349 @@ class Experiment:
     async def _process_readings(self) -> bool:
         """
         Requests readings from all connected devices, validates these readings (and potentially raises an
-        ExperimentError if readings are out of bounds), then saves to .csv file given in experiment.json file.
+        ExperimentError if readings are out of bounds), then saves them with the time they were requested to the data
+        file given in experiment.json file. Returns False if a device failed to give a reading and a gap was recorded
+        instead.
         """
 
+        timestamp = self._timestamp()
+
         try:
-            readings = await self._get_readings()
+            with self.metrics.measure("Sample readings"):
+                readings = await self._get_readings()
         except IOError as err:
-            raise ExperimentError(f"Device communication error: {err}")
+            self._record_missed_sample(timestamp, err)
+            return False
 
-        self._throw_on_bad_readings(readings)
+        if self.missed_samples > 0:
+            self.logger.warning("Sampling recovered after %d missed sample(s).", self.missed_samples)
+            self.missed_samples = 0
 
-        with open(self.save_path, "a") as f:
-            f.write(", ".join(map(str, readings)))
-            f.write("\n")
+        with self.metrics.measure("Sample limit checks"):
+            self._throw_on_bad_readings(readings)
+
+        with self.metrics.measure("Sample analytics"):
+            self._update_analytics(timestamp, readings)
+
+        row = (timestamp,) + readings
+
+        if self.telemetry is not None:
+            with self.metrics.measure("Sample telemetry"):
+                self._publish_telemetry(row)
+
+        self.last_sample = row
+
+        with self.metrics.measure("Sample write"):
+            self._write_rows([row] if self.compressor is None else self.compressor.add(row))
 
         return True
 
+    def _record_missed_sample(self, timestamp: float, err: IOError) -> None:
+        """
+        Writes a gap row (NaN for every reading) at the time of a sample a device failed to give, so the gap is visible
+        in the data file. Raises an ExperimentError once more than max-missed-samples samples in a row were missed.
+        """
+
+        self.missed_samples += 1
+        self.metrics.count("Missed samples")
+
+        if self.missed_samples > self.max_missed_samples:
+            raise ExperimentError(f"Device communication error: {err}")
+
+        self.logger.warning("Missed sample %d of %d allowed in a row: %s", self.missed_samples, self.max_missed_samples,
+                            err)
+
+        gap = (timestamp,) + (math.nan,) * (len(COLUMNS) - 1)
+        self._write_rows([gap] if self.compressor is None else self.compressor.add(gap))
+
+    def _profile(self, iteration: int) -> None:
+        """
+        Starts profiling before sampling iteration start + 1 and stops after iteration start + iterations, where start
+        and iterations are given in the "profile" options of experiment.json.
+        """
+
+        if self.profile_options is None:
+            return
+
+        start = self.profile_options.get("start", 0)
+
+        if iteration == start + 1:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif iteration == start + self.profile_options.get("iterations", 100) + 1 and self.profiler is not None:
+            self._stop_profiler()
+
+    def _stop_profiler(self) -> None:
+        """
+        Stops profiling, saves the profile to the "output" path of the "profile" options if one is given and logs the
+        functions with the most cumulative time.
+        """
+
+        self.profiler.disable()
+
+        if "output" in self.profile_options:
+            self.profiler.dump_stats(self.profile_options["output"])
+
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats("cumulative").print_stats(20)
+        self.logger.info(f"Profile of the sampling loop:\n{report.getvalue()}")
+        self.profiler = None
+
+    def _publish_telemetry(self, row: tuple) -> None:
+        """
+        Publishes a validated row to the telemetry server, with the change in voltage since the last sample, the time
+        since the first sample and the live degradation analytics.
+        """
+
+        derived = {
+            "dV": None if self.last_sample is None else row[2] - self.last_sample[2],
+            "Elapsed": row[0] - self.analytics.start_time,
+            "Degradation rate (uV/h)": self.analytics.degradation_rate(),
+            "Forecast threshold time": self.analytics.forecast_threshold_time(),
+        }
+
+        self.telemetry.publish(row, derived)
+
+    def _write_rows(self, rows: list) -> None:
+        """
+        Queues rows to be written to the data file. Raises an ExperimentError if the data file can no longer be written.
+        """
+
+        try:
+            for row in rows:
+                self.data_writer.write_row(row)
+        except IOError as err:
+            raise ExperimentError(f"Data file error: {err}")
+
     def _throw_on_bad_readings(self, readings: tuple) -> None:
         """
         Compares readings against known limits provided by the user and throws an ExperimentError if these
         limits are exceeded. Readings are ordered (current, voltage, temperature)
         """
 
-        if self.previous_voltage is not None and abs(self.bk_options["max-dV"]) < abs(readings[1] - self.previous_voltage):
-            raise ExperimentError(
-                "The experiment stopped because the change in voltage exceeded the allowed tolerance for dV.")
-
-        if self.starting_voltage is not None and abs(readings[1]) > abs(self.starting_voltage*self.bk_options["voltage-threshold"]):
-            raise ExperimentError("The experiment stopped because the maximum voltage limit was reached.")
+        message = self.limits.check(readings)
 
-        if abs(readings[1]) < abs(self.bk_options["minimum-voltage"]):
-            raise ExperimentError("The experiment stopped because the minimum voltage limit was reached.")
+        if message is not None:
+            raise ExperimentError(message)
 
-        if readings[2] > self.temperature_options["max-temperature"]:
-            raise ExperimentError("The experiment stopped because the maximum temperature was reached.")
+    def _update_analytics(self, timestamp: float, readings: tuple) -> None:
+        """
+        Adds validated readings to the degradation analytics and logs a summary every log-interval seconds.
+        """
 
-        self.previous_voltage = readings[1]
+        self.analytics.update(timestamp, *readings)
 
-        if self.starting_voltage is None:
-            self.starting_voltage = readings[1]
+        if self.analytics_logged is None:
+            self.analytics_logged = timestamp
+        elif timestamp - self.analytics_logged >= self.analytics_log_interval:
+            self.analytics_logged = timestamp
+            self.logger.info(f"Degradation analytics: {self.analytics.summary()}")
 
     async def _get_readings(self) -> tuple:
+        """
+        Returns (current, voltage, temperature) for a sample, the latest values of the channels if channels are
+        configured, otherwise polled from the devices. Raises an IOError if a reading fails or a channel is stale.
+        """
+
+        if self.channel_table is None:
+            return await self._poll_devices()
+
+        table = self.channel_table
+        now = time.monotonic()
+
+        for channel, max_age in self.channel_max_age.items():
+            age = table.age(channel, now)
+
+            if age > max_age:
+                raise IOError(f"The {channel} reading is stale, it was last read {age:.1f} s ago")
+
+        return tuple(table.values[channel] for channel in COLUMNS[1:])
+
+    def _get_channel_pollers(self) -> list:
+        """
+        Creates the table of the latest channel values and a poller for each device from the "channels" options:
+        "power-supply" (Current and Voltage) and "temperature", each with an "interval" (defaults to the sampling rate),
+        a "priority" (lower is served first, defaults to 10) and a "max-age" after which a value is too stale to be
+        sampled (defaults to three intervals plus the longest a read with retries can take, so a single slow reply
+        does not miss a sample). Returns no pollers if no channels are configured.
+        """
+
+        if self.channel_options is None:
+            return []
+
+        self.channel_table = LatestValues(COLUMNS[1:])
+        self.channel_max_age = {}
+        pollers = []
+        devices = (("power-supply", self.bk_operator, self.bk_operator.get_measurements, ("Current", "Voltage")),
+                   ("temperature", self.temp_controller, self._read_temperature, ("Temperature",)))
+
+        for name, device, read, channels in devices:
+            options = self.channel_options.get(name, {})
+            interval = options.get("interval", self.sampling_rate)
+            max_age = options.get("max-age", 3 * interval + device.max_request_time())
+
+            for channel in channels:
+                self.channel_max_age[channel] = max_age
+
+            pollers.append(ChannelPoller(name, read, channels, self.channel_table, interval,
+                                         options.get("priority", 10), self.logger, self.metrics))
+
+        return pollers
+
+    async def _wait_for_channels(self) -> None:
+        """
+        Waits until every channel has been read once, so the first sample holds real values.
+        """
+
+        timeout = max(self.channel_max_age.values())
+
+        try:
+            await asyncio.wait_for(self.channel_table.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise ExperimentError(f"Not every channel could be read within {timeout} s of the start.")
+
+    async def _read_temperature(self) -> tuple:
+        return (await self.temp_controller.get_temperature(),)
+
+    async def _poll_devices(self) -> tuple:
         """
         Returns (current, voltage, temperature) from connected devices if available, does nothing with
         raised exceptions.
         """
 
-        current = asyncio.create_task(self.bk_operator.get_current())
-        voltage = asyncio.create_task(self.bk_operator.get_voltage())
+        # current and voltage are read together in one round trip, so they are taken at the same moment
+        measurements = asyncio.create_task(self.bk_operator.get_measurements())
         temperature = asyncio.create_task(self.temp_controller.get_temperature())
-        await asyncio.gather(current, voltage, temperature)
+        await asyncio.gather(measurements, temperature)
+
+        current, voltage = measurements.result()
+
+        return current, voltage, temperature.result()
+
+    def _adopt_device(self, device, kind: str, options: dict) -> None:
+        """
+        Makes the device log to its own logger below the experiment's device logger, at the "log-level" given in its
+        options (INFO by default, DEBUG includes every command written to the device), and record its metrics with the
+        experiment's.
+        """
+
+        device.logger = self.device_logger.getChild(kind)
+        device.logger.setLevel(options.get("log-level", "INFO"))
+        device.metrics = self.metrics
 
-        return current.result(), voltage.result(), temperature.result()
+        if "retries" in options:
+            device.retries = options["retries"]
+
+        if "retry-backoff" in options:
+            device.backoff = options["retry-backoff"]
+
+    def _timestamp(self, monotonic: float = None) -> float:
+        """
+        Returns the current time (or the given time of the monotonic clock) in seconds since the epoch, measured on the
+        monotonic clock from the start of the experiment.
+        """
+
+        if monotonic is None:
+            monotonic = time.monotonic()
+
+        return self.wall_start + (monotonic - self.monotonic_start)
+
+    def _get_new_DataWriter(self, columns: tuple) -> DataWriter:
+        """
+        Creates the writer for the data file in the format given in the experiment.json file, either "csv" (the
+        default) or "binary". With "data-segments", the .csv file is written in time-partitioned segments.
+        """
+
+        if self.data_format == "csv" and self.segment_options is not None:
+            try:
+                return SegmentedDataWriter(self.save_path, columns, self.segment_options.get("period", "daily"),
+                                           self.segment_options.get("compression", "gzip"), self.flush_rows,
+                                           self.flush_interval, self.fsync_interval, self.logger)
+            except ValueError as err:
+                raise ExperimentError(str(err))
+            except IOError as err:
+                raise ExperimentError(f"Unable to continue the segmented data file {self.save_path}: {err}")
+
+        if self.data_format == "csv":
+            return DataWriter(self.save_path, columns, self.flush_rows, self.flush_interval, self.fsync_interval,
+                              self.logger)
+
+        if self.data_format == "binary":
+            return BinaryDataWriter(self.save_path, columns, self.parameters, self.flush_rows, self.flush_interval,
+                                    self.fsync_interval, self.logger)
+
+        raise ExperimentError(f"Unknown data-format {self.data_format}, expected \"csv\" or \"binary\".")
 
     def _get_new_BK(self, bk_dict: dict) -> BKOperator:
         """
         Makes the initial serial connection with the BK Power Supply to the com port supplied in the
-        experiment.json file. Pyserial will throw an IOError if the com port is not available to connect with.
+        experiment.json file. Pyserial will throw an IOError if the com port is not available to connect with. If the
+        options contain a "simulation" object, a simulated Power Supply is used instead.
         """
 
         try:
-            return BKOperator(bk_dict["com-port"])
+            if "simulation" in bk_dict:
+                return SimulatedBKOperator(bk_dict["simulation"], bk_dict.get("measure-all", False))
+
+            return BKOperator(bk_dict["com-port"], bk_dict.get("measure-all", False))
         except IOError:
             raise ExperimentError("Unable to establish communication with the BK power supply.")
 
     def _get_new_PumpController(self, pump_dict: dict) -> PumpController:
         """
         Makes the initial serial connection with the Pump Controller to the com port supplied in the
-        experiment.json file. Pyserial will throw an IOError if the com port is not available to connect with.
+        experiment.json file. Pyserial will throw an IOError if the com port is not available to connect with. If the
+        options contain a "simulation" object, a simulated Pump Controller is used instead.
         """
 
         try:
-            return PumpController(pump_dict["serial-number"])
+            if "simulation" in pump_dict:
+                return SimulatedPumpController(pump_dict["serial-number"], pump_dict["simulation"])
+
+            return PumpController(pump_dict["serial-number"],
+                                  pump_dict.get("command-path", "pumpcontroller.exe"),
+                                  pump_dict.get("timeout", 10))
         except IOError:
             raise ExperimentError("Unable to establish communication with the Pump Controller.")
 
     def _get_new_TemperatureController(self, temp_dict: dict) -> TemperatureController:
         """
         Makes the initial serial connection with the Temperature Controller to the com port supplied in the
-        experiment.json file. Pyserial will throw an IOError if the com port is not available to connect with.
+        experiment.json file. Pyserial will throw an IOError if the com port is not available to connect with. With
+        "protocol" set to "modbus" the Temperature Controller is driven over Modbus RTU at its "modbus-address" instead
+        of its ASCII protocol. With "shared-bus" set, it shares its com port with the Modbus Temperature Controllers of
+        every other station on the same com port. If the options contain a "simulation" object, a simulated Temperature
+        Controller is used instead.
         """
 
+        protocol = temp_dict.get("protocol", "ascii")
+
+        if protocol not in ("ascii", "modbus"):
+            raise ExperimentError(f"Unknown Temperature Controller protocol {protocol}")
+
+        bus = None
+
+        if temp_dict.get("shared-bus", False):
+            if protocol != "modbus":
+                raise ExperimentError("A shared bus needs the modbus protocol, which addresses each Temperature "
+                                      "Controller.")
+
+            bus = shared_bus(temp_dict["com-port"])
+
         try:
+            if protocol == "modbus":
+                if "simulation" in temp_dict:
+                    return SimulatedModbusTemperatureController(temp_dict["simulation"],
+                                                                temp_dict.get("modbus-address", 1), bus)
+
+                return ModbusTemperatureController(temp_dict["com-port"], temp_dict.get("modbus-address", 1), bus)
+
+            if "simulation" in temp_dict:
+                return SimulatedTemperatureController(temp_dict["simulation"])
+
             return TemperatureController(temp_dict["com-port"])
+        except ValueError as err:
+            raise ExperimentError(f"Unable to add the Temperature Controller to its shared bus: {err}")
         except IOError:
             raise ExperimentError("Unable to establish communication with the Temperature Controller.")
 
@@ -0,0 +1,136 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+import time
+from array import array
+from contextlib import contextmanager
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with logarithmic buckets (eight per doubling, from one microsecond to a few minutes), so
+    recording is O(1) in a fixed amount of memory and percentiles are accurate to within about 9%.
+    """
+
+    minimum = 1e-6
+    buckets_per_doubling = 8
+    bucket_count = 8 * 28
+
+    def __init__(self):
+        self.counts = array("L", [0]) * self.bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+        if seconds <= self.minimum:
+            bucket = 0
+        else:
+            bucket = min(int(math.log2(seconds / self.minimum) * self.buckets_per_doubling), self.bucket_count - 1)
+
+        self.counts[bucket] += 1
+
+    def percentile(self, percent: float) -> float:
+        """
+        Returns the upper bound of the bucket holding the given percentile, never more than the largest latency.
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+
+        for bucket, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank:
+                return min(self.minimum * 2 ** ((bucket + 1) / self.buckets_per_doubling), self.maximum)
+
+        return self.maximum
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.maximum,
+        }
+
+
+class Instrumentation:
+    """
+    Latency histograms and event counters by name, cheap enough to be kept for every command and sampling stage.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.counters = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        histogram = self.latencies.get(name)
+
+        if histogram is None:
+            histogram = self.latencies[name] = LatencyHistogram()
+
+        histogram.record(seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def measure(self, name: str):
+        """
+        Records the time spent in the with block (including time awaited inside it) under name.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def report(self) -> dict:
+        return {
+            "latencies": {name: histogram.summary() for name, histogram in sorted(self.latencies.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def dump(self, logger) -> None:
+        """
+        Logs every latency summary (in milliseconds) and counter, one line each.
+        """
+
+        for name, summary in self.report()["latencies"].items():
+            logger.info(f"Latency of {name}: count {summary['count']}, mean {summary['mean'] * 1e3:.3f} ms, "
+                        f"p50 {summary['p50'] * 1e3:.3f} ms, p95 {summary['p95'] * 1e3:.3f} ms, "
+                        f"p99 {summary['p99'] * 1e3:.3f} ms, max {summary['max'] * 1e3:.3f} ms")
+
+        for name, count in self.report()["counters"].items():
+            logger.info(f"Count of {name}: {count}")
+
+
+# used by devices created outside of an experiment, an experiment hands its own Instrumentation to its devices
+metrics = Instrumentation()
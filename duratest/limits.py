@@ -0,0 +1,199 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+class MaxChangeRule:
+    """
+    Breached when a reading changes by more than max_change from the previous accepted reading.
+    """
+
+    def __init__(self, channel: int, max_change: float, message: str):
+        self.channel = channel
+        self.max_change = abs(max_change)
+        self.message = message
+        self.previous = None
+
+    def breached(self, readings: tuple) -> bool:
+        return self.previous is not None and abs(readings[self.channel] - self.previous) > self.max_change
+
+    def accept(self, readings: tuple) -> None:
+        self.previous = readings[self.channel]
+
+    def levels(self, readings, previous):
+        import numpy as np
+
+        values = readings[:, self.channel]
+        levels = np.abs(np.diff(values, prepend=np.nan if previous is None else previous[self.channel]))
+
+        if previous is None:
+            levels[0] = -np.inf
+
+        return levels
+
+    def thresholds(self, limits, first):
+        import numpy as np
+
+        return np.abs(limits)
+
+
+class RelativeMaxRule:
+    """
+    Breached when the magnitude of a reading exceeds factor times the magnitude of the first accepted reading.
+    """
+
+    def __init__(self, channel: int, factor: float, message: str):
+        self.channel = channel
+        self.factor = factor
+        self.message = message
+        self.limit = None
+
+    def breached(self, readings: tuple) -> bool:
+        return self.limit is not None and abs(readings[self.channel]) > self.limit
+
+    def accept(self, readings: tuple) -> None:
+        if self.limit is None:
+            self.limit = abs(readings[self.channel] * self.factor)
+
+    def levels(self, readings, previous):
+        import numpy as np
+
+        levels = np.abs(readings[:, self.channel])
+
+        if previous is None:
+            levels[0] = -np.inf
+
+        return levels
+
+    def thresholds(self, limits, first):
+        import numpy as np
+
+        return np.abs(first[self.channel] * limits)
+
+
+class MinRule:
+    """
+    Breached when a reading (or its magnitude, if absolute) falls below limit.
+    """
+
+    def __init__(self, channel: int, limit: float, message: str, absolute: bool = False):
+        self.channel = channel
+        self.limit = abs(limit) if absolute else limit
+        self.absolute = absolute
+        self.message = message
+
+    def breached(self, readings: tuple) -> bool:
+        value = readings[self.channel]
+        return (abs(value) if self.absolute else value) < self.limit
+
+    def accept(self, readings: tuple) -> None:
+        pass
+
+    def levels(self, readings, previous):
+        import numpy as np
+
+        # negated, so that falling below the limit is rising above the threshold like every other rule
+        values = readings[:, self.channel]
+        return -(np.abs(values) if self.absolute else values)
+
+    def thresholds(self, limits, first):
+        import numpy as np
+
+        return -(np.abs(limits) if self.absolute else limits)
+
+
+class MaxRule:
+    """
+    Breached when a reading (or its magnitude, if absolute) rises above limit.
+    """
+
+    def __init__(self, channel: int, limit: float, message: str, absolute: bool = False):
+        self.channel = channel
+        self.limit = abs(limit) if absolute else limit
+        self.absolute = absolute
+        self.message = message
+
+    def breached(self, readings: tuple) -> bool:
+        value = readings[self.channel]
+        return (abs(value) if self.absolute else value) > self.limit
+
+    def accept(self, readings: tuple) -> None:
+        pass
+
+    def levels(self, readings, previous):
+        import numpy as np
+
+        values = readings[:, self.channel]
+        return np.abs(values) if self.absolute else values
+
+    def thresholds(self, limits, first):
+        import numpy as np
+
+        return np.abs(limits) if self.absolute else limits
+
+
+class LimitRules:
+    """
+    An ordered set of limit rules, checked against (current, voltage, temperature) readings. Readings are only accepted
+    (becoming the previous or first reading of the rules that keep one) if no rule is breached.
+
+    For replaying recorded runs (see replay.py) every rule also turns a NumPy array of readings (one row per sample)
+    into levels, and candidate limits into thresholds, such that the first sample of a run that breaches the rule is
+    the first whose level is above the threshold. levels is given the last reading of the previous array of the same run
+    (None for the first array), thresholds the first reading of the run. Requires NumPy.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = tuple(rules)
+
+    def check(self, readings: tuple):
+        """
+        Returns the message of the first rule the readings breach, or None if they are within every limit.
+        """
+
+        for rule in self.rules:
+            if rule.breached(readings):
+                return rule.message
+
+        for rule in self.rules:
+            rule.accept(readings)
+
+        return None
+
+
+# the limits of the experiment in the order they are checked: (options section, option, rule, channel, message,
+# keyword arguments of the rule)
+LIMIT_OPTIONS = (
+    ("Power-Supply-options", "max-dV", MaxChangeRule, 1,
+     "The experiment stopped because the change in voltage exceeded the allowed tolerance for dV.", {}),
+    ("Power-Supply-options", "voltage-threshold", RelativeMaxRule, 1,
+     "The experiment stopped because the maximum voltage limit was reached.", {}),
+    ("Power-Supply-options", "minimum-voltage", MinRule, 1,
+     "The experiment stopped because the minimum voltage limit was reached.", {"absolute": True}),
+    ("Temperature-Controller-options", "max-temperature", MaxRule, 2,
+     "The experiment stopped because the maximum temperature was reached.", {}),
+)
+
+
+def compile_limits(bk_options: dict, temperature_options: dict) -> LimitRules:
+    """
+    Builds the limit rules of the experiment from the Power-Supply-options and Temperature-Controller-options. Every
+    call returns rules with their own previous and first readings, so each reader of the devices checks its own.
+    """
+
+    options = {"Power-Supply-options": bk_options, "Temperature-Controller-options": temperature_options}
+
+    return LimitRules([rule(channel, options[section][option], message, **kwargs)
+                       for section, option, rule, channel, message, kwargs in LIMIT_OPTIONS])
@@ -0,0 +1,111 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most burst records with the same logger and message template through per interval seconds. The number of
+    records suppressed is appended to the first record let through after the interval. Errors are never suppressed.
+    Messages logged with %-style arguments share a template, so repetitive messages are recognised as such.
+    """
+
+    max_templates = 1000
+
+    def __init__(self, burst: int = 10, interval: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (logger name, template) -> [start of the interval, records let through, records suppressed]
+        self.templates = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.msg)
+        state = self.templates.get(key)
+
+        if state is None or record.created - state[0] >= self.interval:
+            if state is not None and state[2] > 0:
+                record.msg = f"{record.msg} ({state[2]} similar messages suppressed)"
+
+            if len(self.templates) >= self.max_templates:
+                self._forget(record.created)
+
+            self.templates[key] = [record.created, 1, 0]
+            return True
+
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+
+        state[2] += 1
+        return False
+
+    def _forget(self, now: float) -> None:
+        for key, state in list(self.templates.items()):
+            if now - state[0] >= self.interval:
+                del self.templates[key]
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting (and the string formatting of the message arguments) to the listener thread.
+    Only immutable values are passed as log arguments, so the records can be handed over as they are.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            return super().prepare(record)
+
+        return record
+
+
+def attach_queue_logging(logger: logging.Logger, handlers: list, level=None,
+                         rate_limit: dict = None) -> QueueListener:
+    """
+    Attaches handlers to logger through a queue, so records are formatted and written by a background thread instead
+    of the caller (the event loop). Repetitive records are rate limited with the "burst" and "interval" of rate_limit
+    before they are queued. The listener is stopped (and the queue drained) when the process exits.
+    """
+
+    records = queue.SimpleQueue()
+    handler = _LazyQueueHandler(records)
+    rate_limit = rate_limit or {}
+    handler.addFilter(RateLimitFilter(rate_limit.get("burst", 10), rate_limit.get("interval", 60)))
+
+    for target in handlers:
+        if target.formatter is None:
+            target.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logger.addHandler(handler)
+
+    if level is not None:
+        logger.setLevel(level)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
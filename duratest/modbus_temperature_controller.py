@@ -0,0 +1,230 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import struct
+
+from temperature_controller import TemperatureController
+
+READ_HOLDING_REGISTERS = 0x03
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_REGISTERS = 0x10
+
+
+def _crc_table() -> tuple:
+    table = []
+
+    for byte in range(256):
+        crc = byte
+
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+
+        table.append(crc)
+
+    return tuple(table)
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data: bytes) -> int:
+    """
+    Returns the Modbus CRC-16 (polynomial 0xA001 reflected, initial value 0xFFFF) of data.
+    """
+
+    crc = 0xFFFF
+
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+
+    return crc
+
+
+def frame(address: int, function: int, data: bytes) -> bytes:
+    """
+    Returns the Modbus RTU frame of the given slave address, function code and data, with its CRC appended (low byte
+    first).
+    """
+
+    body = bytes((address, function)) + data
+    return body + struct.pack("<H", crc16(body))
+
+
+def check_frame(reply: bytes, address: int = None, function: int = None) -> bytes:
+    """
+    Returns the data of a Modbus RTU reply after its slave address and function code, without the CRC. Raises an IOError
+    if the reply is too short, its CRC does not match, it is an exception reply or it is not from the given slave
+    address or for the given function code (if given), as a late reply from another slave on a shared line would be.
+    """
+
+    if len(reply) < 5:
+        raise IOError(f"Incomplete Modbus reply {reply.hex()}")
+
+    if crc16(reply[:-2]) != struct.unpack("<H", reply[-2:])[0]:
+        raise IOError(f"Modbus reply {reply.hex()} failed the CRC check")
+
+    if address is not None and reply[0] != address:
+        raise IOError(f"Modbus reply {reply.hex()} is from slave {reply[0]}, not {address}")
+
+    if function is not None and reply[1] & 0x7F != function:
+        raise IOError(f"Modbus reply {reply.hex()} is to function {reply[1] & 0x7F}, not {function}")
+
+    if reply[1] & 0x80:
+        raise IOError(f"Modbus exception {reply[2]} in reply to function {reply[1] & 0x7F}")
+
+    return reply[2:-2]
+
+
+class ModbusTemperatureController(TemperatureController):
+    """
+    Talks Modbus RTU to the Omega CS8DPT instead of its ASCII protocol. The process value, setpoint and output
+    percentage are kept in consecutive registers, so they are read in a single transaction. The request frames that
+    never change are built once.
+    """
+
+    # TODO: Confirm the register map in testing, floats are assumed to take two registers, most significant word first
+    STATUS_REGISTER = 0x0280
+    SETPOINT_REGISTER = 0x0282
+    STATUS_REGISTERS = 6
+    RUN_MODE_REGISTER = 0x0240
+    RUN = 6
+    STANDBY = 8
+
+    # a Modbus RTU frame is at most 256 bytes long
+    max_reply_size = 256
+
+    def __init__(self, com_port: str, address: int = 1, bus=None):
+        self.address = address
+        self.read_status_frame = frame(address, READ_HOLDING_REGISTERS,
+                                       struct.pack(">HH", self.STATUS_REGISTER, self.STATUS_REGISTERS))
+        self.run_frame = frame(address, WRITE_SINGLE_REGISTER, struct.pack(">HH", self.RUN_MODE_REGISTER, self.RUN))
+        self.standby_frame = frame(address, WRITE_SINGLE_REGISTER,
+                                   struct.pack(">HH", self.RUN_MODE_REGISTER, self.STANDBY))
+        super().__init__(com_port, bus)
+
+    @property
+    def frame_gap(self) -> float:
+        # frames are delimited by 3.5 characters of silence (11 bits each), at least 1.75 ms at high baud rates
+        return max(3.5 * 11 / self.serial_settings["baudrate"], 0.00175)
+
+    async def verify_connection(self) -> bool:
+        """
+        Reads the status registers to verify that the Temperature Controller answers at its address, then puts it into
+        run mode.
+        """
+
+        if not self.ser.is_open:
+            self.logger.error("Serial connection with Temperature Controller was not opened.")
+            return False
+
+        try:
+            await self._read_status()
+            await self._write_register(self.run_frame, "run")
+        except IOError as err:
+            self.logger.error(f"Error in verifying Temperature Controller at Modbus address {self.address}: {err}")
+            return False
+
+        return True
+
+    async def set_temperature(self, temperature: float) -> bool:
+        """
+        Writes the setpoint register. Returns True if the Temperature Controller acknowledged the write, otherwise
+        False.
+        """
+
+        data = struct.pack(">HHBf", self.SETPOINT_REGISTER, 2, 4, temperature)
+
+        try:
+            await self._with_retries(self._write_register, frame(self.address, WRITE_MULTIPLE_REGISTERS, data), "setpoint")
+        except IOError as err:
+            self.logger.error(f"Error setting the temperature setpoint of the Temperature Controller: {err}")
+            return False
+
+        return True
+
+    async def get_temperature(self) -> float:
+        """
+        Returns the process value of the Temperature Controller in Celsius. Raises an IOError if the Temperature
+        Controller fails to answer with a valid frame, after retrying.
+        """
+
+        return (await self.get_status())[0]
+
+    async def get_status(self) -> tuple:
+        """
+        Returns (process value, setpoint, output percentage) read in one transaction. Raises an IOError if the
+        Temperature Controller fails to answer with a valid frame, after retrying.
+        """
+
+        return await self._with_retries(self._read_status)
+
+    async def reset(self) -> bool:
+        """
+        Puts the Temperature Controller into standby, where it no longer applies the setpoint.
+        """
+
+        await self._with_retries(self._write_register, self.standby_frame, "standby")
+
+        return True
+
+    async def _read_status(self) -> tuple:
+        reply = await self._send_frame(self.read_status_frame, "status", reply_size=5 + 2 * self.STATUS_REGISTERS)
+        data = check_frame(reply, self.address, READ_HOLDING_REGISTERS)
+
+        if len(data) != 1 + 2 * self.STATUS_REGISTERS or data[0] != 2 * self.STATUS_REGISTERS:
+            raise IOError(f"Unexpected Modbus reply {reply.hex()} to the status request")
+
+        # a float32 holds 7 significant digits, more would only show the rounding error of the conversion
+        return tuple(float(f"{value:.7g}") for value in struct.unpack(">fff", data[1:]))
+
+    async def _write_register(self, request: bytes, label: str) -> None:
+        """
+        Sends a write request, which the Temperature Controller acknowledges by echoing the register address (and the
+        value or count written). Raises an IOError if it does not.
+        """
+
+        reply = await self._send_frame(request, label, reply_size=8)
+        data = check_frame(reply, self.address, request[1])
+
+        if data != request[2:6]:
+            raise IOError(f"Unexpected Modbus reply {reply.hex()} to the {label} request")
+
+    def _coalescable(self, written: bytes) -> bool:
+        return written[1] == READ_HOLDING_REGISTERS
+
+    def _frame_length(self, buffer: bytearray):
+        """
+        Modbus RTU frames have no terminator, their length follows from the function code (and the byte count of a read
+        reply).
+        """
+
+        if len(buffer) < 3:
+            return None
+
+        function = buffer[1]
+
+        if function & 0x80:
+            length = 5
+        elif function == READ_HOLDING_REGISTERS:
+            length = 5 + buffer[2]
+        elif function in (WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_REGISTERS):
+            length = 8
+        else:
+            # an unknown function code is not a reply of ours, take what we have so its check fails
+            return len(buffer)
+
+        return length if len(buffer) >= length else None
@@ -16,43 +16,99 @@
 # SOFTWARE.
 
 import asyncio
-import subprocess
 import logging
+import time
+
+from instrumentation import metrics
 
 
 class PumpController:
 
-    def __init__(self, serial_number: str):
+    def __init__(self, serial_number: str, command_path: str = "pumpcontroller.exe", timeout: float = 10):
         self.serial_number = serial_number
+        self.command_path = command_path
+        self.timeout = timeout
         self.logger = logging.getLogger("serial")
+        self.metrics = metrics
+
+        # last state the pump acknowledged, None until the first command succeeds or after a command fails
+        self.is_on = None
 
     async def turn_on(self) -> bool:
         """
         Sends a request to the Pump Controller requesting the pump to turn on. Returns True if the pump acknowledges
-        a successful pump power on, otherwise returns False.
+        a successful pump power on, otherwise returns False. Does nothing if the pump is already known to be on.
         """
 
-        return await self._send_command("close")
+        return await self._set_state(True)
 
     async def turn_off(self) -> bool:
         """
         Sends a request to the Pump Controller requesting the pump to turn off. Returns True if the pump acknowledges
-        a successful pump shutoff, otherwise returns False.
+        a successful pump shutoff, otherwise returns False. Does nothing if the pump is already known to be off.
         """
 
-        return await self._send_command("open")
+        return await self._set_state(False)
+
+    async def _set_state(self, on: bool) -> bool:
+        if self.is_on == on:
+            return True
+
+        if not await self._send_command("close" if on else "open"):
+            self.is_on = None
+            return False
+
+        self.is_on = on
+        return True
 
     async def _send_command(self, command: str) -> bool:
+        """
+        Runs the pump controller command line program for the given command without blocking the event loop. Returns
+        True if the program exits successfully within the timeout, otherwise False.
+        """
+
+        started = time.perf_counter()
 
-        output = subprocess.run(["pumpcontroller.exe", self.serial_number, command, "01"])
-        self.logger.info(f"Wrote \"{command}\" to Pump controller")
+        try:
+            returncode = await self._run(command)
+        finally:
+            self.metrics.record(f"Pump Controller {command}", time.perf_counter() - started)
 
-        if output.returncode != 0:
-            self.logger.warning(f"The pump controller failed with exit code {output.returncode} for command: {command}")
+        if returncode is None:
+            self.metrics.count("Pump Controller errors")
+            return False
+
+        if returncode != 0:
+            self.metrics.count("Pump Controller errors")
+            self.logger.warning(f"The pump controller failed with exit code {returncode} for command: {command}")
             return False
 
         return True
 
+    async def _run(self, command: str):
+        """
+        Runs the pump controller program and returns its exit code, or None if it could not be run or timed out.
+        """
+
+        try:
+            process = await asyncio.create_subprocess_exec(self.command_path, self.serial_number, command, "01")
+        except OSError as err:
+            self.logger.error(f"Unable to run the pump controller {self.command_path}: {err}")
+            return None
+
+        self.logger.debug("Wrote \"%s\" to Pump controller", command)
+
+        try:
+            returncode = await asyncio.wait_for(process.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            self.metrics.count("Pump Controller timeouts")
+            self.logger.warning(f"The pump controller did not finish within {self.timeout} seconds for command: {command}")
+            return None
+
+        return returncode
+
     async def reset(self) -> bool:
         """
         Provided to match function calls given in other SerialCommunicator objects. Calls turn_off
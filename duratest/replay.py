@@ -0,0 +1,236 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import functools
+import itertools
+import json
+import sys
+
+import numpy as np
+
+from analysis import CSV_FORMAT, read_chunks
+from limits import LIMIT_OPTIONS, compile_limits
+from segmented_recording import load_manifest, read_range
+
+# the readings limits are checked against, in the order of the rules' channels
+CHANNELS = ("Current", "Voltage", "Temperature")
+
+
+def read_series(file_path: str, chunk_rows: int = 100000):
+    """
+    Yields (columns, rows) chunks of a .csv data file, binary recording or the manifest of a segmented recording, like
+    analysis.read_chunks.
+    """
+
+    if not file_path.endswith(".manifest.json"):
+        yield from read_chunks(file_path, chunk_rows)
+        return
+
+    columns = tuple(load_manifest(file_path)["columns"])
+    rows = read_range(file_path)
+
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+
+        if len(chunk) == 0:
+            return
+
+        yield columns, np.array(chunk, dtype=float)
+
+
+def _samples(chunks):
+    # the (time, readings) of the samples the experiment checked, gap rows of missed samples are never checked
+    for columns, rows in chunks:
+        times = rows[:, columns.index("Time")]
+        readings = rows[:, [columns.index(channel) for channel in CHANNELS]]
+        checked = ~np.isnan(readings).any(axis=1)
+
+        if checked.any():
+            yield times[checked], readings[checked]
+
+
+def replay_limits(chunks, options: dict, grid: dict = None) -> list:
+    """
+    Replays a recorded run against every combination of candidate limits in grid (option name to a list of values, for
+    the options in limits.LIMIT_OPTIONS) in a single pass over the chunks from read_series. Options left out of grid
+    keep their value from options (the parsed experiment.json). Returns one dict per combination, in the order of
+    itertools.product over the grid: its limits, and the sample, time and reason the experiment would have stopped (all
+    None if it would have run to the end).
+
+    The result is the same as checking every sample with limits.compile_limits, but each rule only needs a running
+    maximum of its levels, searched once for all of its candidate limits.
+    """
+
+    grid = grid or {}
+    unknown = set(grid) - {option for _, option, *_ in LIMIT_OPTIONS}
+
+    if unknown:
+        raise ValueError(f"{', '.join(sorted(unknown))} are not limit options, expected one of "
+                         f"{', '.join(option for _, option, *_ in LIMIT_OPTIONS)}.")
+
+    names = [option for _, option, *_ in LIMIT_OPTIONS]
+    names = sorted(set(names), key=names.index)
+    candidates = {}
+
+    for section, option, *_ in LIMIT_OPTIONS:
+        candidates[option] = np.asarray(grid.get(option, [options[section][option]]), dtype=float)
+
+    rules = compile_limits(options["Power-Supply-options"], options["Temperature-Controller-options"]).rules
+    limits = [candidates[option] for _, option, *_ in LIMIT_OPTIONS]
+    # per rule and candidate limit: the first sample that breaches it and its time, -1 while none has
+    breaches = [np.full(len(limit), -1) for limit in limits]
+    times = [np.full(len(limit), np.nan) for limit in limits]
+    highest = [-np.inf] * len(rules)
+    thresholds = None
+    previous = None
+    count = 0
+
+    for sample_times, readings in _samples(chunks):
+        if thresholds is None:
+            thresholds = [rule.thresholds(limit, readings[0]) for rule, limit in zip(rules, limits)]
+
+        for index, rule in enumerate(rules):
+            pending = np.flatnonzero(breaches[index] < 0)
+
+            if len(pending) == 0:
+                continue
+
+            running = np.maximum.accumulate(rule.levels(readings, previous))
+            np.maximum(running, highest[index], out=running)
+            highest[index] = running[-1]
+
+            positions = np.searchsorted(running, thresholds[index][pending], side="right")
+            found = positions < len(running)
+            breaches[index][pending[found]] = count + positions[found]
+            times[index][pending[found]] = sample_times[positions[found]]
+
+        previous = readings[-1]
+        count += len(readings)
+
+        if all((breach >= 0).all() for breach in breaches):
+            break
+
+    # the first sample any rule stops the experiment at, with ties going to the rule checked first
+    shape = tuple(len(candidates[name]) for name in names)
+    codes = []
+
+    for index, (_, option, *_) in enumerate(LIMIT_OPTIONS):
+        sample = np.where(breaches[index] < 0, count, breaches[index])
+        axes = [1] * len(names)
+        axes[names.index(option)] = len(sample)
+        codes.append((sample * len(rules) + index).reshape(axes))
+
+    stops = np.broadcast_to(functools.reduce(np.minimum, codes), shape)
+    results = []
+
+    for combination in np.ndindex(*shape):
+        result = {name: float(candidates[name][position]) for name, position in zip(names, combination)}
+        sample, index = divmod(int(stops[combination]), len(rules))
+
+        if sample == count:
+            result.update(sample=None, time=None, reason=None)
+        else:
+            candidate = combination[names.index(LIMIT_OPTIONS[index][1])]
+            result.update(sample=sample, time=float(times[index][candidate]), reason=rules[index].message)
+
+        results.append(result)
+
+    return results
+
+
+def check_limits(chunks, options: dict) -> dict:
+    """
+    Replays a recorded run through limits.compile_limits one sample at a time, exactly as the experiment checks its
+    samples. Returns the sample, time and reason the experiment would have stopped (all None if it would not have).
+    """
+
+    rules = compile_limits(options["Power-Supply-options"], options["Temperature-Controller-options"])
+    sample = 0
+
+    for sample_times, readings in _samples(chunks):
+        for timestamp, row in zip(sample_times.tolist(), readings.tolist()):
+            message = rules.check(tuple(row))
+
+            if message is not None:
+                return {"sample": sample, "time": timestamp, "reason": message}
+
+            sample += 1
+
+    return {"sample": None, "time": None, "reason": None}
+
+
+def _parse_grid(values: list) -> dict:
+    grid = {}
+
+    for value in values:
+        option, _, candidates = value.partition("=")
+
+        try:
+            grid[option.strip()] = [float(candidate) for candidate in candidates.split(",")]
+        except ValueError:
+            raise ValueError(f"{value} is not of the form option=value,value,...")
+
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded run against a grid of candidate limits and reports "
+                                                 "when and why each would have stopped the experiment.")
+    parser.add_argument("data", help="path of the .csv data file, binary recording or segmented recording manifest")
+    parser.add_argument("--config", default="experiment.json", help="experiment.json the run was recorded with")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="candidate values of a limit option, as max-dV=0.05,0.1,0.2 (repeat for each option)")
+    parser.add_argument("--output", help="write the results to this .csv file instead of the console")
+    parser.add_argument("--verify", action="store_true",
+                        help="also replay every combination one sample at a time and fail if the results differ")
+    parser.add_argument("--chunk-rows", type=int, default=100000, help="rows parsed at a time")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        options = json.load(f)
+
+    grid = _parse_grid(args.grid)
+    results = replay_limits(read_series(args.data, args.chunk_rows), options, grid)
+
+    if args.verify:
+        for result in results:
+            sections = {section: dict(options[section]) for section, *_ in LIMIT_OPTIONS}
+
+            for section, option, *_ in LIMIT_OPTIONS:
+                sections[section][option] = result[option]
+
+            expected = check_limits(read_series(args.data, args.chunk_rows), sections)
+
+            if any(result[key] != expected[key] for key in expected):
+                sys.exit(f"The replay of {result} differs from the sample by sample check {expected}.")
+
+    output = open(args.output, "w") if args.output else sys.stdout
+
+    try:
+        output.write(", ".join(results[0]) + "\n")
+
+        for result in results:
+            output.write(", ".join("" if value is None else CSV_FORMAT % value if isinstance(value, float)
+                                   else str(value) for value in result.values()) + "\n")
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import math
+import time
+
+from instrumentation import metrics
+from limits import LimitRules
+from sampling_scheduler import SamplingScheduler
+from serial_communicator import request_priority, request_retries
+
+
+class SafetyInterlock:
+    """
+    Polls the devices every period seconds, independently of the sampling rate of the data file, and checks the
+    readings against its own limit rules. Its requests are served before those of the sampling loop and the channel
+    pollers when they wait for the same device. A breach is detected at most one period (plus the time a poll takes) after it
+    occurs, however slowly the experiment is sampled, and trip (which switches the current off) is awaited at once.
+    Polls are not retried, a reading that fails is counted and skipped until the next poll, missed samples are handled
+    by the sampling loop.
+    """
+
+    def __init__(self, read, limits: LimitRules, period: float, trip, logger: logging.Logger = None, metrics=metrics):
+        self.read = read
+        self.limits = limits
+        self.period = period
+        self.trip = trip
+        self.logger = logger or logging.getLogger("experiment")
+        self.metrics = metrics
+
+        # performance counter time the poll that detected the breach started at, None until a limit is breached
+        self.breached_at = None
+
+    async def run(self) -> str:
+        """
+        Polls until a limit is breached, trips and returns the message of the breached limit. Runs until it is cancelled
+        if no limit is breached.
+        """
+
+        request_priority.set(0)
+        scheduler = SamplingScheduler(self.period, math.inf, self.logger)
+
+        async for _ in scheduler.ticks():
+            polled = time.perf_counter()
+
+            # a poll that fails is not retried, the next poll is due sooner than the retries would be
+            retries = request_retries.set(0)
+
+            try:
+                readings = await self.read()
+            except IOError as err:
+                self.metrics.count("Safety interlock read errors")
+                self.logger.warning("The safety interlock could not read the devices: %s", err)
+                continue
+            finally:
+                request_retries.reset(retries)
+
+            message = self.limits.check(readings)
+            self.metrics.record("Safety interlock poll", time.perf_counter() - polled)
+
+            if message is not None:
+                self.breached_at = polled
+                self.logger.error(f"Safety interlock tripped on readings {readings}: {message}")
+                await self.trip()
+                self.record_reaction()
+                return message
+
+    def record_reaction(self) -> None:
+        """
+        Records the reaction time from the start of the poll that detected the breach until now, called once trip has
+        switched the current off.
+        """
+
+        reaction = time.perf_counter() - self.breached_at
+        self.metrics.record("Safety interlock reaction", reaction)
+        self.logger.info(f"Safety interlock reaction time: {reaction * 1000:.1f} ms from the breaching poll to the "
+                         f"current being switched off (polling every {self.period * 1000:.0f} ms)")
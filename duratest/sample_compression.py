@@ -0,0 +1,178 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+
+
+class DeadbandCompressor:
+    """
+    Keeps a row only if a channel moved by more than its tolerance since the last kept row, or max_interval seconds
+    passed since then. Holding the last kept row reproduces every dropped reading within the tolerance.
+    """
+
+    def __init__(self, tolerances: tuple, max_interval: float):
+        self.tolerances = tolerances
+        self.max_interval = max_interval
+        self.kept = None
+        self.last = None
+
+    def add(self, row: tuple) -> list:
+        """
+        Adds a (timestamp, value...) row and returns the rows to write, in order.
+        """
+
+        self.last = row
+
+        if self.kept is not None and not _is_gap(row) and not _is_gap(self.kept):
+            moved = any(abs(value - kept) > tolerance
+                        for value, kept, tolerance in zip(row[1:], self.kept[1:], self.tolerances))
+
+            if not moved and row[0] - self.kept[0] < self.max_interval:
+                return []
+
+        self.kept = row
+        return [row]
+
+    def flush(self) -> list:
+        """
+        Returns the last row if it was dropped, so the end of the experiment is always written.
+        """
+
+        if self.last is None or self.last is self.kept:
+            return []
+
+        self.kept = self.last
+        return [self.last]
+
+
+class SwingingDoorCompressor:
+    """
+    Swinging door compression: a row is only kept when a straight line from the last kept row can no longer pass within
+    the tolerance of every reading since, for every channel. Linear interpolation between the kept rows reproduces every
+    dropped reading within its tolerance. Kept rows are at most max_interval seconds apart, and gap markers (rows of
+    nan) are always kept.
+    """
+
+    def __init__(self, tolerances: tuple, max_interval: float):
+        self.tolerances = tolerances
+        self.max_interval = max_interval
+        self.archive = None
+        self.held = None
+        self.upper = None
+        self.lower = None
+
+    def add(self, row: tuple) -> list:
+        """
+        Adds a (timestamp, value...) row and returns the rows to write, in order. The row kept when the doors close is
+        the one before the row that closed them, so the returned rows can be older than the row added.
+        """
+
+        if _is_gap(row):
+            written = self.flush() + [row]
+            self.archive = None
+            return written
+
+        if self.archive is None:
+            self._archive(row)
+            return [row]
+
+        if self.held is None:
+            return self._start_segment(row, [])
+
+        if row[0] - self.archive[0] < self.max_interval and self._inside_doors(row):
+            self._narrow_doors(row)
+            self.held = row
+            return []
+
+        held = self.held
+        self._archive(held)
+
+        return self._start_segment(row, [held])
+
+    def flush(self) -> list:
+        """
+        Returns the last row if it has not been written yet, so the end of the experiment is always written.
+        """
+
+        if self.held is None:
+            return []
+
+        held = self.held
+        self._archive(held)
+        return [held]
+
+    def _start_segment(self, row: tuple, written: list) -> list:
+        if row[0] - self.archive[0] >= self.max_interval:
+            self._archive(row)
+            return written + [row]
+
+        self._narrow_doors(row)
+        self.held = row
+        return written
+
+    def _archive(self, row: tuple) -> None:
+        self.archive = row
+        self.held = None
+        self.upper = [math.inf] * len(self.tolerances)
+        self.lower = [-math.inf] * len(self.tolerances)
+
+    def _inside_doors(self, row: tuple) -> bool:
+        dt = row[0] - self.archive[0]
+
+        if dt <= 0:
+            return False
+
+        for i, value in enumerate(row[1:]):
+            slope = (value - self.archive[i + 1]) / dt
+
+            if not self.lower[i] <= slope <= self.upper[i]:
+                return False
+
+        return True
+
+    def _narrow_doors(self, row: tuple) -> None:
+        dt = row[0] - self.archive[0]
+
+        if dt <= 0:
+            return
+
+        for i, (value, tolerance) in enumerate(zip(row[1:], self.tolerances)):
+            self.upper[i] = min(self.upper[i], (value + tolerance - self.archive[i + 1]) / dt)
+            self.lower[i] = max(self.lower[i], (value - tolerance - self.archive[i + 1]) / dt)
+
+
+def _is_gap(row: tuple) -> bool:
+    return any(math.isnan(value) for value in row[1:])
+
+
+def create_compressor(options: dict, columns: tuple):
+    """
+    Creates the compressor described by the "compression" options of experiment.json for rows of the given columns
+    (the first being Time). Channels without a tolerance are kept exactly.
+    """
+
+    tolerances = tuple(options.get("tolerances", {}).get(column, 0) for column in columns[1:])
+    max_interval = options.get("max-interval", 600)
+    method = options.get("method", "swinging-door")
+
+    if method == "swinging-door":
+        return SwingingDoorCompressor(tolerances, max_interval)
+
+    if method == "deadband":
+        return DeadbandCompressor(tolerances, max_interval)
+
+    raise ValueError(f"Unknown compression method {method}, expected \"swinging-door\" or \"deadband\".")
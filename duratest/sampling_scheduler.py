@@ -0,0 +1,197 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import logging
+import time
+
+
+class SamplingScheduler:
+    """
+    Produces sampling ticks on absolute deadlines (start + n * period) of the monotonic clock, so the time spent
+    reading the devices never accumulates into drift, and the run ends at the true duration. A tick whose deadline has
+    already passed when the previous sample finishes is skipped (and counted) rather than run late. The period may be
+    changed between ticks, the deadlines then restart from the previous one (previous + n * new period).
+    """
+
+    def __init__(self, period: float, duration: float, logger: logging.Logger = None):
+        if period <= 0:
+            raise ValueError("The sampling period must be greater than zero.")
+
+        self.logger = logger or logging.getLogger("experiment")
+        self.period = period
+        self.duration = duration
+        self.start_time = None
+        self.base_time = None
+        self.base_period = period
+        self.base_index = 0
+
+        self.tick_count = 0
+        self.missed_ticks = 0
+        self.overruns = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    async def ticks(self):
+        """
+        Asynchronously yields the scheduled time of each tick in seconds since the start of the run. The time between
+        yields is spent in the body of the caller's loop, which is what overruns are measured against.
+        """
+
+        self.start_time = time.monotonic()
+        end_time = self.start_time + self.duration
+        deadline = self.start_time
+        self.base_time = self.start_time
+        self.base_period = self.period
+        self.base_index = 0
+
+        while deadline < end_time:
+            now = time.monotonic()
+
+            if now < deadline:
+                await asyncio.sleep(deadline - now)
+                now = time.monotonic()
+
+            self._record_jitter(now - deadline)
+            yield deadline - self.start_time
+
+            deadline = self._next_deadline(deadline, time.monotonic())
+
+        now = time.monotonic()
+
+        if now < end_time:
+            await asyncio.sleep(end_time - now)
+
+    def elapsed(self) -> float:
+        """
+        Returns the time in seconds since the first tick, measured on the monotonic clock.
+        """
+
+        if self.start_time is None:
+            return 0.0
+
+        return time.monotonic() - self.start_time
+
+    def stats(self) -> dict:
+        """
+        Returns the tick, overrun and jitter accounting of the run so far.
+        """
+
+        return {
+            "ticks": self.tick_count,
+            "missed-ticks": self.missed_ticks,
+            "overruns": self.overruns,
+            "mean-jitter": self.total_jitter / self.tick_count if self.tick_count else 0.0,
+            "max-jitter": self.max_jitter,
+        }
+
+    def _record_jitter(self, jitter: float) -> None:
+        self.tick_count += 1
+        self.last_jitter = jitter
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+
+    def _next_deadline(self, deadline: float, finished: float) -> float:
+        """
+        Returns the next deadline after a tick scheduled at deadline finished processing at finished. If processing ran
+        past one or more following deadlines, those ticks are skipped and recorded as an overrun. Deadlines are computed
+        as base + n * period rather than by repeated addition, so rounding errors never accumulate.
+        """
+
+        if self.period != self.base_period:
+            self.base_time = deadline
+            self.base_period = self.period
+            self.base_index = 0
+
+        next_deadline = self.base_time + (self.base_index + 1) * self.period
+
+        if finished <= next_deadline:
+            self.base_index += 1
+            return next_deadline
+
+        missed = int((finished - deadline) // self.period)
+        self.overruns += 1
+        self.missed_ticks += missed
+        self.logger.warning("Sample at %.3f s took %.3f s, longer than the sampling rate of %s s. Skipping %d sample(s).",
+                            deadline - self.start_time, finished - deadline, self.period, missed)
+
+        self.base_index += missed + 1
+        return self.base_time + self.base_index * self.period
+
+
+class AdaptiveSampling:
+    """
+    Chooses the sampling period from the dynamics of the readings. The fast rate is used during the first fast-duration
+    seconds, while the voltage or temperature changes faster than max-dV/dt or max-dT/dt, and while a reading is within
+    limit-margin (a fraction) of the max-dV, voltage-threshold, minimum-voltage or max-temperature limits. Otherwise
+    the period grows by the backoff factor with every sample, up to the slow rate.
+    """
+
+    def __init__(self, options: dict, sampling_rate: float, bk_options: dict, temperature_options: dict):
+        self.fast_rate = options.get("fast-rate", sampling_rate)
+        self.slow_rate = options.get("slow-rate", 60 * sampling_rate)
+        self.max_voltage_slope = options.get("max-dV/dt", 1e-4)
+        self.max_temperature_slope = options.get("max-dT/dt", 0.01)
+        self.backoff = options.get("backoff", 2)
+        self.fast_duration = options.get("fast-duration", 3600)
+        self.limit_margin = options.get("limit-margin", 0.05)
+
+        self.max_dv = abs(bk_options["max-dV"])
+        self.voltage_threshold = bk_options["voltage-threshold"]
+        self.minimum_voltage = abs(bk_options["minimum-voltage"])
+        self.max_temperature = temperature_options["max-temperature"]
+
+        self.period = self.fast_rate
+        self.start_time = None
+        self.starting_voltage = None
+        self.previous = None
+
+    def next_period(self, timestamp: float, current: float, voltage: float, temperature: float) -> float:
+        """
+        Returns the period until the next sample after the readings taken at timestamp (in seconds).
+        """
+
+        if self.start_time is None:
+            self.start_time = timestamp
+            self.starting_voltage = voltage
+
+        fast = timestamp - self.start_time < self.fast_duration
+        dv = 0.0
+
+        if self.previous is not None:
+            previous_time, previous_voltage, previous_temperature = self.previous
+            dv = voltage - previous_voltage
+            dt = timestamp - previous_time
+
+            if dt > 0:
+                fast = fast or abs(dv) / dt > self.max_voltage_slope
+                fast = fast or abs(temperature - previous_temperature) / dt > self.max_temperature_slope
+
+        fast = fast or self._near_limits(voltage, temperature, dv)
+        self.previous = (timestamp, voltage, temperature)
+        self.period = self.fast_rate if fast else min(self.period * self.backoff, self.slow_rate)
+
+        return self.period
+
+    def _near_limits(self, voltage: float, temperature: float, dv: float) -> bool:
+        margin = self.limit_margin
+
+        return (abs(dv) > self.max_dv * (1 - margin)
+                or abs(voltage) > abs(self.starting_voltage * self.voltage_threshold) * (1 - margin)
+                or abs(voltage) < self.minimum_voltage * (1 + margin)
+                or temperature > self.max_temperature * (1 - margin))
@@ -0,0 +1,338 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import lzma
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from data_writer import DataWriter
+
+# strftime format of the segment key of each period, segments are partitioned on UTC time
+PERIODS = {"hourly": "%Y%m%d%H", "daily": "%Y%m%d"}
+COMPRESSION = {"gzip": (".gz", gzip.open), "lzma": (".xz", lzma.open)}
+
+
+class SegmentedDataWriter(DataWriter):
+    """
+    Writes the rows of the experiment to a new .csv file for every hour or day (on the UTC time of the rows), so the
+    files of a long experiment stay small enough to copy while it runs. Each segment is a complete .csv file with its
+    own header. Closed segments are compressed by a background worker, and a manifest next to the segments records
+    every segment's file, time range, row count and minimum and maximum of each channel, which read_range uses to only
+    open the segments of the requested time range.
+    """
+
+    def __init__(self, save_path: str, columns: tuple, period: str = "daily", compression: str = "gzip",
+                 flush_rows: int = 60, flush_interval: float = 5.0, fsync_interval: float = 60.0,
+                 logger: logging.Logger = None):
+        if period not in PERIODS:
+            raise ValueError(f"Unknown segment period {period}, expected one of {', '.join(PERIODS)}")
+
+        if compression is not None and compression not in COMPRESSION:
+            raise ValueError(f"Unknown segment compression {compression}, expected one of {', '.join(COMPRESSION)}")
+
+        super().__init__(save_path, columns, flush_rows, flush_interval, fsync_interval, logger)
+        self.period = period
+        self.compression = compression
+        self.root, self.extension = os.path.splitext(save_path)
+        self.manifest_path = f"{self.root}.manifest.json"
+
+        # the manifest is updated by the writer thread and the compression worker
+        self.manifest_lock = threading.Lock()
+        self.manifest = load_manifest(self.manifest_path) if os.path.exists(self.manifest_path) else {
+            "columns": list(columns), "period": period, "segments": []}
+
+        if self.manifest["columns"] != list(columns):
+            raise IOError(f"{self.manifest_path} was recorded with columns {self.manifest['columns']}, not {columns}.")
+
+        self.segment_key = None
+        self.segment = None
+        # time range, row count, minimum and maximum of the current segment, kept apart from the manifest while the
+        # writer thread updates them
+        self.statistics = None
+        self.compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"Compressor {save_path}")
+
+    async def close(self, footer: dict = None) -> None:
+        """
+        Closes the last segment like DataWriter.close, then compresses it and waits for the compression worker to
+        finish, in the default executor.
+        """
+
+        if not self.thread.is_alive():
+            return
+
+        await super().close(footer)
+        await asyncio.get_running_loop().run_in_executor(None, self._finish)
+
+    def _open_file(self):
+        return self._open_segment(self._segment_key(time.time()))
+
+    def _segment_key(self, timestamp: float) -> str:
+        return time.strftime(PERIODS[self.period], time.gmtime(timestamp))
+
+    def _open_segment(self, key: str):
+        """
+        Opens the segment of the given key for appending and adds it to the manifest. A segment that was already closed
+        (by an earlier run of the experiment) is continued in a new part. A segment left open (by a run that did not
+        close it) is continued, with its statistics taken from the rows in its file, as the manifest only has them once
+        a segment is closed.
+        """
+
+        directory = os.path.dirname(self.manifest_path)
+
+        with self.manifest_lock:
+            closed = {segment["key"] for segment in self.manifest["segments"] if segment["closed"]}
+            part = 1
+            name = f"{os.path.basename(self.root)}.{key}{self.extension}"
+
+            while f"{key}.{part}" in closed:
+                part += 1
+                name = f"{os.path.basename(self.root)}.{key}-{part}{self.extension}"
+
+            segment = next((segment for segment in self.manifest["segments"] if segment["file"] == name), None)
+
+            if segment is None:
+                segment = {"key": f"{key}.{part}", "file": name, "start": None, "end": None, "rows": 0,
+                           "min": {}, "max": {}, "closed": False}
+                self.manifest["segments"].append(segment)
+                self._save_manifest()
+
+        self.statistics = {"start": None, "end": None, "rows": 0, "min": {}, "max": {}}
+        path = os.path.join(directory, name)
+
+        if os.path.exists(path):
+            for row in _read_rows(path):
+                self._update_statistics(row)
+
+        self.segment_key = key
+        self.segment = segment
+
+        return open(path, "a")
+
+    def _buffer_row(self, row: tuple, buffer: list) -> None:
+        key = self._segment_key(row[0])
+
+        if key != self.segment_key:
+            self._flush(buffer)
+            buffer.clear()
+            self._close_segment()
+            self.file = self._open_segment(key)
+            self._write_header()
+
+        self._update_statistics(row)
+        buffer.append(self._encode_row(row))
+
+    def _update_statistics(self, row: tuple) -> None:
+        statistics = self.statistics
+        statistics["start"] = row[0] if statistics["start"] is None else statistics["start"]
+        statistics["end"] = row[0]
+        statistics["rows"] += 1
+        minimum = statistics["min"]
+        maximum = statistics["max"]
+
+        for column, value in zip(self.columns[1:], row[1:]):
+            # gap rows (nan) do not take part in the minimum and maximum
+            if math.isnan(value):
+                continue
+
+            if column not in minimum or value < minimum[column]:
+                minimum[column] = value
+
+            if column not in maximum or value > maximum[column]:
+                maximum[column] = value
+
+    def _write_footer(self, footer: dict) -> None:
+        super()._write_footer(footer)
+
+        with self.manifest_lock:
+            self.manifest["summary"] = footer
+
+    def _close_segment(self) -> None:
+        """
+        Fsyncs and closes the current segment, marks it closed in the manifest and hands it to the compression worker.
+        Runs on the writer thread.
+        """
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        # the segment opened with the writer is empty if the first row already belongs to the next period
+        if self.statistics["rows"] == 0:
+            with self.manifest_lock:
+                self.manifest["segments"].remove(self.segment)
+                self._save_manifest()
+
+            os.remove(os.path.join(os.path.dirname(self.manifest_path), self.segment["file"]))
+            return
+
+        self._index_segment()
+
+    def _finish(self) -> None:
+        # the writer thread has closed the file of the last segment
+        if self.segment is not None and not self.segment["closed"]:
+            self._index_segment()
+
+        self.compressor.shutdown(wait=True)
+
+    def _index_segment(self) -> None:
+        """
+        Records the statistics of the closed current segment in the manifest and hands it to the compression worker.
+        """
+
+        with self.manifest_lock:
+            self.segment.update(self.statistics, closed=True)
+            self._save_manifest()
+
+        if self.compression is not None:
+            self.compressor.submit(self._compress, self.segment)
+
+    def _compress(self, segment: dict) -> None:
+        """
+        Compresses a closed segment next to the original, then swaps the compressed file into the manifest and removes
+        the original. Runs on the compression worker, a failure leaves the segment uncompressed.
+        """
+
+        directory = os.path.dirname(self.manifest_path)
+        source = os.path.join(directory, segment["file"])
+        suffix, open_compressed = COMPRESSION[self.compression]
+        target = source + suffix
+
+        try:
+            with open(source, "rb") as original, open_compressed(target + ".tmp", "wb") as compressed:
+                shutil.copyfileobj(original, compressed)
+
+            os.replace(target + ".tmp", target)
+
+            with self.manifest_lock:
+                segment["file"] = os.path.basename(target)
+                self._save_manifest()
+
+            os.remove(source)
+        except OSError as err:
+            self.logger.error(f"Error compressing {source}: {err}")
+
+    def _save_manifest(self) -> None:
+        # written to a temporary file first, so a crash never leaves a truncated manifest behind
+        temporary = self.manifest_path + ".tmp"
+
+        with open(temporary, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+
+        os.replace(temporary, self.manifest_path)
+
+
+def load_manifest(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _open_segment_file(path: str):
+    for suffix, open_compressed in COMPRESSION.values():
+        if path.endswith(suffix):
+            return open_compressed(path, "rt")
+
+    return open(path)
+
+
+def read_range(manifest_path: str, start: float = -math.inf, end: float = math.inf):
+    """
+    Yields the rows (as tuples of floats) of the segmented recording with a time from start to end (seconds since the
+    epoch). Only the segments whose time range overlaps the requested range are opened; segments still being written
+    are always opened.
+    """
+
+    manifest = load_manifest(manifest_path)
+    directory = os.path.dirname(manifest_path)
+
+    for segment in manifest["segments"]:
+        if segment["closed"] and (segment["start"] is None or segment["end"] < start or segment["start"] > end):
+            continue
+
+        for row in _read_rows(os.path.join(directory, segment["file"])):
+            if row[0] > end:
+                break
+
+            if row[0] >= start:
+                yield row
+
+
+def _read_rows(path: str):
+    """
+    Yields the rows (as tuples of floats) of a segment, compressed or not. Only rows with a value for every column of
+    the header are yielded.
+    """
+
+    columns = None
+
+    with _open_segment_file(path) as f:
+        for line in f:
+            # skip the footer, and the header (repeated whenever a segment was reopened) once it has been counted
+            if line.startswith("#"):
+                continue
+
+            if not line[:1].isdigit():
+                columns = len(line.split(",")) if columns is None else columns
+                continue
+
+            values = line.split(",")
+
+            # the last line of a segment is cut short if the experiment stopped while it was written, possibly just
+            # after a comma
+            if len(values) != columns:
+                continue
+
+            try:
+                yield tuple(float(value) for value in values)
+            except ValueError:
+                continue
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes the rows of a segmented recording within a time range as .csv")
+    parser.add_argument("manifest", help="path of the manifest of the segmented recording")
+    parser.add_argument("--start", type=_parse_time, default=-math.inf,
+                        help="start of the range, in seconds since the epoch or as an ISO 8601 time")
+    parser.add_argument("--end", type=_parse_time, default=math.inf,
+                        help="end of the range, in seconds since the epoch or as an ISO 8601 time")
+    args = parser.parse_args()
+
+    print(", ".join(load_manifest(args.manifest)["columns"]))
+
+    for row in read_range(args.manifest, args.start, args.end):
+        sys.stdout.write(", ".join(map(str, row)) + "\n")
+
+
+if __name__ == "__main__":
+    main()
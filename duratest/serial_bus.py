@@ -0,0 +1,258 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from serial_communicator import request_priority, SerialConnectionError
+
+
+class _Request:
+    """
+    An operation queued on the bus and the future its callers wait for. Requests are marked as started when the worker
+    takes them, so entries queued twice (see SerialBus.submit) are only run once.
+    """
+
+    def __init__(self, operation, key, priority: int):
+        self.operation = operation
+        self.key = key
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
+        self.callers = 0
+        self.started = False
+
+
+class SerialBus:
+    """
+    One serial port shared by several addressed devices, such as Modbus temperature controllers on an RS-485 multi-drop
+    line. Devices hand their requests to the bus instead of locking a port of their own, and a single worker runs them
+    back to back: every device has its own queue ordered by request_priority, and the queues take turns (the lowest
+    priority first), so a device that keeps asking can not starve the others. A read that is requested again while the
+    first request for it is still queued is answered by the same exchange.
+    """
+
+    def __init__(self, com_port: str):
+        self.logger = logging.getLogger("serial")
+        self.com_port = com_port
+        self.ser = None
+        self.open_port = None
+        self.devices = []
+        self.queues = {}
+        # the queued (not yet started) requests that can be shared by their key
+        self.queued = {}
+        self.order = itertools.count()
+        self.turn = -1
+        self.worker = None
+        self.quiet_until = 0.0
+
+    def attach(self, device):
+        """
+        Adds device to the bus and returns the shared port, which is opened by the first device attached. Raises a
+        ValueError if the device needs other port settings than the devices already on the bus or has the same address
+        as one of them, and an IOError if the port can not be opened.
+        """
+
+        for other in self.devices:
+            if device.serial_settings != other.serial_settings:
+                raise ValueError(f"{device.name} needs other serial settings than {other.name} on {self.com_port}.")
+
+            if getattr(device, "address", None) is not None and getattr(other, "address", None) == device.address:
+                raise ValueError(f"More than one device has address {device.address} on {self.com_port}.")
+
+        if self.ser is None:
+            self.ser = device._open_port()
+            self.open_port = device._open_port
+
+        self.devices.append(device)
+        self.queues[device] = []
+
+        return self.ser
+
+    def detach(self, device) -> None:
+        """
+        Removes device from the bus, its requests that have not started yet fail with a SerialConnectionError. Once the
+        last device has left, the shared port is closed and the bus is dropped from buses, so the next device attached
+        to the com port (for example by a station that is run again) starts a new bus.
+        """
+
+        if device not in self.queues:
+            return
+
+        for _, _, request in self.queues.pop(device):
+            self._forget(request)
+
+            if not request.started and not request.future.done():
+                request.future.set_exception(SerialConnectionError(f"{device.name} has left the bus {self.com_port}."))
+
+        self.devices.remove(device)
+        self.turn = -1
+
+        if self.devices:
+            return
+
+        try:
+            self.ser.close()
+        except (IOError, OSError):
+            pass
+
+        self.ser = None
+        self.open_port = None
+
+        if buses.get(self.com_port) is self:
+            del buses[self.com_port]
+
+    async def submit(self, device, operation, key=None):
+        """
+        Queues operation (a coroutine function without arguments) behind the other requests of device and returns its
+        result once the worker has run it. While a request with the same key is still queued, no new request is made and
+        its result is returned to both callers (its priority rises to that of the new caller if that is higher).
+        """
+
+        if device not in self.queues:
+            raise SerialConnectionError(f"{device.name} is not on the bus {self.com_port}.")
+
+        priority = request_priority.get()
+        request = self.queued.get(key) if key is not None else None
+
+        if request is None:
+            request = _Request(operation, key, priority)
+            heapq.heappush(self.queues[device], (priority, next(self.order), request))
+
+            if key is not None:
+                self.queued[key] = request
+
+            if self.worker is None or self.worker.done():
+                self.worker = asyncio.get_running_loop().create_task(self._run())
+        else:
+            device.metrics.count(f"{device.name} coalesced requests")
+
+            if priority < request.priority:
+                request.priority = priority
+                heapq.heappush(self.queues[device], (priority, next(self.order), request))
+
+        request.callers += 1
+
+        try:
+            # shielded, so one caller giving up does not cancel the request for the others
+            return await asyncio.shield(request.future)
+        except asyncio.CancelledError:
+            request.callers -= 1
+
+            # a request that has already been written is left to finish, so the bus never carries half a frame
+            if request.callers == 0 and not request.started:
+                request.future.cancel()
+                self._forget(request)
+
+            raise
+
+    async def reopen(self, device) -> None:
+        """
+        Closes the shared port and opens it again between two requests, for every device on the bus. Requests to reopen
+        the port made while one is queued are answered by the same reopening. Raises an IOError if the port can not be
+        opened.
+        """
+
+        await self.submit(device, self._reopen, "reopen")
+
+    async def _reopen(self) -> None:
+        try:
+            self.ser.close()
+        except (IOError, OSError):
+            pass
+
+        self.ser = self.open_port()
+
+        for device in self.devices:
+            device.ser = self.ser
+            device.port_failed = False
+
+    async def _run(self) -> None:
+        # runs until every queue is empty, submit starts it again for the next request
+        while True:
+            device = self._next_device()
+
+            if device is None:
+                return
+
+            _, _, request = heapq.heappop(self.queues[device])
+
+            if request.started or request.future.done():
+                self._forget(request)
+                continue
+
+            request.started = True
+            self._forget(request)
+
+            # some protocols need the line to be silent for a while between a reply and the next request
+            delay = self.quiet_until - time.monotonic()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                result = await request.operation()
+            except Exception as err:
+                if not request.future.done():
+                    request.future.set_exception(err)
+            else:
+                if not request.future.done():
+                    request.future.set_result(result)
+            finally:
+                self.quiet_until = time.monotonic() + device.frame_gap
+
+    def _forget(self, request: _Request) -> None:
+        # a request that is started or cancelled can no longer be shared by a new caller
+        if request.key is not None and self.queued.get(request.key) is request:
+            del self.queued[request.key]
+
+    def _next_device(self):
+        """
+        Returns the device whose request is next, or None if no request is queued. Among the devices with the most urgent
+        request first in their queue, the one after the device served last takes its turn.
+        """
+
+        chosen = None
+
+        for step in range(1, len(self.devices) + 1):
+            device = self.devices[(self.turn + step) % len(self.devices)]
+            queue = self.queues[device]
+
+            if queue and (chosen is None or queue[0][0] < self.queues[chosen][0][0]):
+                chosen = device
+
+        if chosen is not None:
+            self.turn = self.devices.index(chosen)
+
+        return chosen
+
+
+# the buses of the process by com port, shared by the devices of every station
+buses = {}
+
+
+def shared_bus(com_port: str) -> SerialBus:
+    """
+    Returns the bus of com_port, created when it is first asked for.
+    """
+
+    if com_port not in buses:
+        buses[com_port] = SerialBus(com_port)
+
+    return buses[com_port]
@@ -16,19 +16,450 @@
 # SOFTWARE.
 
 import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import os
+import time
 import serial
 import logging
 
+from instrumentation import metrics
+
+# priority of the requests made by the current task, lower values are served first when requests wait for a device
+request_priority = contextvars.ContextVar("request_priority", default=10)
+
+# retries of the failed requests made by the current task, None for the retries of the device
+request_retries = contextvars.ContextVar("request_retries", default=None)
+
+
+class SerialConnectionError(IOError):
+    """
+    Raised when the serial port itself fails, as opposed to the device giving no reply or an unreadable one. The port
+    is closed and opened again before the next request.
+    """
+
+
+class PriorityLock:
+    """
+    Lock that hands itself to the waiting task with the lowest request_priority (in the order they started waiting among
+    equal priorities), instead of strictly first come first served.
+    """
+
+    def __init__(self):
+        self.locked = False
+        self.waiters = []
+        self.order = itertools.count()
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    async def acquire(self) -> None:
+        # while the lock is free nobody is waiting for it, release hands it straight to the next waiter
+        if not self.locked:
+            self.locked = True
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (request_priority.get(), next(self.order), waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # the lock may have been handed over just before the cancellation, pass it on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self.waiters:
+            _, _, waiter = heapq.heappop(self.waiters)
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.locked = False
+
+
+class DeviceHealth:
+    """
+    Keeps track of the failed and recovered requests of a device. A device is healthy while its last request succeeded.
+    """
+
+    def __init__(self):
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.recoveries = 0
+        self.reconnects = 0
+        self.last_error = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_failures == 0
+
+    def record_failure(self, err: Exception) -> None:
+        self.consecutive_failures += 1
+        self.failures += 1
+        self.last_error = str(err)
+
+    def record_success(self) -> int:
+        """
+        Records a successful request, returns the number of failed requests it recovered the device from.
+        """
+
+        recovered = self.consecutive_failures
+        self.consecutive_failures = 0
+
+        if recovered > 0:
+            self.recoveries += 1
+
+        return recovered
+
+    def summary(self) -> dict:
+        return {"healthy": self.healthy, "consecutive-failures": self.consecutive_failures, "failures": self.failures,
+                "recoveries": self.recoveries, "reconnects": self.reconnects, "last-error": self.last_error}
+
 
 class SerialCommunicator:
-    def __init__(self, com_port: str, name: str):
+    # replies from the supported devices end with "\r\n" (some firmware sends a bare "\n"), reading stops as soon as the
+    # line feed arrives
+    terminator = b"\n"
+    max_reply_size = 100
+
+    # failed readings are retried this many times, waiting backoff seconds before the first retry and twice as long
+    # before each following one (up to max_backoff seconds)
+    retries = 2
+    backoff = 0.1
+    max_backoff = 2.0
+
+    # seconds of silence a shared bus keeps on the line after a reply to this device, before the next request
+    frame_gap = 0.0
+
+    def __init__(self, com_port: str, name: str, bus=None, **serial_settings):
+        """
+        Devices given a bus (see serial_bus.SerialBus) share its port with the other devices on it, their requests are
+        queued on the bus instead of taking serial_lock.
+        """
+
         self.logger = logging.getLogger("serial")
         self.com_port = com_port
         self.name = name
-        self.serial_lock = asyncio.Lock()
+        self.bus = bus
+        self.serial_lock = PriorityLock()
+        self.metrics = metrics
+        self.serial_settings = serial_settings
+        self.ser = None
+        self.health = DeviceHealth()
+        # set when the port itself failed, it is reopened before the next request
+        self.port_failed = False
 
     async def verify_connection(self) -> bool:
         raise NotImplementedError("Connection must be verified before proceeding")
 
-    async def _send_command(self, command: str) -> str:
-        raise NotImplementedError("Device must have usable send command interface.")
\ No newline at end of file
+    def _open_serial(self) -> None:
+        """
+        Opens the serial port with the settings given by the device, or joins the port of its bus. Pyserial will throw
+        an IOError if the com port is not available to connect with.
+        """
+
+        try:
+            self.ser = self._open_port() if self.bus is None else self.bus.attach(self)
+        except IOError as err:
+            # a warning, so a port that stays unavailable while it is reopened is rate limited like the failed requests
+            self.logger.warning("Error opening serial communication with %s: %s", self.name, err)
+            raise err
+
+    def _open_port(self):
+        return serial.Serial(port=self.com_port, **self.serial_settings)
+
+    def close(self) -> None:
+        """
+        Closes the serial port, or leaves the bus of the device, which closes the shared port once every device has left.
+        """
+
+        if self.bus is not None:
+            self.bus.detach(self)
+        elif self.ser is not None:
+            try:
+                self.ser.close()
+            except (IOError, OSError):
+                pass
+
+        self.ser = None
+
+    async def _reconnect(self) -> None:
+        """
+        Closes the serial port and opens it again, for example after a USB-serial adapter was briefly unplugged. Raises
+        an IOError if the port can not be opened.
+        """
+
+        if self.bus is not None:
+            self.health.reconnects += 1
+            self.metrics.count(f"{self.name} reconnects")
+            self.logger.warning("Reopening the serial bus %s of %s", self.bus.com_port, self.name)
+            await self.bus.reopen(self)
+            return
+
+        async with self.serial_lock:
+            self.health.reconnects += 1
+            self.metrics.count(f"{self.name} reconnects")
+            self.logger.warning("Reopening the serial connection with %s", self.name)
+
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except (IOError, OSError):
+                    pass
+
+            self._open_serial()
+            self.port_failed = False
+
+    def max_request_time(self) -> float:
+        """
+        Returns the longest time in seconds a request made through _with_retries can take while the device does not
+        answer: the port timeout of every attempt and the backoff before every retry.
+        """
+
+        timeout = self.serial_settings.get("timeout") or 0.0
+        backoff = sum(min(self.backoff * 2 ** attempt, self.max_backoff) for attempt in range(self.retries))
+
+        return timeout * (self.retries + 1) + backoff
+
+    async def _with_retries(self, request, *args):
+        """
+        Returns the result of awaiting request(*args), a single request to the device that raises an IOError if the
+        device fails to answer or gives an unreadable answer. Failed requests are retried with exponential backoff and
+        the port is reopened first if it failed, also when it failed during an earlier request. Raises the last IOError
+        once every retry failed. Tasks that set request_retries make that many retries instead of the device's.
+        """
+
+        retries = request_retries.get()
+
+        if retries is None:
+            retries = self.retries
+
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+
+            try:
+                if self.port_failed:
+                    await self._reconnect()
+
+                result = await request(*args)
+            except IOError as err:
+                error = err
+                self.health.record_failure(err)
+                self.metrics.count(f"{self.name} failed requests")
+                continue
+
+            recovered = self.health.record_success()
+
+            if recovered > 0:
+                self.logger.warning("Communication with %s recovered after %d failed request(s)", self.name, recovered)
+
+            return result
+
+        raise error
+
+    def _format_command(self, command: str) -> bytes:
+        """
+        Returns the bytes written to the device for the given ascii command.
+        """
+
+        return bytes(str().join((command, "\r\n")), "ascii")
+
+    def _expects_reply(self, command: str) -> bool:
+        """
+        Returns True if the device answers the given command. Commands without an answer do not wait for a reply.
+        """
+
+        return True
+
+    def _coalescable(self, written: bytes) -> bool:
+        """
+        Returns True if the request only reads from the device, so requests for the same bytes made while it waits on a
+        shared bus can be answered by one exchange.
+        """
+
+        return False
+
+    def _frame_length(self, buffer: bytearray):
+        """
+        Returns the length of the complete reply at the start of buffer, or None if the reply is not complete yet.
+        """
+
+        end = buffer.find(self.terminator)
+
+        if end < 0:
+            return None
+
+        return end + len(self.terminator)
+
+    async def _send_command(self, command: str, reply_size: int = None) -> str:
+        """
+        Locks the resource, sends ascii text to the serial port and waits for the reply without blocking the event loop.
+        Returns as soon as a complete reply is read (or the port timeout passes) in ascii format with the terminator
+        stripped. Replies longer than max_reply_size, such as bulk transfers, are read by giving their maximum
+        reply_size. Raises an IOError if the serial connection fails.
+        """
+
+        reply = await self._send_frame(self._format_command(command),
+                                       command.split(" ", 1)[0],
+                                       self._expects_reply(command),
+                                       reply_size)
+
+        return reply.decode("ascii", errors="replace").rstrip("\r\n")
+
+    async def _send_frame(self, written: bytes, label: str, expects_reply: bool = True, reply_size: int = None) -> bytes:
+        """
+        Locks the resource, writes the raw bytes to the serial port and returns the raw reply, read as _send_command
+        does. The time the exchange takes is recorded under label. Used directly by devices with binary protocols.
+        Raises an IOError if the serial connection fails.
+        """
+
+        if self.ser is None:
+            self.port_failed = True
+            raise SerialConnectionError(f"Attempting to write to {self.name} which has no software serial connection.")
+
+        waiting = time.perf_counter()
+
+        if self.bus is not None:
+            transfer = functools.partial(self._transfer, written, label, expects_reply, reply_size, waiting)
+            reply = await self.bus.submit(self, transfer, (self, written) if self._coalescable(written) else None)
+        else:
+            async with self.serial_lock:
+                reply = await self._transfer(written, label, expects_reply, reply_size, waiting)
+
+        if expects_reply and self._frame_length(bytearray(reply)) is None:
+            self.metrics.count(f"{self.name} timeouts")
+
+        return reply
+
+    async def _transfer(self, written: bytes, label: str, expects_reply: bool, reply_size: int, waiting: float) -> bytes:
+        # runs while holding serial_lock, or as the turn of the device on its bus
+        started = time.perf_counter()
+        self.metrics.record(f"{self.name} lock wait", started - waiting)
+        self.logger.debug("Wrote %r to %s", written, self.name)
+        try:
+            return await self._exchange(written, expects_reply, reply_size)
+        except IOError as err:
+            self.metrics.count(f"{self.name} errors")
+            # every failed request of a dropout is logged, as a warning so it can be rate limited
+            self.logger.warning("Serial communication with %s failed: %s", self.name, err)
+            self.port_failed = True
+            raise SerialConnectionError(f"Serial communication with {self.name} failed: {err}") from err
+        finally:
+            self.metrics.record(f"{self.name} {label}", time.perf_counter() - started)
+
+    async def _exchange(self, payload: bytes, expects_reply: bool = True, reply_size: int = None) -> bytes:
+        """
+        Writes the payload to the serial port and returns the raw reply. Stale bytes left over from an earlier reply
+        that timed out are discarded first, so a late reply can never be attributed to the wrong command. Replies of up
+        to reply_size bytes (max_reply_size by default) are read, the time it takes to transfer them at the baud rate of
+        the port is added to the port timeout.
+        """
+
+        self.ser.reset_input_buffer()
+        self.ser.write(payload)
+
+        if not expects_reply:
+            return bytes()
+
+        size = self.max_reply_size if reply_size is None else reply_size
+        timeout = self.ser.timeout
+
+        if reply_size is not None and timeout is not None:
+            # 10 bits on the wire for every byte (start, 8 data and stop bit)
+            timeout += reply_size * 10 / self.serial_settings.get("baudrate", 9600)
+
+        fd = self._reader_fd()
+
+        if fd is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self._read_reply_blocking, size, timeout)
+
+        return await self._read_reply_async(fd, size, timeout)
+
+    def _reader_fd(self):
+        """
+        Returns the file descriptor of the serial port if the event loop can watch it directly (POSIX), otherwise None,
+        in which case the reply is read from the default executor instead.
+        """
+
+        if os.name != "posix" or not hasattr(self.ser, "fileno"):
+            return None
+
+        try:
+            return self.ser.fileno()
+        except (OSError, ValueError):
+            return None
+
+    async def _read_reply_async(self, fd: int, size: int, timeout: float) -> bytes:
+        """
+        Reads a single reply of up to size bytes by letting the event loop notify us whenever the port is readable.
+        Returns whatever was read so far if timeout passes before the reply is complete.
+        """
+
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        buffer = bytearray()
+
+        def on_readable():
+            if reply.done():
+                return
+
+            try:
+                chunk = os.read(fd, size)
+            except BlockingIOError:
+                return
+            except OSError as err:
+                reply.set_exception(IOError(f"Error reading from {self.name}: {err}"))
+                return
+
+            if len(chunk) == 0:
+                reply.set_exception(IOError(f"The serial connection with {self.name} was closed."))
+                return
+
+            buffer.extend(chunk)
+            length = self._frame_length(buffer)
+
+            if length is not None:
+                reply.set_result(bytes(buffer[:length]))
+            elif len(buffer) >= size:
+                reply.set_result(bytes(buffer))
+
+        loop.add_reader(fd, on_readable)
+
+        try:
+            return await asyncio.wait_for(reply, timeout)
+        except asyncio.TimeoutError:
+            return bytes(buffer)
+        finally:
+            loop.remove_reader(fd)
+
+    def _read_reply_blocking(self, size: int, timeout: float) -> bytes:
+        """
+        Reads a single reply of up to size bytes with blocking reads, used on platforms where the event loop can not
+        watch the serial port (Windows). Runs in the default executor so the event loop keeps running while we wait.
+        """
+
+        buffer = bytearray()
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while len(buffer) < size:
+            chunk = self.ser.read(max(1, min(self.ser.in_waiting, size - len(buffer))))
+            buffer.extend(chunk)
+            length = self._frame_length(buffer)
+
+            if length is not None:
+                return bytes(buffer[:length])
+
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+        return bytes(buffer)
@@ -0,0 +1,542 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import math
+import random
+import struct
+import time
+
+import serial
+
+from bk_operator import BKOperator
+from modbus_temperature_controller import (check_frame, frame, ModbusTemperatureController, READ_HOLDING_REGISTERS,
+                                           WRITE_MULTIPLE_REGISTERS, WRITE_SINGLE_REGISTER)
+from pump_controller import PumpController
+from temperature_controller import TemperatureController
+
+
+class SimulationOptions:
+    """
+    Options shared by every simulated device, read from the "simulation" object of the device in experiment.json.
+    Latencies are in seconds of real time, drift and time constants in simulated time, which runs time-scale times
+    faster than real time so that long experiments can be run in minutes.
+    """
+
+    def __init__(self, options: dict):
+        self.options = options
+        self.latency = options.get("latency", 0.01)
+        self.latency_jitter = options.get("latency-jitter", 0)
+        self.noise = options.get("noise", 0)
+        self.drift = options.get("drift", 0)
+        self.time_scale = options.get("time-scale", 1)
+        self.fault_rate = options.get("fault-rate", 0)
+        self.faults = options.get("faults", ["timeout", "garbage"])
+        self.random = random.Random(options.get("seed"))
+        self.start = time.monotonic()
+
+    def get(self, key: str, default):
+        return self.options.get(key, default)
+
+    def hours(self) -> float:
+        """
+        Returns the simulated time in hours since the device was created.
+        """
+
+        return (time.monotonic() - self.start) * self.time_scale / 3600
+
+    def reply_delay(self) -> float:
+        return self.latency + self.random.uniform(0, self.latency_jitter)
+
+    def gaussian(self, scale: float) -> float:
+        return self.random.gauss(0, scale) if scale else 0.0
+
+    def next_fault(self):
+        """
+        Returns the name of the fault to inject into the next reply, or None for a healthy reply.
+        """
+
+        if self.fault_rate and self.random.random() < self.fault_rate:
+            return self.random.choice(self.faults)
+
+        return None
+
+
+class SimulatedSerial:
+    """
+    Stands in for a serial.Serial port connected to a simulated device. Each command written is answered by the
+    device model after the simulated latency, and faults are injected into the replies at the configured rate: a
+    "timeout" never replies, "garbage" replies with an unreadable value and "disconnect" fails like an unplugged
+    USB-serial adapter until the port is opened again.
+    """
+
+    def __init__(self, model, options: SimulationOptions, terminator: bytes, timeout: float = 1):
+        self.model = model
+        self.options = options
+        self.terminator = terminator
+        self.timeout = timeout
+        self.is_open = True
+
+        self.received = bytearray()
+        self.reply = bytearray()
+        self.ready_at = 0.0
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.reply) if time.monotonic() >= self.ready_at else 0
+
+    def write(self, data: bytes) -> int:
+        self._check_open()
+        self.received.extend(data)
+
+        while self.terminator in self.received:
+            line, _, rest = bytes(self.received).partition(self.terminator)
+            self.received = bytearray(rest)
+            self._answer(line.decode("ascii").strip())
+
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        self._check_open()
+        now = time.monotonic()
+
+        if len(self.reply) == 0 or self.ready_at > now:
+            wait = self.timeout if len(self.reply) == 0 else self.ready_at - now
+            time.sleep(max(0.0, min(wait, self.timeout)))
+            self._check_open()
+
+            if len(self.reply) == 0 or self.ready_at > time.monotonic():
+                return bytes()
+
+        data = bytes(self.reply[:size])
+        del self.reply[:size]
+        return data
+
+    def reset_input_buffer(self) -> None:
+        self.reply.clear()
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def _check_open(self) -> None:
+        if not self.is_open:
+            raise serial.SerialException("The simulated serial port is not open.")
+
+    def _answer(self, command: str) -> None:
+        response = self.model.respond(command)
+        fault = self.options.next_fault()
+
+        if fault == "disconnect":
+            self.is_open = False
+            raise serial.SerialException("Simulated disconnect of the serial port.")
+
+        if response is None or fault == "timeout":
+            return
+
+        if fault == "garbage":
+            response = "\x15ERR"
+
+        if isinstance(response, str):
+            response = bytes(response, "ascii") + self.terminator
+
+        self.reply.extend(response)
+        self.ready_at = time.monotonic() + self.options.reply_delay()
+
+
+class SimulatedPowerSupply:
+    """
+    Models the SCPI command set of the BK 9115 driving an electrolyzer cell. The cell voltage is
+    base-voltage + resistance * current, rising by drift volts per simulated hour as the cell degrades. After a step of
+    the current the readings settle exponentially with the transient-time-constant (in real seconds), which shows in
+    bursts captured with the acquisition commands.
+    """
+
+    def __init__(self, options: SimulationOptions):
+        self.options = options
+        self.base_voltage = options.get("base-voltage", 1.45)
+        self.resistance = options.get("resistance", 0.5)
+        # the supply does not answer while it reboots after *RST
+        self.reset_time = options.get("reset-time", 0.5)
+        self.busy_until = 0.0
+        self.time_constant = options.get("transient-time-constant", 0.002)
+        # (time of the last step, (current, voltage) before it, (current, voltage) after it)
+        self.step = None
+        # (points, interval, start time) of the running or last capture, and its readings once fetched
+        self.acquisition = None
+        self.captured = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.output = False
+        self.current_setpoint = 0.0
+        self.voltage_setpoint = 0.0
+        self.voltage_protection = math.inf
+        self.points = 100
+        self.interval = 0.001
+
+    def measure(self) -> tuple:
+        """
+        Returns the (current, voltage) the supply would measure right now.
+        """
+
+        if not self.output:
+            return 0.0, 0.0
+
+        current, voltage = self._steady_state()
+        voltage = min(voltage + self.options.gaussian(self.options.noise), self.voltage_protection)
+        current = current + self.options.gaussian(self.options.noise)
+
+        return round(current, 3), round(voltage, 3)
+
+    def _steady_state(self) -> tuple:
+        """
+        Returns the (current, voltage) without noise the readings settle at.
+        """
+
+        if not self.output:
+            return 0.0, 0.0
+
+        degradation = self.options.drift * self.options.hours()
+        voltage = self.base_voltage + self.resistance * self.current_setpoint + degradation
+
+        return self.current_setpoint, min(voltage, self.voltage_protection)
+
+    def _level(self, at: float) -> tuple:
+        """
+        Returns the (current, voltage) without noise at the given monotonic time, following the last step.
+        """
+
+        if self.step is None or at < self.step[0]:
+            return self._steady_state() if self.step is None else self.step[1]
+
+        started, before, after = self.step
+        remaining = math.exp(-(at - started) / self.time_constant)
+
+        return tuple(final + (initial - final) * remaining for initial, final in zip(before, after))
+
+    def _switch(self, change) -> None:
+        """
+        Applies change (a function changing the setpoint or output) as a step the readings settle from.
+        """
+
+        now = time.monotonic()
+        before = self._level(now)
+        change()
+        self.step = (now, before, self._steady_state())
+
+    def _capture(self) -> list:
+        """
+        Returns the (current, voltage) readings of the last completed capture, or None while it is still running.
+        """
+
+        if self.captured is None:
+            points, interval, started = self.acquisition
+
+            if time.monotonic() < started + points * interval:
+                return None
+
+            noise = self.options.noise
+            self.captured = [tuple(round(value + self.options.gaussian(noise), 4)
+                                   for value in self._level(started + i * interval)) for i in range(points)]
+
+        return self.captured
+
+    def respond(self, command: str):
+        """
+        Returns the reply to a (possibly compound) command, or None for commands without a reply.
+        """
+
+        replies = [self._respond_single(part.strip().lstrip(":").lower()) for part in command.split(";")]
+        replies = [reply for reply in replies if reply is not None]
+
+        return ";".join(replies) if replies else None
+
+    def _respond_single(self, command: str):
+        name, _, argument = command.partition(" ")
+
+        if time.monotonic() < self.busy_until:
+            return None
+        if name == "*idn?":
+            return "B&K Precision, 9115, SIMULATED, 1.0"
+        if name == "*opc?":
+            # the operation is not complete (and *OPC? not answered) until a running capture is done
+            return None if self.acquisition is not None and self._capture() is None else "1"
+        if name == "*rst":
+            self._switch(self._reset)
+            self.busy_until = time.monotonic() + self.reset_time
+        elif name == "curr":
+            self._switch(lambda: setattr(self, "current_setpoint", float(argument)))
+        elif name == "volt":
+            self.voltage_setpoint = float(argument)
+        elif name == "volt:prot":
+            self.voltage_protection = float(argument)
+        elif name == "outp":
+            self._switch(lambda: setattr(self, "output", argument.strip() in ("1", "on")))
+        elif name == "acq:poin":
+            self.points = int(argument)
+        elif name == "acq:tint":
+            self.interval = float(argument)
+        elif name == "acq:init":
+            self.acquisition = (self.points, self.interval, time.monotonic())
+            self.captured = None
+        elif name in ("fetc:curr:arr?", "fetc:volt:arr?"):
+            readings = self._capture() if self.acquisition is not None else None
+
+            if readings is None:
+                return None
+
+            channel = 0 if name == "fetc:curr:arr?" else 1
+            return ",".join(str(reading[channel]) for reading in readings)
+        elif name == "meas:curr?":
+            return str(self.measure()[0])
+        elif name == "meas:volt?":
+            return str(self.measure()[1])
+        elif name == "meas:pow?":
+            current, voltage = self.measure()
+            return str(round(current * voltage, 3))
+        elif name == "meas:all?":
+            current, voltage = self.measure()
+            return f"{voltage},{current},{round(current * voltage, 3)}"
+        elif name.endswith("?"):
+            return "0"
+
+        return None
+
+
+class SimulatedOmegaController:
+    """
+    Models the ASCII command set of the Omega CS8DPT. When running (WF23 6) the temperature approaches the setpoint as
+    a first order system with the time-constant given in simulated seconds, in standby (WF23 8) it cools towards the
+    ambient temperature.
+    """
+
+    def __init__(self, options: SimulationOptions):
+        self.options = options
+        self.ambient = options.get("ambient-temperature", 22.0)
+        self.time_constant = options.get("time-constant", 300.0)
+        self.temperature = self.ambient
+        self.setpoint = self.ambient
+        self.running = False
+        self.updated = options.hours()
+
+    def measure(self) -> float:
+        hours = self.options.hours()
+        target = self.setpoint if self.running else self.ambient
+        settled = 1 - math.exp(-(hours - self.updated) * 3600 / self.time_constant)
+        self.temperature += (target - self.temperature) * settled
+        self.updated = hours
+
+        return round(self.temperature + self.options.drift * hours + self.options.gaussian(self.options.noise), 1)
+
+    def respond(self, command: str):
+        command = command.lstrip("*")
+        name, _, argument = command.partition(" ")
+
+        if name == "G110":
+            return str(self.measure())
+        if name == "GF20":
+            return "CS8DPT SIMULATED"
+        if name == "W400":
+            self.measure()
+            self.setpoint = float(argument)
+        elif name == "WF23":
+            self.measure()
+            self.running = argument.strip() == "6"
+
+        return command
+
+
+class SimulatedModbusSerial(SimulatedSerial):
+    """
+    SimulatedSerial for binary protocols without a terminator: every write is a complete request frame, as Modbus RTU
+    frames are delimited by silence on the line.
+    """
+
+    def __init__(self, model, options: SimulationOptions, timeout: float = 1):
+        super().__init__(model, options, bytes(), timeout)
+
+    def write(self, data: bytes) -> int:
+        self._check_open()
+        self._answer(bytes(data))
+
+        return len(data)
+
+
+class SimulatedModbusSlave:
+    """
+    Modbus RTU slave with the register map of ModbusTemperatureController, backed by the temperature model of
+    SimulatedOmegaController. Requests for other addresses or with a bad CRC are not answered, like on a real bus. The
+    output percentage follows a proportional band of "proportional-band" degrees below the setpoint.
+    """
+
+    def __init__(self, options: SimulationOptions, address: int = 1):
+        self.address = address
+        self.controller = SimulatedOmegaController(options)
+        self.proportional_band = options.get("proportional-band", 10.0)
+
+    def registers(self) -> bytes:
+        """
+        Returns the status registers: process value, setpoint and output percentage.
+        """
+
+        temperature = self.controller.measure()
+        setpoint = self.controller.setpoint
+        output = 0.0
+
+        if self.controller.running:
+            output = min(100.0, max(0.0, (setpoint - temperature) / self.proportional_band * 100))
+
+        return struct.pack(">fff", temperature, setpoint, output)
+
+    def respond(self, request: bytes):
+        try:
+            data = check_frame(request)
+        except IOError:
+            return None
+
+        if request[0] != self.address:
+            return None
+
+        function = request[1]
+
+        if len(data) < 4:
+            return self._exception(function, 3)
+
+        register, count = struct.unpack(">HH", data[:4])
+        controller = ModbusTemperatureController
+
+        if function == READ_HOLDING_REGISTERS:
+            if register != controller.STATUS_REGISTER or count > controller.STATUS_REGISTERS:
+                return self._exception(function, 2)
+
+            values = self.registers()[:2 * count]
+            return frame(self.address, function, bytes((len(values),)) + values)
+
+        if function == WRITE_SINGLE_REGISTER and register == controller.RUN_MODE_REGISTER:
+            self.controller.measure()
+            self.controller.running = count == controller.RUN
+            return request
+        if function == WRITE_MULTIPLE_REGISTERS and register == controller.SETPOINT_REGISTER and count == 2:
+            self.controller.measure()
+            self.controller.setpoint = struct.unpack(">f", data[5:9])[0]
+            return frame(self.address, function, data[:4])
+        if function in (WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_REGISTERS):
+            return self._exception(function, 2)
+
+        return self._exception(function, 1)
+
+    def _exception(self, function: int, code: int) -> bytes:
+        return frame(self.address, function | 0x80, bytes((code,)))
+
+
+class SimulatedModbusLine:
+    """
+    The Modbus slaves on one simulated RS-485 line. Every slave sees every request and only the one at its address
+    answers.
+    """
+
+    def __init__(self):
+        self.slaves = []
+
+    def respond(self, request: bytes):
+        for slave in self.slaves:
+            response = slave.respond(request)
+
+            if response is not None:
+                return response
+
+        return None
+
+
+class SimulatedBKOperator(BKOperator):
+    """
+    BKOperator talking to a SimulatedPowerSupply through a SimulatedSerial port instead of a real com port.
+    """
+
+    def __init__(self, simulation: dict, measure_all: bool = False):
+        self.simulation = SimulationOptions(simulation)
+        self.model = SimulatedPowerSupply(self.simulation)
+        super().__init__("simulated", measure_all)
+
+    def _open_port(self):
+        return SimulatedSerial(self.model, self.simulation, b"\r\n", self.serial_settings["timeout"])
+
+
+class SimulatedTemperatureController(TemperatureController):
+    """
+    TemperatureController talking to a SimulatedOmegaController through a SimulatedSerial port instead of a real com
+    port.
+    """
+
+    def __init__(self, simulation: dict):
+        self.simulation = SimulationOptions(simulation)
+        self.model = SimulatedOmegaController(self.simulation)
+        super().__init__("simulated")
+
+    def _open_port(self):
+        return SimulatedSerial(self.model, self.simulation, b"\r\n", self.serial_settings["timeout"])
+
+
+class SimulatedPumpController(PumpController):
+    """
+    PumpController that simulates the pump controller program instead of running it.
+    """
+
+    def __init__(self, serial_number: str, simulation: dict):
+        super().__init__(serial_number)
+        self.simulation = SimulationOptions(simulation)
+
+    async def _run(self, command: str):
+        await asyncio.sleep(self.simulation.reply_delay())
+        self.logger.debug("Wrote \"%s\" to simulated Pump controller", command)
+
+        # a faulty pump controller program exits with an error code
+        return 1 if self.simulation.next_fault() is not None else 0
+
+
+class SimulatedModbusTemperatureController(ModbusTemperatureController):
+    """
+    ModbusTemperatureController talking to a SimulatedModbusSlave through a SimulatedModbusSerial port instead of a real
+    com port. On a bus, the slaves of every controller share the line of the port opened by the first (and its latency
+    and faults).
+    """
+
+    def __init__(self, simulation: dict, address: int = 1, bus=None):
+        self.simulation = SimulationOptions(simulation)
+        self.model = SimulatedModbusSlave(self.simulation, address)
+        super().__init__("simulated", address, bus)
+
+    def _open_port(self):
+        # a port opened again keeps the line, and the slaves on it
+        line = SimulatedModbusLine() if self.ser is None else self.ser.model
+        return SimulatedModbusSerial(line, self.simulation, self.serial_settings["timeout"])
+
+    def _open_serial(self) -> None:
+        super()._open_serial()
+
+        if self.model not in self.ser.model.slaves:
+            self.ser.model.slaves.append(self.model)
+
+    def close(self) -> None:
+        # the slave leaves the line with its controller, a controller at the same address may take its place
+        if self.ser is not None and self.model in self.ser.model.slaves:
+            self.ser.model.slaves.remove(self.model)
+
+        super().close()
@@ -0,0 +1,70 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+
+from experiment import Experiment, ExperimentError
+from os import path
+
+
+class StationRunner:
+    """
+    Runs the experiments of several stations (one experiment.json each) concurrently on one event loop. Every station
+    keeps its own devices, limits, data file and log file, and an error in one station only stops that station.
+    """
+
+    def __init__(self, config_paths: list):
+        self.stations = {}
+
+        for config_path in config_paths:
+            station = Experiment(config_path, path.splitext(path.basename(config_path))[0])
+
+            if station.station in self.stations:
+                raise ExperimentError(f"Station {station.station} is configured more than once.")
+
+            self.stations[station.station] = station
+
+    async def run(self) -> dict:
+        """
+        Runs every station until it finishes or fails and puts its devices at rest. Returns a dictionary with the
+        outcome of each station by name.
+        """
+
+        names = list(self.stations)
+        outcomes = await asyncio.gather(*(self._run_station(name) for name in names))
+
+        return dict(zip(names, outcomes))
+
+    async def _run_station(self, name: str) -> str:
+        experiment = self.stations[name]
+
+        try:
+            await experiment.run_experiment()
+            outcome = "Experiment finished successfully"
+        except ExperimentError as err:
+            outcome = str(err)
+            experiment.logger.fatal(f"{err} Aborting Experiment.")
+        except Exception as err:
+            outcome = f"Unexpected error: {err}"
+            experiment.logger.exception(f"Unexpected error in station {name}. Aborting Experiment.")
+        finally:
+            try:
+                await experiment.stop_experiment()
+            except Exception as err:
+                experiment.logger.error(f"Failed to put station {name} at rest: {err}")
+
+        return outcome
@@ -0,0 +1,233 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+from array import array
+from urllib.parse import parse_qs, urlsplit
+
+# appended to the Sec-WebSocket-Key of the client to accept the WebSocket handshake (RFC 6455)
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B63"
+
+
+class RingBuffer:
+    """
+    Fixed-size history of rows of float columns, stored in a single preallocated array. Once full, every appended row
+    overwrites the oldest one, so memory use never grows during an experiment.
+    """
+
+    def __init__(self, capacity: int, width: int):
+        self.capacity = capacity
+        self.width = width
+        self.data = array("d", [math.nan]) * (capacity * width)
+        self.next = 0
+        self.count = 0
+
+    def append(self, row: tuple) -> None:
+        offset = self.next * self.width
+        self.data[offset:offset + self.width] = array("d", row)
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        if self.count == 0:
+            return None
+
+        offset = ((self.next - 1) % self.capacity) * self.width
+        return tuple(self.data[offset:offset + self.width])
+
+    def history(self, rows: int = None) -> list:
+        """
+        Returns the last rows rows (every row by default), oldest first.
+        """
+
+        rows = self.count if rows is None else max(0, min(rows, self.count))
+        first = (self.next - rows) % self.capacity
+
+        return [tuple(self.data[i * self.width:(i + 1) * self.width])
+                for i in ((first + j) % self.capacity for j in range(rows))]
+
+
+class TelemetryServer:
+    """
+    Local HTTP server publishing the readings of a running experiment from memory, without touching the data file:
+    * GET /latest returns the latest row and the values derived from it as JSON
+    * GET /history?rows=N returns the last N rows held in the ring buffer as JSON
+    * GET /metrics returns the latency histograms and counters of the experiment as JSON
+    * GET /stream pushes every new row as it is published, as Server-Sent Events, or as WebSocket text messages when
+      the request asks for a WebSocket upgrade
+    Publishing encodes each update once and hands it to a bounded queue per subscriber without waiting, dropping the
+    oldest update of a subscriber that falls behind, so no number of dashboards can slow the sampling loop.
+    """
+
+    def __init__(self, columns: tuple, host: str = "127.0.0.1", port: int = 8080, history_size: int = 3600,
+                 client_queue_size: int = 100, logger: logging.Logger = None, metrics=None):
+        self.logger = logger or logging.getLogger("experiment")
+        self.columns = columns
+        self.host = host
+        self.port = port
+        self.client_queue_size = client_queue_size
+        self.metrics = metrics
+        self.history = RingBuffer(history_size, len(columns))
+        self.derived = {}
+        self.subscribers = set()
+        # the tasks handling connected clients, streams only end when they are cancelled
+        self.clients = set()
+        self.server = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.logger.info(f"Serving telemetry on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self.server is None:
+            return
+
+        self.server.close()
+
+        for client in self.clients:
+            client.cancel()
+
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        await self.server.wait_closed()
+        self.server = None
+
+    def publish(self, row: tuple, derived: dict = None) -> None:
+        """
+        Adds a row to the history and pushes it, with the values derived from it, to every subscriber. Never blocks.
+        """
+
+        self.history.append(row)
+        self.derived = derived or {}
+
+        if not self.subscribers:
+            return
+
+        message = self._encode(self._latest())
+
+        for subscriber in self.subscribers:
+            if subscriber.full():
+                subscriber.get_nowait()
+
+            subscriber.put_nowait(message)
+
+    def _latest(self) -> dict:
+        row = self.history.latest()
+
+        if row is None:
+            return {}
+
+        return {"row": dict(zip(self.columns, map(_json_number, row))),
+                "derived": {key: _json_number(value) for key, value in self.derived.items()}}
+
+    @staticmethod
+    def _encode(content) -> bytes:
+        return json.dumps(content).encode("utf-8")
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = asyncio.current_task()
+        self.clients.add(client)
+
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = request.decode("latin-1").split("\r\n")
+            method, target, _ = request_line.split(" ", 2)
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(":") for line in header_lines if line)}
+            url = urlsplit(target)
+
+            if method != "GET":
+                await self._respond(writer, "405 Method Not Allowed", {"error": "Only GET is supported."})
+            elif url.path == "/latest":
+                await self._respond(writer, "200 OK", self._latest())
+            elif url.path == "/history":
+                rows = parse_qs(url.query).get("rows", [None])[0]
+                history = self.history.history(None if rows is None else int(rows))
+                await self._respond(writer, "200 OK", {"columns": list(self.columns),
+                                                       "rows": [list(map(_json_number, row)) for row in history]})
+            elif url.path == "/metrics" and self.metrics is not None:
+                await self._respond(writer, "200 OK", self.metrics.report())
+            elif url.path == "/stream":
+                await self._stream(writer, headers)
+            else:
+                await self._respond(writer, "404 Not Found", {"error": f"Unknown path {url.path}."})
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: str, content) -> None:
+        body = self._encode(content)
+        writer.write(bytes(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                           f"Connection: close\r\n\r\n", "latin-1") + body)
+        await writer.drain()
+
+    async def _stream(self, writer: asyncio.StreamWriter, headers: dict) -> None:
+        websocket = headers.get("upgrade", "").lower() == "websocket"
+
+        if websocket:
+            key = headers.get("sec-websocket-key")
+
+            if not key:
+                await self._respond(writer, "400 Bad Request",
+                                    {"error": "The WebSocket upgrade has no Sec-WebSocket-Key."})
+                return
+
+            accept = base64.b64encode(hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest())
+            writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        else:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n")
+
+        subscriber = asyncio.Queue(self.client_queue_size)
+        self.subscribers.add(subscriber)
+
+        try:
+            while True:
+                message = await subscriber.get()
+                writer.write(_websocket_frame(message) if websocket else b"data: " + message + b"\n\n")
+                await writer.drain()
+        finally:
+            self.subscribers.discard(subscriber)
+
+
+def _websocket_frame(payload: bytes) -> bytes:
+    """
+    Returns payload as an unmasked WebSocket text frame, as sent from a server.
+    """
+
+    if len(payload) < 126:
+        header = bytes((0x81, len(payload)))
+    elif len(payload) < 1 << 16:
+        header = bytes((0x81, 126)) + len(payload).to_bytes(2, "big")
+    else:
+        header = bytes((0x81, 127)) + len(payload).to_bytes(8, "big")
+
+    return header + payload
+
+
+def _json_number(value):
+    # JSON has no nan or infinity, gap markers and unknown values are sent as null
+    if value is None or math.isnan(value) or math.isinf(value):
+        return None
+
+    return value
@@ -16,22 +16,21 @@
 # SOFTWARE.
 
 from serial_communicator import asyncio, logging, SerialCommunicator, serial
+import time
 
 
 class TemperatureController(SerialCommunicator):
 
-    def __init__(self, com_port: str):
-        super().__init__(com_port, "Temperature Controller")
-        try:
-            self.ser = serial.Serial(port=com_port,
-                                     baudrate=19200,
-                                     bytesize=serial.EIGHTBITS,
-                                     timeout=1,
-                                     parity=serial.PARITY_ODD,
-                                     stopbits=serial.STOPBITS_ONE)
-        except IOError as err:
-            self.logger.error(f"Error opening serial communication with {self.name}")
-            raise err
+    def __init__(self, com_port: str, bus=None):
+        super().__init__(com_port,
+                         "Temperature Controller",
+                         bus,
+                         baudrate=19200,
+                         bytesize=serial.EIGHTBITS,
+                         timeout=1,
+                         parity=serial.PARITY_ODD,
+                         stopbits=serial.STOPBITS_ONE)
+        self._open_serial()
 
     async def verify_connection(self) -> bool:
         """
@@ -67,9 +66,12 @@ class TemperatureController(SerialCommunicator):
         """
         Requests the current temperature reading from the Temperature Controller, the reading is converted into a float
         if possible. If not or no response is given, an IOError is raised to indicate a communication breakdown
-        with the Temperature Controller.
+        with the Temperature Controller. Failed readings are retried first.
         """
 
+        return await self._with_retries(self._read_temperature)
+
+    async def _read_temperature(self) -> float:
         response = await self._send_command("G110")
 
         if len(response) == 0:
@@ -81,37 +83,50 @@ class TemperatureController(SerialCommunicator):
             self.logger.error(f"Error converting {response} from Temperature Controller to string.")
             raise IOError("Error requesting temperature from Temperature Controller. The reading was not a number.")
 
+    async def wait_until_settled(self, setpoint: float, tolerance: float, hold: float = 10.0, timeout: float = 600.0,
+                                 interval: float = 1.0) -> bool:
+        """
+        Polls the temperature every interval seconds until it has stayed within tolerance degrees Celsius of the
+        setpoint for hold seconds. Returns False if the temperature has not settled within timeout seconds. Readings
+        that fail are treated as unsettled.
+        """
+
+        started = time.monotonic()
+        settled_since = None
+
+        while True:
+            now = time.monotonic()
+
+            try:
+                within = abs(await self.get_temperature() - setpoint) <= tolerance
+            except IOError:
+                within = False
+
+            if not within:
+                settled_since = None
+            elif settled_since is None:
+                settled_since = now
+            elif now - settled_since >= hold:
+                return True
+
+            if now - started >= timeout:
+                return False
+
+            await asyncio.sleep(interval)
+
     async def reset(self) -> bool:
         """
         Puts the Temperature Controller into a neutral state where it no longer applies a set temperature. Returns
         True if the device communicates back that it has successfully reset itself, otherwise False.
         """
 
-        response = await self._send_command("WF23 8")
+        response = await self._with_retries(self._send_command, "WF23 8")
 
         return True
 
-    async def _send_command(self, command: str) -> str:
+    def _format_command(self, command: str) -> bytes:
         """
-        Locks the resource and sends ascii text to a serial port and waits until 100 bytes are read back or 1 seconds have passed. Returns
-        the bytes read from the serial port in ascii format with new line characters stripped.
+        Commands to the Temperature Controller are prefixed with the "*" recognition character.
         """
 
-
-
-        if self.ser is None:
-            raise IOError(f"Attempting to write to {self.name} which has no software serial connection.")
-        try:
-            await self.serial_lock.acquire()
-            written = bytes(str().join(["*", command, "\r\n"]), "ascii")
-            self.logger.info(f"Wrote {written} to {self.name}")
-            self.ser.write(written)
-            ret = self.ser.read(100).decode("ascii").rstrip("\n")
-            self.ser.flush()
-            self.serial_lock.release()
-            return ret
-        except BaseException as e:
-            self.ser.flush()
-            self.serial_lock.release()
-
-
+        return bytes(str().join(["*", command, "\r\n"]), "ascii")
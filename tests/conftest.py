@@ -0,0 +1,55 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import sys
+from os import path
+
+import pytest
+
+# the modules of duratest import each other by name, as they do when run from their directory
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "duratest"))
+
+
+@pytest.fixture
+def experiment_config(tmp_path):
+    """
+    Returns a function writing an experiment.json for simulated devices to tmp_path, with the given options replacing
+    those of the Power Supply and Temperature Controller and any other top level options, and returning its path.
+    """
+
+    def write(power_supply: dict = None, temperature: dict = None, **options) -> str:
+        simulation = {"latency": 0.001, "noise": 0.001, "time-scale": 3600, "reset-time": 0, "seed": 1}
+        config = {
+            "sampling-rate": 0.05,
+            "duration": 0.5,
+            "data-save-path": str(tmp_path / "data.csv"),
+            "log-save-path": str(tmp_path / "experiment.log"),
+            "Power-Supply-options": {"com-port": "COM4", "current-setpoint": 0.5, "maximum-voltage": 2.2,
+                                     "minimum-voltage": 1.5, "voltage-threshold": 1.1, "max-dV": 1,
+                                     "simulation": dict(simulation), **(power_supply or {})},
+            "Temperature-Controller-options": {"com-port": "COM5", "temperature-setpoint": 22, "max-temperature": 150,
+                                               "simulation": dict(simulation), **(temperature or {})},
+            "Pump-Controller-options": {"serial-number": "BITFT", "simulation": {}},
+            **options,
+        }
+        config_path = tmp_path / "experiment.json"
+        config_path.write_text(json.dumps(config))
+
+        return str(config_path)
+
+    return write
@@ -0,0 +1,58 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+
+import pytest
+
+from data_writer import DataWriter
+from experiment import COLUMNS
+
+ROW = (1.0, 0.5, 1.8, 22.0)
+
+
+def test_error_of_the_writer_thread_is_raised_by_the_next_write(tmp_path):
+    writer = DataWriter(str(tmp_path / "data.csv"), COLUMNS, flush_rows=1)
+
+    def unformattable(row):
+        raise ValueError(f"Unable to format {row}")
+
+    writer._encode_row = unformattable
+    writer.open()
+    writer.write_row(ROW)
+    writer.thread.join(5)
+
+    assert not writer.thread.is_alive()
+
+    with pytest.raises(IOError, match="Unable to format"):
+        writer.write_row(ROW)
+
+    # closing a writer whose thread has stopped returns at once
+    asyncio.run(writer.close())
+
+
+def test_queue_is_bounded(tmp_path):
+    writer = DataWriter(str(tmp_path / "data.csv"), COLUMNS, max_queued_rows=2)
+    writer.write_row(ROW)
+    writer.write_row(ROW)
+
+    with pytest.raises(IOError, match="2 rows are waiting"):
+        writer.write_row(ROW)
+
+    writer.open()
+    asyncio.run(writer.close())
+
+    assert (tmp_path / "data.csv").read_text().count("\n") == 3
@@ -0,0 +1,98 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+
+import pytest
+
+from bk_operator import BKOperator
+from experiment import Experiment, ExperimentError
+
+BURST = {"burst": {"points": 20, "interval": 0.0005, "at-stop": True}}
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    """
+    Records every command sent to a Power Supply, in order.
+    """
+
+    sent = []
+    send_command = BKOperator._send_command
+
+    async def record(self, command, reply_size=None):
+        sent.append(command)
+        return await send_command(self, command, reply_size)
+
+    monkeypatch.setattr(BKOperator, "_send_command", record)
+
+    return sent
+
+
+def run(experiment: Experiment, commands: list) -> list:
+    """
+    Runs the experiment and puts it at rest, returns the commands sent to the Power Supply while putting it at rest.
+    """
+
+    stopped = []
+
+    async def main():
+        try:
+            await experiment.run_experiment()
+        finally:
+            stopped.append(len(commands))
+            await experiment.stop_experiment()
+
+    try:
+        asyncio.run(main())
+    except ExperimentError:
+        pass
+
+    return commands[stopped[0]:]
+
+
+def test_breached_limit_switches_off_without_capture(experiment_config, commands):
+    experiment = Experiment(experiment_config(BURST, {"max-temperature": 10}), "breach")
+
+    stop_commands = run(experiment, commands)
+
+    assert not experiment.completed
+    assert stop_commands[0] == "outp 0"
+    assert not any(command.startswith(("acq", "fetc")) for command in stop_commands)
+
+
+def test_completed_run_captures_after_switching_off(experiment_config, commands):
+    experiment = Experiment(experiment_config(BURST), "completed")
+
+    stop_commands = run(experiment, commands)
+
+    assert experiment.completed
+    assert stop_commands[0] == "outp 0"
+    assert stop_commands[1].startswith("acq")
+
+
+def test_default_max_age_outlasts_a_read_with_retries(experiment_config):
+    channels = {"power-supply": {"interval": 0.1}, "temperature": {"interval": 1, "max-age": 10}}
+    experiment = Experiment(experiment_config(channels=channels), "channels")
+    experiment.bk_operator = experiment._get_new_BK(experiment.bk_options)
+    experiment.temp_controller = experiment._get_new_TemperatureController(experiment.temperature_options)
+
+    experiment._get_channel_pollers()
+
+    # three intervals, then a 1 s port timeout for each of the 3 attempts and 0.1 s + 0.2 s of backoff
+    assert experiment.channel_max_age["Current"] == pytest.approx(0.3 + 3 + 0.3)
+    assert experiment.channel_max_age["Voltage"] == experiment.channel_max_age["Current"]
+    assert experiment.channel_max_age["Temperature"] == 10
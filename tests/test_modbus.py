@@ -0,0 +1,133 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import struct
+
+import pytest
+
+from modbus_temperature_controller import (check_frame, frame, ModbusTemperatureController, READ_HOLDING_REGISTERS,
+                                           WRITE_MULTIPLE_REGISTERS)
+from simulated_devices import SimulatedModbusSlave, SimulatedModbusTemperatureController, SimulationOptions
+
+
+@pytest.fixture
+def controller():
+    # failed requests are not retried, so every faulty reply surfaces
+    controller = SimulatedModbusTemperatureController({"latency": 0, "time-scale": 3600}, address=3)
+    controller.retries = 0
+
+    return controller
+
+
+def answer_with(controller, reply) -> None:
+    # replaces the answer of the slave to every request with reply(request)
+    controller.ser.model.respond = reply
+
+
+def test_reads_and_writes_the_slave(controller):
+    async def run():
+        assert await controller.verify_connection()
+        assert await controller.set_temperature(40.5)
+
+        return await controller.get_status()
+
+    temperature, setpoint, output = asyncio.run(run())
+
+    assert setpoint == 40.5
+    assert controller.model.controller.running
+    assert 0 <= output <= 100
+
+
+def test_crc_errors_raise(controller):
+    def corrupted(request):
+        reply = bytearray(controller.model.respond(request))
+        reply[3] ^= 0xFF
+        return bytes(reply)
+
+    answer_with(controller, corrupted)
+
+    with pytest.raises(IOError, match="CRC"):
+        asyncio.run(controller.get_status())
+
+
+def test_crc_errors_are_retried(controller):
+    replies = []
+
+    def corrupted_once(request):
+        reply = bytearray(controller.model.respond(request))
+
+        if not replies:
+            reply[-1] ^= 0xFF
+
+        replies.append(reply)
+        return bytes(reply)
+
+    controller.retries = 1
+    controller.backoff = 0
+    answer_with(controller, corrupted_once)
+
+    assert asyncio.run(controller.get_status())[0] == controller.model.controller.temperature
+    assert controller.health.recoveries == 1
+
+
+def test_exception_replies_raise(controller):
+    def illegal_address(request):
+        return controller.model._exception(request[1], 2)
+
+    answer_with(controller, illegal_address)
+
+    with pytest.raises(IOError, match="exception 2"):
+        asyncio.run(controller.get_status())
+
+    with pytest.raises(IOError, match="exception 2"):
+        asyncio.run(controller._write_register(controller.standby_frame, "standby"))
+
+
+def test_the_slave_rejects_unknown_registers():
+    slave = SimulatedModbusSlave(SimulationOptions({}), address=1)
+    reply = slave.respond(frame(1, READ_HOLDING_REGISTERS, struct.pack(">HH", 0x1000, 2)))
+
+    with pytest.raises(IOError, match="exception 2"):
+        check_frame(reply, 1, READ_HOLDING_REGISTERS)
+
+    # requests to other slaves and with a bad CRC are not answered
+    assert slave.respond(frame(2, READ_HOLDING_REGISTERS, struct.pack(">HH", 0x0280, 6))) is None
+    assert slave.respond(frame(1, READ_HOLDING_REGISTERS, struct.pack(">HH", 0x0280, 6))[:-1] + b"\0") is None
+
+
+def test_replies_from_other_slaves_raise(controller):
+    other = SimulatedModbusSlave(controller.simulation, address=4)
+
+    def late_reply_of_other_slave(request):
+        # the same request, answered by the slave at address 4
+        return other.respond(frame(4, request[1], request[2:-2]))
+
+    answer_with(controller, late_reply_of_other_slave)
+
+    with pytest.raises(IOError, match="from slave 4, not 3"):
+        asyncio.run(controller.get_status())
+
+
+def test_replies_to_other_functions_raise(controller):
+    def write_acknowledgement(request):
+        return frame(3, WRITE_MULTIPLE_REGISTERS, struct.pack(">HH", ModbusTemperatureController.SETPOINT_REGISTER, 2))
+
+    answer_with(controller, write_acknowledgement)
+
+    with pytest.raises(IOError, match="to function 16, not 3"):
+        asyncio.run(controller.get_status())
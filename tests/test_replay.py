@@ -0,0 +1,154 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import json
+import math
+
+import numpy as np
+import pytest
+
+from experiment import COLUMNS, Experiment, ExperimentError
+from limits import compile_limits
+from replay import check_limits, read_series, replay_limits
+
+OPTIONS = {"Power-Supply-options": {"max-dV": 0.05, "voltage-threshold": 1.1, "minimum-voltage": 1.6},
+           "Temperature-Controller-options": {"max-temperature": 23}}
+
+
+def live_stop(experiment: Experiment, rows: np.ndarray) -> dict:
+    # feeds the rows to the limit check of the experiment, skipping gap rows as the experiment never checks them, with
+    # limits built as the experiment builds them, which have not seen a sample yet
+    experiment.limits = compile_limits(experiment.bk_options, experiment.temperature_options)
+
+    for sample, (timestamp, *readings) in enumerate(row for row in rows.tolist() if not math.isnan(row[1])):
+        try:
+            experiment._throw_on_bad_readings(tuple(readings))
+        except ExperimentError as err:
+            return {"sample": sample, "time": timestamp, "reason": err.message}
+
+    return {"sample": None, "time": None, "reason": None}
+
+
+def chunks(rows: np.ndarray, size: int):
+    return [(COLUMNS, rows[start:start + size]) for start in range(0, len(rows), size)]
+
+
+def rows_of(voltages, temperatures=None) -> np.ndarray:
+    voltages = np.asarray(voltages, dtype=float)
+    temperatures = np.full(len(voltages), 22.0) if temperatures is None else np.asarray(temperatures, dtype=float)
+
+    return np.column_stack((np.arange(len(voltages)) * 0.5, np.full(len(voltages), 0.5), voltages, temperatures))
+
+
+@pytest.fixture
+def experiment(experiment_config):
+    config_path = experiment_config(OPTIONS["Power-Supply-options"], OPTIONS["Temperature-Controller-options"])
+    return Experiment(config_path, "replay")
+
+
+def assert_same_stop(experiment: Experiment, rows: np.ndarray, chunk_size: int = 4) -> dict:
+    expected = live_stop(experiment, rows)
+    result = replay_limits(chunks(rows, chunk_size), OPTIONS)[0]
+
+    assert {key: result[key] for key in expected} == expected
+    return expected
+
+
+def test_first_sample_sets_the_voltage_threshold(experiment):
+    # 1.7 * 1.1 = 1.87, so 1.86 passes and 1.9 stops the experiment
+    stop = assert_same_stop(experiment, rows_of([1.7, 1.74, 1.78, 1.82, 1.86, 1.9]))
+
+    assert stop["sample"] == 5
+    assert stop["reason"] == compile_limits(*OPTIONS.values()).rules[1].message
+
+
+def test_first_sample_can_stop_the_experiment(experiment):
+    stop = assert_same_stop(experiment, rows_of([1.5, 1.7]))
+
+    assert stop["sample"] == 0
+
+
+def test_max_dv_across_chunk_boundaries(experiment):
+    voltages = [1.7, 1.72, 1.74, 1.76, 1.82, 1.84]
+
+    for chunk_size in range(1, len(voltages) + 1):
+        assert assert_same_stop(experiment, rows_of(voltages), chunk_size)["sample"] == 4
+
+
+def test_max_dv_is_measured_across_gaps(experiment):
+    rows = rows_of([1.7, 1.72, 1.9, 1.9, 1.76, 1.82])
+    rows[2:4, 1:] = math.nan
+
+    # the change from 1.72 to 1.76 is checked, as the gap rows were never samples
+    stop = assert_same_stop(experiment, rows, 2)
+
+    assert stop["sample"] == 3
+    assert stop["time"] == rows[5, 0]
+
+
+def test_ties_go_to_the_first_rule(experiment):
+    # breaches max-dV and the maximum temperature in the same sample
+    stop = assert_same_stop(experiment, rows_of([1.7, 1.8], [22, 24]))
+
+    assert stop["reason"] == compile_limits(*OPTIONS.values()).rules[0].message
+
+
+def test_random_runs_over_a_grid(experiment_config):
+    generator = np.random.default_rng(0)
+    grid = {"max-dV": [0.02, 0.05, 0.1], "voltage-threshold": [1.02, 1.1], "minimum-voltage": [1.5, 1.6],
+            "max-temperature": [22.5, 23]}
+
+    for _ in range(20):
+        count = int(generator.integers(1, 200))
+        # rounded, so readings land exactly on the limits
+        rows = rows_of(np.round(1.7 + np.cumsum(generator.normal(0, 0.02, count)), 2),
+                       np.round(22 + np.cumsum(generator.normal(0, 0.1, count)), 1))
+        rows[generator.integers(0, count, 2), 1:] = math.nan
+        results = replay_limits(chunks(rows, int(generator.integers(1, 50))), OPTIONS, grid)
+
+        for result in results:
+            options = {"Power-Supply-options": {key: result[key] for key in OPTIONS["Power-Supply-options"]},
+                       "Temperature-Controller-options": {"max-temperature": result["max-temperature"]}}
+            experiment = Experiment(experiment_config(**options), "replay")
+
+            expected = live_stop(experiment, rows)
+
+            assert {key: result[key] for key in expected} == expected
+            assert check_limits(chunks(rows, 7), options) == expected
+
+
+def test_burst_rows_are_not_replayed(experiment_config, tmp_path):
+    burst = {"points": 50, "interval": 0.0005, "at-stop": True}
+    config_path = experiment_config({"burst": burst})
+    experiment = Experiment(config_path, "burst")
+
+    async def run():
+        try:
+            await experiment.run_experiment()
+        finally:
+            await experiment.stop_experiment()
+
+    asyncio.run(run())
+
+    # the bursts hold the 0 V readings around the current steps, which would breach the minimum voltage
+    assert len(np.loadtxt(tmp_path / "data.burst.csv", delimiter=",", skiprows=1)) == 2 * burst["points"]
+
+    with open(config_path) as f:
+        options = json.load(f)
+
+    assert replay_limits(read_series(str(tmp_path / "data.csv")), options)[0]["reason"] is None
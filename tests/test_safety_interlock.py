@@ -0,0 +1,55 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+
+from instrumentation import Instrumentation
+from limits import compile_limits
+from safety_interlock import SafetyInterlock
+from serial_communicator import SerialCommunicator
+
+BK_OPTIONS = {"max-dV": 0.05, "voltage-threshold": 1.1, "minimum-voltage": 1.6}
+TEMPERATURE_OPTIONS = {"max-temperature": 23}
+
+
+def test_polls_once_and_trips_before_returning():
+    device = SerialCommunicator("COM1", "Device")
+    readings = [IOError("no reply"), (0.5, 1.8, 22.0), (0.5, 1.8, 30.0)]
+    events = []
+
+    async def read_once():
+        events.append("read")
+        reading = readings.pop(0)
+
+        if isinstance(reading, Exception):
+            raise reading
+
+        return reading
+
+    async def read():
+        return await device._with_retries(read_once)
+
+    async def trip():
+        events.append("trip")
+
+    metrics = Instrumentation()
+    interlock = SafetyInterlock(read, compile_limits(BK_OPTIONS, TEMPERATURE_OPTIONS), 0.001, trip, metrics=metrics)
+    message = asyncio.run(interlock.run())
+
+    # the failed poll was not retried by the device, and the current was switched off before the interlock returned
+    assert events == ["read", "read", "read", "trip"]
+    assert "temperature" in message.lower()
+    assert metrics.latencies["Safety interlock reaction"].count == 1
@@ -0,0 +1,89 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+
+import pytest
+
+import sampling_scheduler
+from sampling_scheduler import SamplingScheduler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the monotonic clock with one that only advances when the scheduler sleeps.
+    """
+
+    now = [100.0]
+
+    async def sleep(delay):
+        now[0] += delay
+
+    monkeypatch.setattr(sampling_scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(sampling_scheduler.asyncio, "sleep", sleep)
+
+    return now
+
+
+def collect(scheduler, on_tick=None):
+    async def run():
+        times = []
+
+        async for tick in scheduler.ticks():
+            times.append(tick)
+
+            if on_tick:
+                on_tick(len(times))
+
+        return times
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("duration, period, count", [(2, 0.2, 10), (3, 0.2, 15), (1, 0.1, 10)])
+def test_tick_count(clock, duration, period, count):
+    times = collect(SamplingScheduler(period, duration))
+
+    assert len(times) == count
+    assert times == pytest.approx([n * period for n in range(count)])
+
+
+def test_period_change_restarts_deadlines(clock):
+    scheduler = SamplingScheduler(0.1, 2)
+
+    def on_tick(n):
+        if n == 5:
+            scheduler.period = 0.3
+
+    times = collect(scheduler, on_tick)
+
+    assert times == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4] + [0.4 + n * 0.3 for n in range(1, 6)])
+
+
+def test_overrun_skips_deadlines(clock):
+    scheduler = SamplingScheduler(0.2, 2)
+
+    def on_tick(n):
+        if n == 3:
+            clock[0] += 0.5
+
+    times = collect(scheduler, on_tick)
+
+    assert times == pytest.approx([0.0, 0.2, 0.4, 1.0, 1.2, 1.4, 1.6, 1.8])
+    assert scheduler.stats()["missed-ticks"] == 2
+    assert scheduler.stats()["overruns"] == 1
@@ -0,0 +1,65 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import json
+import time
+
+from experiment import COLUMNS
+from segmented_recording import _read_rows, read_range, SegmentedDataWriter
+
+HEADER = ", ".join(COLUMNS) + "\n"
+
+
+def test_rows_cut_short_are_skipped(tmp_path):
+    path = tmp_path / "data.20261017.csv"
+    path.write_text(HEADER + "1.0, 0.5, 1.8, 22.0\n" + "2.0, 0.5,\n" + "2.5, 0.5, 1.8\n" + HEADER +
+                    "3.0, 0.5, 1.9, 22.5\n" + "4.0, 0.5, 1.9, 2\n")
+
+    assert list(_read_rows(str(path))) == [(1.0, 0.5, 1.8, 22.0), (3.0, 0.5, 1.9, 22.5), (4.0, 0.5, 1.9, 2.0)]
+
+
+def test_resumed_segment_skips_the_row_cut_short(tmp_path):
+    save_path = str(tmp_path / "data.csv")
+    now = time.time()
+
+    def record(rows: list) -> None:
+        writer = SegmentedDataWriter(save_path, COLUMNS, compression=None)
+        writer.open()
+
+        for row in rows:
+            writer.write_row(row)
+
+        asyncio.run(writer.close())
+
+    record([(now, 0.5, 1.8, 22.0), (now + 1, 0.5, 1.7, 23.0)])
+
+    # as left behind by a run that stopped without closing the segment, with a row cut short after a comma
+    manifest_path = tmp_path / "data.manifest.json"
+    manifest = json.loads(manifest_path.read_text())
+    segment = manifest["segments"][0]
+    segment["closed"] = False
+    manifest_path.write_text(json.dumps(manifest))
+
+    with open(tmp_path / segment["file"], "a") as f:
+        f.write(f"{now + 2}, 0.5, 1\n")
+
+    record([(now + 3, 0.5, 1.9, 21.0)])
+    segment = json.loads(manifest_path.read_text())["segments"][0]
+
+    assert segment["rows"] == 3
+    assert segment["min"] == {"Current": 0.5, "Voltage": 1.7, "Temperature": 21.0}
+    assert [row[0] for row in read_range(str(manifest_path))] == [now, now + 1, now + 3]
@@ -0,0 +1,71 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+
+import pytest
+
+import serial_bus
+from experiment import Experiment
+from serial_bus import shared_bus
+from serial_communicator import SerialConnectionError
+from simulated_devices import SimulatedModbusTemperatureController
+
+SIMULATION = {"latency": 0, "time-scale": 3600}
+
+
+def test_last_device_to_leave_closes_the_bus():
+    bus = shared_bus("COM7")
+    first = SimulatedModbusTemperatureController(SIMULATION, 1, bus)
+    second = SimulatedModbusTemperatureController(SIMULATION, 2, bus)
+    port = bus.ser
+
+    first.close()
+
+    assert serial_bus.buses["COM7"] is bus
+    assert port.is_open
+    assert asyncio.run(second.get_status())
+
+    second.close()
+
+    assert "COM7" not in serial_bus.buses
+    assert not port.is_open
+
+    with pytest.raises(SerialConnectionError):
+        asyncio.run(bus.submit(second, second.get_status))
+
+    # the address is free again on a new bus
+    third = SimulatedModbusTemperatureController(SIMULATION, 1, shared_bus("COM7"))
+    assert asyncio.run(third.get_status())
+    third.close()
+
+
+def test_station_runs_again_on_its_shared_bus(experiment_config):
+    config_path = experiment_config(temperature={"com-port": "COM8", "protocol": "modbus", "shared-bus": True,
+                                                 "modbus-address": 4})
+
+    async def run(experiment: Experiment):
+        try:
+            await experiment.run_experiment()
+        finally:
+            await experiment.stop_experiment()
+
+    for run_number in range(2):
+        experiment = Experiment(config_path, f"run-{run_number}")
+        asyncio.run(run(experiment))
+
+        assert experiment.completed
+        assert "COM8" not in serial_bus.buses
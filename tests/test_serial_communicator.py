@@ -0,0 +1,118 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import os
+
+import pytest
+
+from serial_communicator import SerialCommunicator
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="pseudo-terminals and add_reader need POSIX")
+
+
+@pytest.fixture
+def pty_device():
+    """
+    Returns a device on the slave end of a pseudo-terminal, opened with pyserial like a real port, and the master end,
+    which plays the device.
+    """
+
+    master, slave = os.openpty()
+    device = SerialCommunicator(os.ttyname(slave), "Device", baudrate=9600, timeout=1)
+    device._open_serial()
+
+    yield device, master
+
+    device.close()
+    os.close(slave)
+    os.close(master)
+
+
+async def answer(master: int, parts: list, delay: float) -> bytes:
+    """
+    Waits for a command on the master end, then answers it in parts, delay seconds apart.
+    """
+
+    loop = asyncio.get_running_loop()
+    command = bytearray()
+
+    while not command.endswith(b"\r\n"):
+        readable = loop.create_future()
+        loop.add_reader(master, readable.set_result, None)
+
+        try:
+            await readable
+        finally:
+            loop.remove_reader(master)
+
+        command.extend(os.read(master, 100))
+
+    for part in parts:
+        await asyncio.sleep(delay)
+        os.write(master, part)
+
+    return bytes(command)
+
+
+def test_reply_split_across_reads_is_assembled(pty_device):
+    device, master = pty_device
+
+    async def run():
+        # the reply is read by the event loop watching the port, not by a blocking read in the executor
+        assert device._reader_fd() is not None
+
+        device_side = asyncio.create_task(answer(master, [b"12", b".5", b"\r\n"], 0.05))
+        reply = await device._send_command("meas:curr?")
+
+        return reply, await device_side
+
+    reply, command = asyncio.run(run())
+
+    assert reply == "12.5"
+    assert command == b"meas:curr?\r\n"
+
+
+def test_event_loop_runs_while_the_reply_is_read(pty_device):
+    device, master = pty_device
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(asyncio.get_running_loop().time())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        device_side = asyncio.create_task(answer(master, [b"1", b"\r\n"], 0.2))
+        ticking = asyncio.create_task(ticker())
+
+        try:
+            return await device._send_command("*OPC?")
+        finally:
+            ticking.cancel()
+            await device_side
+
+    assert asyncio.run(run()) == "1"
+    # the 0.4 s the reply took were spent running other tasks
+    assert len(ticks) >= 20
+    assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.1
+
+
+def test_missing_reply_times_out(pty_device):
+    device, master = pty_device
+    device.ser.timeout = 0.1
+
+    assert asyncio.run(device._send_command("*IDN?")) == ""
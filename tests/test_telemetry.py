@@ -0,0 +1,80 @@
+# Copyright (c) 2021 Admiral Instruments
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import json
+
+from telemetry import TelemetryServer
+
+COLUMNS = ("Timestamp", "Current", "Voltage", "Temperature")
+
+
+async def request(server: TelemetryServer, headers: str) -> bytes:
+    reader, writer = await asyncio.open_connection(server.host, server.server.sockets[0].getsockname()[1])
+    writer.write(bytes(f"GET /stream HTTP/1.1\r\n{headers}\r\n", "latin-1"))
+    await writer.drain()
+
+    try:
+        return await asyncio.wait_for(reader.read(), 5)
+    finally:
+        writer.close()
+
+
+def test_websocket_upgrade_without_key_is_rejected():
+    server = TelemetryServer(COLUMNS, port=0)
+
+    async def run():
+        await server.start()
+
+        try:
+            reply = await request(server, "Upgrade: websocket\r\nConnection: Upgrade\r\n")
+            clients = len(server.clients)
+        finally:
+            await server.stop()
+
+        return reply, clients
+
+    reply, clients = asyncio.run(run())
+    status, _, body = reply.partition(b"\r\n\r\n")
+
+    assert status.startswith(b"HTTP/1.1 400 Bad Request")
+    assert "Sec-WebSocket-Key" in json.loads(body)["error"]
+    assert clients == 0
+
+
+def test_stream_is_disconnected_on_stop():
+    server = TelemetryServer(COLUMNS, port=0)
+
+    async def run():
+        await server.start()
+        stream = asyncio.create_task(request(server, ""))
+
+        while not server.subscribers:
+            await asyncio.sleep(0.01)
+
+        server.publish((1.0, 0.5, 1.8, 22.0))
+
+        while any(not subscriber.empty() for subscriber in server.subscribers):
+            await asyncio.sleep(0.01)
+
+        await server.stop()
+
+        return await stream
+
+    reply = asyncio.run(asyncio.wait_for(run(), 10))
+
+    assert reply.startswith(b"HTTP/1.1 200 OK")
+    assert b"data: " in reply